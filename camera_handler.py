@@ -1,5 +1,6 @@
 
 import cv2
+import numpy as np
 import time
 import piexif
 from fractions import Fraction
@@ -10,11 +11,22 @@ from picamera2 import Picamera2, Preview
 from picamera2.encoders import H264Encoder, Quality
 from picamera2.outputs import FileOutput
 from libcamera import controls
-from threading import Thread, Event
+from threading import Thread, Event, Lock
 import sys
 import traceback
 
 
+def is_complete_jpeg(buf):
+    """True if a raw frame buffer is one whole JPEG: starts with SOI and ends with EOI (UVC padding ignored)."""
+    data = buf.reshape(-1) if isinstance(buf, np.ndarray) else np.frombuffer(buf, dtype=np.uint8)
+    if data.size < 4 or data[0] != 0xFF or data[1] != 0xD8:
+        return False
+    end = data.size
+    # Some UVC drivers pad the payload with zeros after the EOI marker
+    while end > 2 and data[end - 1] == 0x00 and end > data.size - 1024:
+        end -= 1
+    return data[end - 2] == 0xFF and data[end - 1] == 0xD9
+
 
 class CameraBase:
     def __init__(self, path, friendly_name):
@@ -25,6 +37,86 @@ class CameraBase:
         self.is_running = False
         self.ready_event = Event()
         self.preferred_resolution = None # Stores the user-desired resolution (ignoring OOM caps)
+        # Active frame consumers (streams, pending captures). Capture loops idle when there are none.
+        self._consumers = {}
+        self._consumer_lock = Lock()
+        self.consumer_event = Event()
+        self.frame_event = Event() # Set by capture loops whenever a new frame is stored
+        self._warmup_started = None
+        self.last_warmup_s = None
+        # Still-capture arbitration: a still capture owns the device while preview producers
+        # hold their last frame instead of calling into a stopped/reconfiguring camera
+        self._device_lock = Lock()
+        self.preview_paused = Event()
+        self._pause_started = None
+        self.pause_count = 0
+        self.last_pause_s = None
+        self.max_pause_s = 0.0
+        self.total_pause_s = 0.0
+
+    def _pause_preview(self):
+        self._pause_started = time.time()
+        self.preview_paused.set()
+
+    def _resume_preview(self):
+        if not self.preview_paused.is_set():
+            return
+        duration = time.time() - self._pause_started
+        self.preview_paused.clear()
+        self._pause_started = None
+        self.pause_count += 1
+        self.last_pause_s = round(duration, 3)
+        self.max_pause_s = max(self.max_pause_s, self.last_pause_s)
+        self.total_pause_s = round(self.total_pause_s + duration, 3)
+        print(f"[{self.__class__.__name__} {self.path}] Preview paused for {duration:.3f}s during still capture.", file=sys.stderr)
+
+    def acquire(self, consumer, kind="stream"):
+        """Registers an active frame consumer. The first consumer wakes an idle capture loop."""
+        with self._consumer_lock:
+            if not self._consumers:
+                self._warmup_started = time.time()
+                self.consumer_event.set()
+            self._consumers[consumer] = kind
+
+    def release(self, consumer):
+        """Unregisters a frame consumer. Safe to call for unknown consumers."""
+        with self._consumer_lock:
+            self._consumers.pop(consumer, None)
+            if not self._consumers:
+                self.consumer_event.clear()
+                self._warmup_started = None
+
+    def has_consumers(self):
+        return bool(self._consumers)
+
+    def _mark_warm(self):
+        """Called by capture loops when a fresh frame is available; records the warm-up time."""
+        started = self._warmup_started
+        if started is not None:
+            self._warmup_started = None
+            self.last_warmup_s = round(time.time() - started, 3)
+            print(f"[{self.__class__.__name__} {self.path}] Warm-up to full rate took {self.last_warmup_s:.3f}s", file=sys.stderr)
+
+    def get_status(self):
+        """Returns runtime information about the camera for the status API."""
+        with self._consumer_lock:
+            consumers = list(self._consumers.values())
+        return {
+            "friendly_name": self.friendly_name,
+            "type": self.__class__.__name__,
+            "is_running": self.is_running,
+            "consumers": len(consumers),
+            "consumer_kinds": sorted(set(consumers)),
+            "idle": self.is_running and not consumers,
+            "last_warmup_s": self.last_warmup_s,
+            "preview_paused": self.preview_paused.is_set(),
+            "preview_pauses": {
+                "count": self.pause_count,
+                "last_s": self.last_pause_s,
+                "max_s": self.max_pause_s,
+                "total_s": self.total_pause_s
+            }
+        }
 
     def start(self):
         self.is_running = True
@@ -42,6 +134,10 @@ class CameraBase:
         """Stops the camera and releases any resources."""
         self.stop()
 
+    def suspend(self):
+        """Stops the camera to free its resources while keeping settings for a later start()."""
+        self.stop()
+
     def get_frame(self):
         return self.frame
 
@@ -102,11 +198,29 @@ class CameraBase:
 
 class USBCamera(CameraBase):
     """Handler for USB webcams using OpenCV."""
-    def __init__(self, path, friendly_name):
+    IDLE_GRAB_INTERVAL = 0.5 # Seconds between grab() calls while nobody consumes frames
+    WARMUP_TIMEOUT = 2.0 # Upper bound for waiting on a fresh frame after a consumer subscribes
+
+    def __init__(self, path, friendly_name, mjpeg_passthrough=True):
         super().__init__(path, friendly_name)
         self.cap = None
         self.width = 1280
         self.height = 720
+        # MJPEG passthrough: keep the compressed payload from the camera and only decode on demand
+        self.mjpeg_passthrough = mjpeg_passthrough
+        self._passthrough_active = False
+        self.jpeg = None # Latest compressed frame (bytes) when passthrough is active
+        self.frame_seq = 0 # Incremented for every new frame
+        self._decoded_seq = -1
+
+    def get_frame(self):
+        return self.capture_array()
+
+    def get_jpeg(self):
+        """Returns the latest compressed MJPEG frame, or None if passthrough is not active."""
+        if not self._passthrough_active:
+            return None
+        return self.jpeg
 
     def set_resolution(self, width, height):
         # No need to change if resolution is the same and it's running
@@ -143,15 +257,55 @@ class USBCamera(CameraBase):
         """Captures current frame to file using OpenCV."""
         # USB Camera resolution switching is handled by set_resolution beforehand for now
         # implementing transient switch for USB is harder due to warmup time
-        if self.frame is None:
-            raise RuntimeError("No frame available from USB camera")
-        success = cv2.imwrite(filepath, self.frame)
-        if not success:
-             raise RuntimeError(f"Failed to write image to {filepath}")
-        return filepath
+        # A pending capture is a consumer: wake the loop and wait for a frame grabbed after this point
+        consumer = object()
+        self.acquire(consumer, kind="capture")
+        try:
+            if not self.wait_for_fresh_frame(self.WARMUP_TIMEOUT):
+                print(f"[USBCamera {self.path}] Warning: No fresh frame within {self.WARMUP_TIMEOUT}s. Using last frame.", file=sys.stderr)
+
+            jpeg = self.get_jpeg()
+            if jpeg is not None:
+                # Passthrough: write the camera's JPEG as-is (no decode, no re-encode)
+                with open(filepath, 'wb') as f:
+                    f.write(jpeg)
+                return filepath
+
+            if self.frame is None:
+                raise RuntimeError("No frame available from USB camera")
+            success = cv2.imwrite(filepath, self.frame)
+            if not success:
+                 raise RuntimeError(f"Failed to write image to {filepath}")
+            return filepath
+        finally:
+            self.release(consumer)
+
+    def wait_for_fresh_frame(self, timeout):
+        """Blocks until a frame newer than the current one is stored. Returns False on timeout."""
+        if not self.is_running:
+            return False
+        seq = self.frame_seq
+        deadline = time.time() + timeout
+        while self.frame_seq == seq:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+            self.frame_event.clear()
+            if self.frame_seq != seq:
+                break
+            self.frame_event.wait(min(remaining, 0.1))
+        return True
 
     def capture_array(self):
-        """Returns the latest captured frame (BGR)."""
+        """Returns the latest captured frame (BGR). In passthrough mode the JPEG is decoded on demand."""
+        if self._passthrough_active:
+            seq = self.frame_seq
+            jpeg = self.jpeg
+            if jpeg is not None and seq != self._decoded_seq:
+                decoded = cv2.imdecode(np.frombuffer(jpeg, dtype=np.uint8), cv2.IMREAD_COLOR)
+                if decoded is not None:
+                    self.frame = decoded
+                    self._decoded_seq = seq
         return self.frame
 
     def _capture_loop(self):
@@ -167,6 +321,12 @@ class USBCamera(CameraBase):
             fourcc = cv2.VideoWriter_fourcc(*'MJPG')
             self.cap.set(cv2.CAP_PROP_FOURCC, fourcc)
 
+            # Ask OpenCV to hand back the raw MJPEG buffer instead of decoding to BGR
+            self._passthrough_active = False
+            self.jpeg = None
+            if self.mjpeg_passthrough:
+                self.cap.set(cv2.CAP_PROP_CONVERT_RGB, 0)
+
             # Set the resolution
             self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, self.width)
             self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, self.height)
@@ -190,13 +350,55 @@ class USBCamera(CameraBase):
             self.is_running = False
             return
 
+        passthrough_checked = not self.mjpeg_passthrough
+        was_idle = False
         while self.is_running:
+            if not self.has_consumers():
+                # Nobody is watching: keep the device streaming with grab() only (no retrieve/decode)
+                if not was_idle:
+                    print(f"[USBCamera {self.path}] No consumers. Dropping to idle grab rate.", file=sys.stderr)
+                    was_idle = True
+                self.cap.grab()
+                self.consumer_event.wait(timeout=self.IDLE_GRAB_INTERVAL)
+                continue
+
+            if was_idle:
+                # Flush frames that queued up in the driver while idle so the next read is fresh
+                was_idle = False
+                buffered = int(self.cap.get(cv2.CAP_PROP_BUFFERSIZE) or 0)
+                flush_deadline = time.time() + self.WARMUP_TIMEOUT
+                for _ in range(max(0, min(buffered, 8))):
+                    if time.time() > flush_deadline:
+                        break
+                    self.cap.grab()
+
             ret, frame = self.cap.read()
             if not ret:
                 print(f"[USBCamera {self.path}] Failed to capture frame.", file=sys.stderr)
                 time.sleep(0.1)
                 continue
-            self.frame = frame
+
+            if not passthrough_checked:
+                # Verify the backend really returned a compressed JPEG buffer (1-D, SOI ... EOI)
+                passthrough_checked = True
+                if frame.ndim <= 2 and is_complete_jpeg(frame):
+                    self._passthrough_active = True
+                    print(f"[USBCamera {self.path}] MJPEG passthrough active.", file=sys.stderr)
+                else:
+                    print(f"[USBCamera {self.path}] MJPEG passthrough not supported by backend. Falling back to decoded frames.", file=sys.stderr)
+                    self.cap.set(cv2.CAP_PROP_CONVERT_RGB, 1)
+                    continue # This frame may still be the raw buffer; wait for a decoded one
+
+            if self._passthrough_active:
+                if not is_complete_jpeg(frame):
+                    # Truncated payload (USB bandwidth drop); never stream or save a broken JPEG
+                    continue
+                self.jpeg = frame.tobytes()
+            else:
+                self.frame = frame
+            self.frame_seq += 1
+            self.frame_event.set()
+            self._mark_warm()
             time.sleep(0.01)
         
         print(f"[USBCamera {self.path}] _capture_loop stopped.", file=sys.stderr)
@@ -246,6 +448,11 @@ class PiCamera(CameraBase):
                 print(f"[PiCamera {self.camera_id}] Adjusting preview from {preview_width}x{preview_height} to {new_width}x{preview_height} to match AR of {pref_w}x{pref_h}", file=sys.stderr)
                 preview_width = new_width
 
+        # Re-open the device if it was released by suspend()
+        if self.picam2 is None:
+            print(f"[PiCamera {self.camera_id}] Re-opening camera after suspend.", file=sys.stderr)
+            self.picam2 = Picamera2(self.camera_id)
+
         # Defensive stop: Ensure libcamera state is clean before configuring
         try:
             if self.picam2:
@@ -258,6 +465,7 @@ class PiCamera(CameraBase):
         self.picam2.start()
         self.picam2.set_overlay(None)
         self.is_running = True
+        self.ready_event.set()
         self._has_autofocus = "AfMode" in self.picam2.camera_controls
         # Apply initial control settings
         if self._has_autofocus:
@@ -276,9 +484,22 @@ class PiCamera(CameraBase):
     def close(self):
         """Stops and closes the camera, releasing all resources."""
         print(f"[PiCamera {self.camera_id}] Closing camera.", file=sys.stderr)
-        self.picam2.close()
+        if self.picam2:
+            self.picam2.close()
         self.is_running = False
 
+    def suspend(self):
+        """
+        Stops and closes the camera so libcamera frees its CMA buffers.
+        Resolution, exposure and focus settings stay on this object and are
+        re-applied by start().
+        """
+        print(f"[PiCamera {self.camera_id}] Suspending camera.", file=sys.stderr)
+        self.stop()
+        if self.picam2:
+            self.picam2.close()
+            self.picam2 = None
+
     def set_resolution(self, width, height):
         if self.width == width and self.height == height:
             return
@@ -371,12 +592,25 @@ class PiCamera(CameraBase):
         Captures directly to file using Picamera2's efficient encoder.
         If width/height are provided, temporarily reconfigures the camera for a still capture
         without changing the persistent video stream configuration (to avoid OOM on Pi Zero).
+        Returns the metadata of the saved frame (exposure, gain, sensor timestamp, ...).
         """
         if not self.is_running:
              # If not running, we must start it (or just run a oneshot?)
              # For simplicity, assume caller expects it running? Actually, we can handle it.
              raise RuntimeError("Camera not running")
-        
+
+        # The still capture owns the device: waits for an in-flight preview frame, then
+        # keeps preview producers on their last frame until the video mode is restored
+        consumer = object()
+        self.acquire(consumer, kind="capture")
+        try:
+            with self._device_lock:
+                return self._capture_to_file_locked(filepath, width, height)
+        finally:
+            self._resume_preview()
+            self.release(consumer)
+
+    def _capture_to_file_locked(self, filepath, width, height):
         reconfigured = False
         original_width = self.width
         original_height = self.height
@@ -384,6 +618,7 @@ class PiCamera(CameraBase):
         # Check if we need to switch resolution for this capture
         if width and height and (width != self.width or height != self.height):
             print(f"[PiCamera] Switching to Still Mode: {width}x{height} (current is {self.width}x{self.height})", file=sys.stderr)
+            self._pause_preview()
             self.stop() # Release video buffers!
             
             # Create a STILL configuration (usually uses fewer buffers than video)
@@ -401,11 +636,11 @@ class PiCamera(CameraBase):
             filepath = str(filepath)
             
             # We use capture_file which streams directly to disk via encoder
-            # This avoids loading the raw array into Python memory
-            self.picam2.capture_file(filepath)
-
-            # Metadata writing (ISO, Exif) removed per user request.
-            
+            # This avoids loading the raw array into Python memory.
+            # Its metadata is that of the saved frame; once video mode is restored,
+            # capture_metadata() would describe a later preview frame instead
+            metadata = self.picam2.capture_file(filepath)
+            return metadata if isinstance(metadata, dict) else {}
         finally:
             if reconfigured:
                 print(f"[PiCamera] Restoring Video Mode: {original_width}x{original_height}", file=sys.stderr)
@@ -441,10 +676,21 @@ class PiCamera(CameraBase):
         self._apply_exposure_controls()
 
     def capture_array(self):
-        """Captures a single frame. Renamed from capture_still for clarity."""
-        if not self.is_running:
-            return None
-        return self.picam2.capture_array()
+        """
+        Captures a single frame. Renamed from capture_still for clarity.
+        While a still capture owns the camera this returns the last preview frame instead.
+        """
+        if self.preview_paused.is_set() or not self._device_lock.acquire(blocking=False):
+            return self.frame
+        try:
+            if not self.is_running:
+                return None
+            frame = self.picam2.capture_array()
+        finally:
+            self._device_lock.release()
+        self.frame = frame # Held for preview producers while a still capture is in progress
+        self._mark_warm()
+        return frame
 
     def autofocus_and_capture(self):
         if self.picam2 and self._has_autofocus:
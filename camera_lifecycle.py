@@ -0,0 +1,127 @@
+import asyncio
+import sys
+import time
+
+# Camera lifecycle states
+STATE_COLD = "cold"            # Instantiated but never started
+STATE_WARMING = "warming"      # start() in progress
+STATE_STREAMING = "streaming"  # Running and delivering frames
+STATE_SUSPENDED = "suspended"  # Stopped after being idle; settings kept for a fast restart
+
+
+class CameraLifecycleManager:
+    """
+    Tracks per-camera lifecycle state and suspends cameras that have been idle
+    (no frame consumers and no scheduled job) for longer than `idle_timeout` seconds.
+    Suspended cameras keep their configuration and controls on the camera object,
+    so ensure_running() only has to restart the hardware.
+    """
+    def __init__(self, idle_timeout=0, publish_callback=None, check_interval=5.0):
+        self.idle_timeout = idle_timeout # 0 = never suspend
+        self.publish_callback = publish_callback
+        self.check_interval = check_interval
+        self.states = {}
+        self.last_active = {}
+        self.last_resume_s = {}
+        self.suspend_count = {}
+
+    async def _set_state(self, camera_path, state, **extra):
+        if self.states.get(camera_path) == state:
+            return
+        self.states[camera_path] = state
+        print(f"[Lifecycle] {camera_path} -> {state}", file=sys.stderr)
+        if self.publish_callback:
+            try:
+                await self.publish_callback(camera_path, state, extra)
+            except Exception as e:
+                print(f"[Lifecycle] Failed to publish state for {camera_path}: {e}", file=sys.stderr)
+
+    def touch(self, camera_path):
+        """Marks the camera as in use right now."""
+        self.last_active[camera_path] = time.time()
+
+    async def register(self, camera_path):
+        """Registers a freshly instantiated camera in the cold state."""
+        if camera_path not in self.states:
+            await self._set_state(camera_path, STATE_COLD)
+
+    async def ensure_running(self, camera_path, camera):
+        """
+        Starts the camera if it is not running (cold start or resume from suspend)
+        and records how long it took. Returns the start latency in seconds, or 0.0
+        if the camera was already running.
+        """
+        self.touch(camera_path)
+        if camera.is_running:
+            if self.states.get(camera_path) != STATE_STREAMING:
+                await self._set_state(camera_path, STATE_STREAMING)
+            return 0.0
+
+        previous = self.states.get(camera_path, STATE_COLD)
+        await self._set_state(camera_path, STATE_WARMING, previous=previous)
+        t_start = time.time()
+        # Both block (PiCamera configures the sensor, USB cameras open the device on their
+        # own thread); run them off the event loop so other streams and the API keep going
+        await asyncio.to_thread(camera.start)
+        if not await asyncio.to_thread(camera.ready_event.wait, 10):
+            print(f"[Lifecycle] {camera_path} did not report ready within 10s.", file=sys.stderr)
+        latency = round(time.time() - t_start, 3)
+        self.last_resume_s[camera_path] = latency
+        self.touch(camera_path)
+        await self._set_state(camera_path, STATE_STREAMING, previous=previous, start_latency_s=latency)
+        print(f"[Lifecycle] {camera_path} started from '{previous}' in {latency:.3f}s", file=sys.stderr)
+        return latency
+
+    async def suspend(self, camera_path, camera):
+        """Stops an idle camera while keeping its settings for a fast restart."""
+        idle_for = time.time() - self.last_active.get(camera_path, time.time())
+        print(f"[Lifecycle] Suspending {camera_path} after {idle_for:.0f}s idle.", file=sys.stderr)
+        camera.suspend()
+        self.suspend_count[camera_path] = self.suspend_count.get(camera_path, 0) + 1
+        await self._set_state(camera_path, STATE_SUSPENDED, idle_s=round(idle_for, 1))
+
+    def forget(self, camera_path=None):
+        """Drops tracking for one camera, or for all cameras if camera_path is None."""
+        for table in (self.states, self.last_active, self.last_resume_s, self.suspend_count):
+            if camera_path is None:
+                table.clear()
+            else:
+                table.pop(camera_path, None)
+
+    def get_status(self, camera_path):
+        return {
+            "state": self.states.get(camera_path, STATE_COLD),
+            "last_active": self.last_active.get(camera_path),
+            "last_start_latency_s": self.last_resume_s.get(camera_path),
+            "suspend_count": self.suspend_count.get(camera_path, 0)
+        }
+
+    async def check_idle(self, cameras, jobs_running=False):
+        """Suspends running cameras that exceeded the idle timeout. `cameras` maps path -> camera."""
+        now = time.time()
+        for camera_path, camera in list(cameras.items()):
+            if not camera.is_running:
+                continue
+            if jobs_running or camera.has_consumers():
+                self.touch(camera_path)
+                if self.states.get(camera_path) != STATE_STREAMING:
+                    await self._set_state(camera_path, STATE_STREAMING)
+                continue
+            if camera_path not in self.last_active:
+                self.touch(camera_path)
+                continue
+            if self.idle_timeout > 0 and now - self.last_active[camera_path] >= self.idle_timeout:
+                try:
+                    await self.suspend(camera_path, camera)
+                except Exception as e:
+                    print(f"[Lifecycle] Failed to suspend {camera_path}: {e}", file=sys.stderr)
+
+    async def run(self, get_cameras, jobs_running):
+        """Background loop. `get_cameras` and `jobs_running` are callables evaluated on every pass."""
+        print(f"[Lifecycle] Idle monitor started (timeout={self.idle_timeout}s).", file=sys.stderr)
+        while True:
+            try:
+                await self.check_idle(get_cameras(), jobs_running())
+            except Exception as e:
+                print(f"[Lifecycle] Error in idle monitor: {e}", file=sys.stderr)
+            await asyncio.sleep(self.check_interval)
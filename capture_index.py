@@ -0,0 +1,385 @@
+import argparse
+import os
+import pathlib
+import sqlite3
+import sys
+import time
+from threading import Lock
+
+BASE_DIR = pathlib.Path(__file__).parent.absolute()
+CAPTURE_INDEX_PATH = BASE_DIR / "capture_index.db"
+DEFAULT_CAPTURE_DIR = BASE_DIR / "captures"
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg")
+SCHEMA_VERSION = 3
+MAX_TOMBSTONES = 5000 # Removal records kept for incremental clients
+
+
+class CaptureIndex:
+    """
+    SQLite index of the images under `<capture_dir>/images`, so listing recent captures
+    is an indexed query instead of a walk + stat over the whole tree. Paths are stored
+    relative to `capture_dir` (e.g. "images/default/IMG_....jpg"), the same form the
+    WebUI and /captures mount use. The index is kept current by the capture, delete and
+    SFTP code paths; rebuild() resynchronises it from disk.
+
+    Every add and remove takes the next value of a monotonically increasing sequence
+    number, which clients use as a cursor to fetch only what changed (see changes()).
+    Removals are kept as tombstones; once they are pruned, or after a rebuild, cursors
+    older than `floor` can no longer be served incrementally and get a reset instead.
+    """
+    def __init__(self, db_path=CAPTURE_INDEX_PATH, capture_dir=DEFAULT_CAPTURE_DIR):
+        self.db_path = str(db_path)
+        self.capture_dir = pathlib.Path(capture_dir)
+        self._lock = Lock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._create_schema()
+        self.floor = int(self._get_meta("floor", 0))
+        self._seq = max(self.floor, self._conn.execute(
+            "SELECT MAX(s) FROM (SELECT MAX(seq) AS s FROM captures UNION ALL SELECT MAX(seq) FROM removed)"
+        ).fetchone()[0] or 0)
+        # Running total for total_bytes(), kept up to date by every write
+        self._bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM captures").fetchone()[0]
+
+    def _create_schema(self):
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        version = self._conn.execute("SELECT value FROM meta WHERE key = 'schema'").fetchone()
+        if version is None or int(version[0]) != SCHEMA_VERSION:
+            # The index is derived data: drop an older layout and let it be rebuilt from disk
+            self._conn.execute("DROP TABLE IF EXISTS captures")
+            self._conn.execute("DROP TABLE IF EXISTS removed")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS captures ("
+            " path TEXT PRIMARY KEY,"
+            " name TEXT,"
+            " subfolder TEXT,"
+            " camera TEXT,"
+            " size INTEGER,"
+            " mtime REAL,"
+            " seq INTEGER,"
+            " uploaded INTEGER DEFAULT 0)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_captures_mtime ON captures (mtime)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_captures_subfolder ON captures (subfolder, mtime)")
+        self._conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_captures_seq ON captures (seq)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS removed (seq INTEGER PRIMARY KEY, path TEXT)")
+        self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('schema', ?)", (str(SCHEMA_VERSION),))
+        self._conn.commit()
+
+    def _get_meta(self, key, default=None):
+        row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def _set_floor(self, seq):
+        self.floor = seq
+        self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('floor', ?)", (str(seq),))
+
+    def _next_seq(self):
+        self._seq += 1
+        return self._seq
+
+    def _rel(self, path):
+        """Normalises an absolute or capture-relative path to the stored relative form."""
+        p = pathlib.Path(path)
+        if p.is_absolute():
+            try:
+                p = p.relative_to(self.capture_dir)
+            except ValueError:
+                p = p.relative_to(self.capture_dir.resolve()) # Resolved paths from the delete endpoints
+        return p.as_posix()
+
+    @staticmethod
+    def _subfolder(rel_path):
+        # images/<subfolder...>/<file> -> <subfolder...>
+        parts = rel_path.split("/")
+        return "/".join(parts[1:-1])
+
+    def _row(self, rel, camera, size, mtime):
+        return (rel, rel.rsplit("/", 1)[-1], self._subfolder(rel), camera, size, mtime, self._next_seq())
+
+    def add(self, path, camera=None, stat_path=None):
+        """
+        Indexes (or re-indexes) one file. The file must exist, at `stat_path` if given
+        (e.g. its spool copy) or else under its own path.
+        """
+        rel = self._rel(path)
+        st = pathlib.Path(stat_path or self.capture_dir / rel).stat()
+        with self._lock:
+            old = self._conn.execute("SELECT size FROM captures WHERE path = ?", (rel,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO captures (path, name, subfolder, camera, size, mtime, seq)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                self._row(rel, camera, st.st_size, st.st_mtime)
+            )
+            self._conn.commit()
+            self._bytes += st.st_size - ((old[0] or 0) if old else 0)
+
+    def remove(self, paths):
+        """Drops one path or a list of paths from the index. Unknown paths are ignored."""
+        if isinstance(paths, (str, pathlib.Path)):
+            paths = [paths]
+        rels = []
+        for path in paths:
+            try:
+                rels.append(self._rel(path))
+            except ValueError:
+                continue # Outside the capture directory, never indexed
+        with self._lock:
+            for rel in rels:
+                row = self._conn.execute("SELECT size FROM captures WHERE path = ?", (rel,)).fetchone()
+                if row:
+                    self._conn.execute("DELETE FROM captures WHERE path = ?", (rel,))
+                    self._bytes -= row[0] or 0
+                    self._conn.execute("INSERT INTO removed (seq, path) VALUES (?, ?)", (self._next_seq(), rel))
+            self._prune_tombstones()
+            self._conn.commit()
+
+    def remove_tree(self, path):
+        """Drops every indexed file below a directory (e.g. a deleted subfolder)."""
+        prefix = self._rel(path).rstrip("/") + "/"
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT path, size FROM captures WHERE substr(path, 1, ?) = ?", (len(prefix), prefix)
+            ).fetchall()
+            self._conn.execute("DELETE FROM captures WHERE substr(path, 1, ?) = ?", (len(prefix), prefix))
+            self._bytes -= sum(row[1] or 0 for row in rows)
+            self._conn.executemany(
+                "INSERT INTO removed (seq, path) VALUES (?, ?)", [(self._next_seq(), row[0]) for row in rows]
+            )
+            self._prune_tombstones()
+            self._conn.commit()
+
+    def _prune_tombstones(self):
+        """Keeps the newest MAX_TOMBSTONES removals; older cursors must reset. Caller holds the lock."""
+        row = self._conn.execute(
+            "SELECT seq FROM removed ORDER BY seq DESC LIMIT 1 OFFSET ?", (MAX_TOMBSTONES,)
+        ).fetchone()
+        if row:
+            self._conn.execute("DELETE FROM removed WHERE seq <= ?", (row[0],))
+            self._set_floor(row[0])
+
+    def mark_uploaded(self, paths):
+        """Flags files that were uploaded but kept locally, so retention can delete them first."""
+        rows = []
+        for path in paths:
+            try:
+                rows.append((self._rel(path),))
+            except ValueError:
+                continue
+        with self._lock:
+            self._conn.executemany("UPDATE captures SET uploaded = 1 WHERE path = ?", rows)
+            self._conn.commit()
+
+    def total_bytes(self):
+        """Size of all indexed files. O(1): checked before every capture when a quota is set."""
+        return self._bytes
+
+    def subfolder_counts(self):
+        """Returns {subfolder: file count}."""
+        with self._lock:
+            return dict(self._conn.execute("SELECT subfolder, COUNT(*) FROM captures GROUP BY subfolder"))
+
+    def oldest(self, limit, uploaded=None, subfolder=None, older_than=None, newer_than=None):
+        """
+        Returns [(path, size)] for the oldest captures, optionally only uploaded (or
+        not uploaded) files, one subfolder, or files with an mtime before `older_than`
+        (or from `newer_than` on).
+        """
+        where, args = "", []
+        if uploaded is not None:
+            where += " AND uploaded = ?"
+            args.append(1 if uploaded else 0)
+        if subfolder is not None:
+            where += " AND subfolder = ?"
+            args.append(subfolder)
+        if older_than is not None:
+            where += " AND mtime < ?"
+            args.append(older_than)
+        if newer_than is not None:
+            where += " AND mtime >= ?"
+            args.append(newer_than)
+        with self._lock:
+            return self._conn.execute(
+                f"SELECT path, size FROM captures WHERE 1 = 1{where} ORDER BY mtime LIMIT ?", [*args, limit]
+            ).fetchall()
+
+    def recent(self, limit=20):
+        """Returns relative paths of the newest captures, newest first."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT path FROM captures ORDER BY mtime DESC, path DESC LIMIT ?", (limit,)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    @staticmethod
+    def _filter_sql(camera=None, subfolder=None, prefix=None, start=None, end=None):
+        clauses, args = [], []
+        if camera:
+            clauses.append("camera = ?")
+            args.append(camera)
+        if subfolder is not None:
+            clauses.append("subfolder = ?")
+            args.append(subfolder.strip("/"))
+        if prefix:
+            clauses.append("substr(name, 1, ?) = ?")
+            args.extend([len(prefix), prefix])
+        if start is not None:
+            clauses.append("mtime >= ?")
+            args.append(start)
+        if end is not None:
+            clauses.append("mtime < ?")
+            args.append(end)
+        return "".join(f" AND {c}" for c in clauses), args
+
+    def changes(self, since=None, before=None, limit=50, **filters):
+        """
+        Cursor-paginated listing. Entries are dicts with path, camera, subfolder, size,
+        mtime and seq; `filters` are camera, subfolder, prefix, start and end (mtime).
+
+        - since=None: the newest `limit` matching entries (newest first). `before` pages
+          further back; pass the previous response's `next_before`.
+        - since=<cursor>: entries added after the cursor (oldest first, at most `limit`)
+          plus paths removed after it. Removals are not filtered. When `has_more` is set,
+          call again with the returned cursor.
+
+        If the cursor predates the oldest kept tombstone (or a rebuild), or is ahead of the
+        index (the database was recreated), the newest page is returned with `reset` set
+        and the client should discard what it has.
+        """
+        where, args = self._filter_sql(**filters)
+        columns = "path, camera, subfolder, size, mtime, seq"
+        with self._lock:
+            reset = since is not None and (since < self.floor or since > self._seq)
+            if since is None or reset:
+                bound = before if before is not None else self._seq + 1
+                rows = self._conn.execute(
+                    f"SELECT {columns} FROM captures WHERE seq < ?{where} ORDER BY seq DESC LIMIT ?",
+                    [bound, *args, limit + 1]
+                ).fetchall()
+                removed = []
+                cursor = self._seq
+                has_more = len(rows) > limit
+            else:
+                rows = self._conn.execute(
+                    f"SELECT {columns} FROM captures WHERE seq > ?{where} ORDER BY seq LIMIT ?",
+                    [since, *args, limit + 1]
+                ).fetchall()
+                has_more = len(rows) > limit
+                # A full page stops the cursor at its last entry; removals are bounded the same way
+                cursor = rows[limit - 1][5] if has_more else self._seq
+                removed = [row[0] for row in self._conn.execute(
+                    "SELECT path FROM removed WHERE seq > ? AND seq <= ? ORDER BY seq", (since, cursor)
+                )]
+
+        rows = rows[:limit]
+        entries = [dict(zip(("path", "camera", "subfolder", "size", "mtime", "seq"), row)) for row in rows]
+        result = {
+            "cursor": cursor,
+            "added": entries,
+            "removed": removed,
+            "has_more": has_more,
+            "reset": reset
+        }
+        if since is None or reset:
+            result["next_before"] = entries[-1]["seq"] if has_more and entries else None
+        return result
+
+    def iter_selection(self, page=500, **filters):
+        """
+        Yields relative paths matching `filters` (see changes()), oldest first. Reads one
+        page at a time so large selections never hold the lock or the whole result.
+        """
+        where, args = self._filter_sql(**filters)
+        after = 0
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    f"SELECT path, seq FROM captures WHERE seq > ?{where} ORDER BY seq LIMIT ?",
+                    [after, *args, page]
+                ).fetchall()
+            for path, seq in rows:
+                yield path
+            if len(rows) < page:
+                return
+            after = rows[-1][1]
+
+    def all_paths(self):
+        """Returns every indexed relative path, sorted by name."""
+        with self._lock:
+            rows = self._conn.execute("SELECT path FROM captures ORDER BY path").fetchall()
+        return [row[0] for row in rows]
+
+    def contains(self, path):
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM captures WHERE path = ?", (self._rel(path),)).fetchone() is not None
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM captures").fetchone()[0]
+
+    def _scan(self):
+        """Walks `<capture_dir>/images` with scandir, yielding (rel_path, size, mtime)."""
+        stack = [self.capture_dir / "images"]
+        while stack:
+            directory = stack.pop()
+            try:
+                entries = list(os.scandir(directory))
+            except OSError:
+                continue
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.name.lower().endswith(IMAGE_EXTENSIONS) and not entry.name.startswith("."):
+                    try:
+                        st = entry.stat()
+                    except OSError:
+                        continue # Deleted while scanning
+                    rel = pathlib.Path(entry.path).relative_to(self.capture_dir).as_posix()
+                    yield rel, st.st_size, st.st_mtime
+
+    def rebuild(self):
+        """
+        Replaces the index with the current contents of the disk. The walk runs without
+        the lock, so readers keep getting the old listing until the swap commits.
+        Files get sequence numbers in mtime order, and every existing cursor is reset.
+        Known camera names and upload flags are carried over for files that are still present.
+        Returns the number of indexed files.
+        """
+        t_start = time.time()
+        scanned = sorted(self._scan(), key=lambda item: (item[2], item[0]))
+        with self._lock:
+            cameras = dict(self._conn.execute("SELECT path, camera FROM captures WHERE camera IS NOT NULL"))
+            uploaded = self._conn.execute("SELECT path FROM captures WHERE uploaded = 1").fetchall()
+            with self._conn:
+                self._conn.execute("DELETE FROM captures")
+                self._conn.execute("DELETE FROM removed")
+                self._set_floor(self._next_seq()) # Marks the rebuild; older cursors reset
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO captures (path, name, subfolder, camera, size, mtime, seq)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    [self._row(rel, cameras.get(rel), size, mtime) for rel, size, mtime in scanned]
+                )
+                self._conn.executemany("UPDATE captures SET uploaded = 1 WHERE path = ?", uploaded)
+            self._bytes = sum(size for _, size, _ in scanned)
+        print(f"[Index] Rebuilt capture index: {len(scanned)} files in {time.time() - t_start:.2f}s", file=sys.stderr)
+        return len(scanned)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Capture index maintenance")
+    parser.add_argument("--rebuild", action="store_true", help="Rebuild the index from the files on disk")
+    parser.add_argument("--db", default=str(CAPTURE_INDEX_PATH), help="Index database path")
+    parser.add_argument("--captures", default=str(DEFAULT_CAPTURE_DIR), help="Capture directory")
+    args = parser.parse_args()
+
+    index = CaptureIndex(args.db, args.captures)
+    if args.rebuild:
+        index.rebuild()
+    print(f"{index.count()} files indexed in {args.db}")
+    index.close()
@@ -0,0 +1,165 @@
+import os
+import pathlib
+import sys
+import time
+from threading import Lock
+
+PARTIAL_PREFIX = ".partial_"
+
+SYNC_NONE = "none"   # Rename only; the kernel writes back whenever it likes
+SYNC_FILE = "file"   # fsync every file (and its directory) before it becomes visible
+SYNC_GROUP = "group" # Rename immediately, fsync in groups of N files or every T ms
+SYNC_POLICIES = (SYNC_NONE, SYNC_FILE, SYNC_GROUP)
+
+
+def is_complete_jpeg(path):
+    """True if the file ends with the JPEG EOI marker (FFD9), i.e. was not truncated."""
+    try:
+        with open(path, "rb") as f:
+            f.seek(-2, os.SEEK_END)
+            return f.read(2) == b"\xff\xd9"
+    except OSError:
+        return False
+
+
+class CaptureWriter:
+    """
+    Makes capture writes atomic. Cameras, EXIF insertion and the overlay all work on a
+    hidden temp file (`.partial_<name>` in the target directory, keeping the extension
+    so encoders pick the right format). commit() renames it into place, so a capture is
+    either complete under its final name or left behind as a `.partial_` orphan that
+    recover() removes on the next start.
+
+    The durability policy trades SD card throughput against what a power cut can lose:
+    `none` (page cache only), `file` (fsync before each rename) or `group` (fsync the
+    files renamed so far once `group_files` have accumulated or `group_ms` has passed).
+    """
+    def __init__(self, policy=SYNC_GROUP, group_files=10, group_ms=1000):
+        self.policy = policy
+        self.group_files = group_files
+        self.group_ms = group_ms
+        self._pending = [] # Committed but not yet fsynced (group policy)
+        self._pending_since = None
+        self._lock = Lock()
+        self.commits = 0
+        self.fsyncs = 0
+        self.fsync_time_s = 0.0
+        self.last_recovery = {}
+
+    def configure(self, config):
+        """Applies the sync settings from the `storage:` config section."""
+        config = config or {}
+        policy = config.get('sync', self.policy)
+        if policy not in SYNC_POLICIES:
+            print(f"[Writer] Unknown sync policy '{policy}', using '{self.policy}'.", file=sys.stderr)
+            policy = self.policy
+        self.policy = policy
+        self.group_files = config.get('sync_group_files', self.group_files)
+        self.group_ms = config.get('sync_group_ms', self.group_ms)
+
+    @staticmethod
+    def temp_path(final_path):
+        final_path = pathlib.Path(final_path)
+        return final_path.with_name(PARTIAL_PREFIX + final_path.name)
+
+    @staticmethod
+    def _fsync(path):
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _fsync_paths(self, files, already_synced=()):
+        """fsyncs files, then their directories so the renames persist too."""
+        t_start = time.time()
+        for path in files:
+            if path not in already_synced:
+                self._fsync(path)
+        for directory in {os.path.dirname(path) for path in files}:
+            self._fsync(directory)
+        self.fsyncs += 1
+        self.fsync_time_s += time.time() - t_start
+
+    def commit(self, temp_path, final_path):
+        """Moves a finished temp file to its final name according to the sync policy."""
+        temp_path, final_path = str(temp_path), str(final_path)
+        if self.policy == SYNC_FILE:
+            t_start = time.time()
+            self._fsync(temp_path) # Data must be on disk before the name points at it
+            self.fsync_time_s += time.time() - t_start
+            os.replace(temp_path, final_path)
+            self._fsync_paths([final_path], already_synced=(final_path,))
+        else:
+            os.replace(temp_path, final_path)
+
+        self.commits += 1
+        if self.policy == SYNC_GROUP:
+            with self._lock:
+                self._pending.append(final_path)
+                if self._pending_since is None:
+                    self._pending_since = time.time()
+            self.flush_if_due()
+
+    def flush_if_due(self):
+        """fsyncs the pending group if it is full or old enough. Cheap to call often."""
+        with self._lock:
+            if not self._pending:
+                return
+            due = (len(self._pending) >= self.group_files or
+                   (time.time() - self._pending_since) * 1000 >= self.group_ms)
+        if due:
+            self.flush()
+
+    def flush(self):
+        """fsyncs every pending file now."""
+        with self._lock:
+            pending, self._pending, self._pending_since = self._pending, [], None
+        existing = [path for path in pending if os.path.exists(path)] # Uploaded/deleted meanwhile
+        if existing:
+            self._fsync_paths(existing)
+
+    def discard(self, temp_path):
+        """Removes a temp file after a failed capture."""
+        try:
+            os.remove(temp_path)
+        except FileNotFoundError:
+            pass
+
+    def recover(self, image_dir, recent_paths=()):
+        """
+        Startup check. Deletes `.partial_` orphans left by an interrupted capture and
+        reports which of `recent_paths` (the newest captures, which is where an
+        unsynced power cut would strike) are truncated JPEGs.
+        """
+        orphans = []
+        for root, dirs, files in os.walk(image_dir):
+            for name in files:
+                if name.startswith(PARTIAL_PREFIX):
+                    path = os.path.join(root, name)
+                    orphans.append(path)
+                    try:
+                        os.remove(path)
+                    except OSError as e:
+                        print(f"[Writer] Failed to remove orphan {path}: {e}", file=sys.stderr)
+        truncated = [str(path) for path in recent_paths if not is_complete_jpeg(path)]
+        if orphans:
+            print(f"[Writer] Removed {len(orphans)} orphaned partial capture(s).", file=sys.stderr)
+        for path in truncated:
+            print(f"[Writer] Capture appears truncated: {path}", file=sys.stderr)
+        self.last_recovery = {"orphans_removed": len(orphans), "truncated": truncated, "time": time.time()}
+        return self.last_recovery
+
+    def get_status(self):
+        with self._lock:
+            pending = len(self._pending)
+        return {
+            "policy": self.policy,
+            "group_files": self.group_files,
+            "group_ms": self.group_ms,
+            "commits": self.commits,
+            "fsyncs": self.fsyncs,
+            "avg_fsync_ms": round(self.fsync_time_s / self.fsyncs * 1000, 2) if self.fsyncs else None,
+            "pending_sync": pending,
+            "last_recovery": self.last_recovery
+        }
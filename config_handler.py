@@ -117,7 +117,9 @@ def generate_default_config(config, detected_cameras):
                 base_config.update({
                     'resolutions': res_list,
                     'has_autofocus': cam_info.get('has_autofocus', False),
-                    'shutter_speed_range': "unavailable"
+                    'shutter_speed_range': "unavailable",
+                    # Stream/save the camera's MJPEG frames without decoding (falls back automatically)
+                    'mjpeg_passthrough': True
                 })
             
             config['cameras'][cam_key] = base_config
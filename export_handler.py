@@ -0,0 +1,85 @@
+import os
+import sys
+import tarfile
+import time
+import zipfile
+
+CHUNK = 256 * 1024
+ZIP64_THRESHOLD = 2 ** 31 # Per-file; zipfile needs to know up front when writing to a stream
+
+
+class _StreamSink:
+    """Write-only file object that collects output until the generator hands it to the client."""
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _open_entries(entries):
+    """Yields (arcname, open file, stat) for each (arcname, path), skipping files deleted meanwhile."""
+    for arcname, path in entries:
+        try:
+            f = open(path, "rb")
+        except OSError:
+            print(f"[Export] Skipping {arcname}: no longer available", file=sys.stderr)
+            continue
+        with f:
+            yield arcname, f, os.fstat(f.fileno())
+
+
+def stream_zip(entries):
+    """
+    Streams a ZIP of (arcname, path) entries as bytes chunks. Members are STORED (JPEGs
+    do not compress) and written with data descriptors, so nothing is seeked, buffered
+    or staged in a temp file. Memory stays at one chunk plus ZIP's central directory
+    entry (a few dozen bytes) per file.
+    """
+    sink = _StreamSink()
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_STORED, allowZip64=True) as zf:
+        for arcname, src, st in _open_entries(entries):
+            info = zipfile.ZipInfo(arcname, date_time=time.localtime(st.st_mtime)[:6])
+            info.compress_type = zipfile.ZIP_STORED
+            with zf.open(info, "w", force_zip64=st.st_size >= ZIP64_THRESHOLD) as dest:
+                for chunk in iter(lambda: src.read(CHUNK), b""):
+                    dest.write(chunk)
+                    yield sink.drain()
+            yield sink.drain()
+    yield sink.drain() # Central directory
+
+
+def stream_tar(entries):
+    """Streams a POSIX tar of (arcname, path) entries as bytes chunks, in constant memory."""
+    for arcname, src, st in _open_entries(entries):
+        info = tarfile.TarInfo(arcname)
+        info.size = st.st_size
+        info.mtime = int(st.st_mtime)
+        info.mode = 0o644
+        yield info.tobuf(tarfile.PAX_FORMAT)
+        remaining = st.st_size
+        while remaining > 0:
+            # Never send more than the header announced, even if the file grew meanwhile
+            chunk = src.read(min(CHUNK, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+        # A file that shrank after the header was written is padded to its announced size
+        yield b"\0" * remaining + b"\0" * ((tarfile.BLOCKSIZE - st.st_size % tarfile.BLOCKSIZE) % tarfile.BLOCKSIZE)
+    yield b"\0" * (2 * tarfile.BLOCKSIZE)
+
+
+FORMATS = {
+    "zip": (stream_zip, "application/zip"),
+    "tar": (stream_tar, "application/x-tar")
+}
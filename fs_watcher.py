@@ -0,0 +1,311 @@
+import ctypes
+import ctypes.util
+import os
+import pathlib
+import select
+import struct
+import sys
+from threading import Lock, Thread
+
+# <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = getattr(os, "O_CLOEXEC", 0o2000000)
+
+WATCH_MASK = (IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+              | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+EVENT_HEADER = struct.Struct("iIII") # wd, mask, cookie, len
+
+
+class Inotify:
+    """Minimal ctypes binding for Linux inotify (no extra dependency)."""
+    def __init__(self):
+        libc_name = ctypes.util.find_library("c")
+        if not sys.platform.startswith("linux") or not libc_name:
+            raise OSError("inotify is only available on Linux")
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        self.fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+    def add_watch(self, path, mask=WATCH_MASK):
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(str(path)), mask)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {path}")
+        return wd
+
+    def read_events(self, timeout):
+        """Returns [(wd, mask, name)] ready within `timeout` seconds."""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        events, offset = [], 0
+        while offset + EVENT_HEADER.size <= len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+            offset += length
+            events.append((wd, mask, name))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class _Node:
+    __slots__ = ("dirs", "files", "total_files", "total_bytes")
+
+    def __init__(self):
+        self.dirs = set()
+        self.files = {} # name -> size
+        self.total_files = 0 # Recursive
+        self.total_bytes = 0
+
+
+class CaptureTree:
+    """
+    In-memory mirror of the capture image directory, kept current by inotify.
+
+    Every directory has a node with its subdirectories, its files and recursive file
+    counts and sizes, so listings and statistics never touch the disk. Every change,
+    including ones made outside the app (files copied in or removed by hand), is
+    reported through `on_change(kind, rel_path)` with kind one of `file_created`,
+    `file_deleted`, `dir_created` or `dir_deleted`; it is called on the watcher thread.
+    Hidden files (in-progress `.partial_` writes) are ignored; a capture appears when
+    it is renamed into place.
+    """
+    def __init__(self, root, on_change=None):
+        self.root = pathlib.Path(root)
+        self.on_change = on_change
+        self._nodes = {}
+        self._lock = Lock()
+        self._inotify = None
+        self._watches = {} # wd -> rel dir
+        self._running = False
+        self._thread = None
+        self.events = 0
+        self.rescans = 0
+
+    @staticmethod
+    def _parent(rel):
+        return rel.rsplit("/", 1)[0] if "/" in rel else ""
+
+    @staticmethod
+    def _join(rel_dir, name):
+        return f"{rel_dir}/{name}" if rel_dir else name
+
+    def _ancestors(self, rel_dir):
+        """rel_dir and every directory above it, up to the root. Caller holds the lock."""
+        while True:
+            yield self._nodes.setdefault(rel_dir, _Node())
+            if not rel_dir:
+                return
+            rel_dir = self._parent(rel_dir)
+
+    def _add_file(self, rel_dir, name, size):
+        """Records a file; returns True if it was new. Caller holds the lock."""
+        node = self._nodes.setdefault(rel_dir, _Node())
+        old = node.files.get(name)
+        node.files[name] = size
+        for ancestor in self._ancestors(rel_dir):
+            ancestor.total_bytes += size - (old or 0)
+            ancestor.total_files += 0 if old is not None else 1
+        return old is None
+
+    def _remove_file(self, rel_dir, name):
+        """Forgets a file; returns True if it was known. Caller holds the lock."""
+        node = self._nodes.get(rel_dir)
+        if node is None or name not in node.files:
+            return False
+        size = node.files.pop(name)
+        for ancestor in self._ancestors(rel_dir):
+            ancestor.total_bytes -= size
+            ancestor.total_files -= 1
+        return True
+
+    def _remove_dir(self, rel):
+        """Forgets a directory and everything below it. Caller holds the lock."""
+        node = self._nodes.get(rel)
+        if node is None:
+            return False
+        parent = self._parent(rel)
+        for ancestor in self._ancestors(parent):
+            ancestor.total_bytes -= node.total_bytes
+            ancestor.total_files -= node.total_files
+        self._nodes[parent].dirs.discard(rel.rsplit("/", 1)[-1])
+        prefix = rel + "/"
+        for key in [k for k in self._nodes if k == rel or k.startswith(prefix)]:
+            del self._nodes[key]
+        for wd in [wd for wd, d in self._watches.items() if d == rel or d.startswith(prefix)]:
+            del self._watches[wd] # The kernel drops the watch itself (IN_IGNORED)
+        return True
+
+    def _scan_dir(self, rel_dir, created):
+        """Adds a directory subtree (watching each directory before listing it, so nothing slips through)."""
+        stack = [rel_dir]
+        while stack:
+            current = stack.pop()
+            path = self.root / current if current else self.root
+            if self._inotify:
+                try:
+                    self._watches[self._inotify.add_watch(path)] = current
+                except OSError as e:
+                    print(f"[Watcher] Cannot watch {path}: {e}", file=sys.stderr)
+            try:
+                entries = list(os.scandir(path))
+            except OSError:
+                continue
+            with self._lock:
+                self._nodes.setdefault(current, _Node())
+                if current:
+                    self._nodes.setdefault(self._parent(current), _Node()).dirs.add(current.rsplit("/", 1)[-1])
+                for entry in entries:
+                    if entry.name.startswith("."):
+                        continue
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(self._join(current, entry.name))
+                        elif entry.is_file(follow_symlinks=False):
+                            if self._add_file(current, entry.name, entry.stat().st_size) and created is not None:
+                                created.append(self._join(current, entry.name))
+                    except OSError:
+                        continue # Deleted while scanning
+
+    def scan(self):
+        """Rebuilds the whole tree from disk."""
+        with self._lock:
+            self._nodes = {"": _Node()}
+            self._watches.clear()
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._scan_dir("", None)
+        self.rescans += 1
+
+    def _notify(self, kind, rel):
+        if self.on_change:
+            try:
+                self.on_change(kind, rel)
+            except Exception as e:
+                print(f"[Watcher] Change callback failed for {rel}: {e}", file=sys.stderr)
+
+    def _handle(self, wd, mask, name):
+        if mask & IN_Q_OVERFLOW:
+            print("[Watcher] Event queue overflowed; rescanning.", file=sys.stderr)
+            self.scan()
+            return
+        rel_dir = self._watches.get(wd)
+        if rel_dir is None or not name or name.startswith("."):
+            return
+        rel = self._join(rel_dir, name)
+        path = self.root / rel
+
+        if mask & IN_ISDIR:
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                created = []
+                self._scan_dir(rel, created)
+                self._notify("dir_created", rel)
+                for file_rel in created:
+                    self._notify("file_created", file_rel)
+            elif mask & (IN_DELETE | IN_MOVED_FROM):
+                with self._lock:
+                    removed = self._remove_dir(rel)
+                if removed:
+                    self._notify("dir_deleted", rel)
+        elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+            try:
+                size = path.stat().st_size
+            except OSError:
+                return # Already gone again
+            with self._lock:
+                added = self._add_file(rel_dir, name, size)
+            if added:
+                self._notify("file_created", rel)
+        elif mask & (IN_DELETE | IN_MOVED_FROM):
+            with self._lock:
+                removed = self._remove_file(rel_dir, name)
+            if removed:
+                self._notify("file_deleted", rel)
+
+    def _loop(self):
+        while self._running:
+            try:
+                for wd, mask, name in self._inotify.read_events(0.5):
+                    self.events += 1
+                    if mask & IN_IGNORED:
+                        with self._lock:
+                            self._watches.pop(wd, None)
+                        continue
+                    self._handle(wd, mask, name)
+            except Exception as e:
+                print(f"[Watcher] Error handling events: {e}", file=sys.stderr)
+
+    def start(self):
+        """Scans the tree and starts watching. Returns False if inotify is unavailable."""
+        try:
+            self._inotify = Inotify()
+        except (OSError, AttributeError) as e:
+            print(f"[Watcher] inotify unavailable ({e}); directory listings will read the disk.", file=sys.stderr)
+            self._inotify = None
+            return False
+        self.scan()
+        self._running = True
+        self._thread = Thread(target=self._loop, name="capture-watcher", daemon=True)
+        self._thread.start()
+        print(f"[Watcher] Watching {len(self._watches)} directories under {self.root}.", file=sys.stderr)
+        return True
+
+    def stop(self):
+        self._running = False
+        if self._thread:
+            self._thread.join(2.0)
+            self._thread = None
+        if self._inotify:
+            self._inotify.close()
+            self._inotify = None
+
+    @property
+    def running(self):
+        return self._running
+
+    def list_dirs(self, rel_dir=""):
+        """Sorted subdirectory names of a directory, or None if it does not exist."""
+        with self._lock:
+            node = self._nodes.get(rel_dir.strip("/"))
+            return sorted(node.dirs) if node is not None else None
+
+    def stats(self, rel_dir=""):
+        """File count and bytes of a directory (direct and recursive), or None if it does not exist."""
+        with self._lock:
+            node = self._nodes.get(rel_dir.strip("/"))
+            if node is None:
+                return None
+            return {
+                "files": len(node.files),
+                "bytes": sum(node.files.values()),
+                "total_files": node.total_files,
+                "total_bytes": node.total_bytes,
+                "subdirs": len(node.dirs)
+            }
+
+    def get_status(self):
+        with self._lock:
+            return {
+                "running": self._running,
+                "directories": len(self._nodes),
+                "watches": len(self._watches),
+                "events": self.events,
+                "rescans": self.rescans
+            }
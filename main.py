@@ -8,7 +8,7 @@ import pathlib
 import yaml
 from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request, HTTPException, Body, Query, WebSocket, WebSocketDisconnect
-from fastapi.responses import HTMLResponse, StreamingResponse, JSONResponse, PlainTextResponse
+from fastapi.responses import HTMLResponse, StreamingResponse, JSONResponse, PlainTextResponse, FileResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from pydantic import BaseModel
@@ -27,6 +27,20 @@ from config_handler import (
 )
 from mqtt_handler import MQTTClientWrapper
 from system_monitor import get_system_stats
+from stream_handler import compose_mosaic, encode_mjpeg_part, StreamRegistry, StreamLimitError
+from camera_lifecycle import CameraLifecycleManager
+from capture_index import CaptureIndex, IMAGE_EXTENSIONS
+from thumbnail_cache import ThumbnailCache
+from storage_manager import StorageManager, StorageFullError
+from capture_writer import CaptureWriter
+from spool_handler import CaptureSpool, SpoolStaticFiles
+from shard_writer import ShardWriter
+from manifest_writer import ManifestWriter
+from export_handler import FORMATS as EXPORT_FORMATS
+from fs_watcher import CaptureTree
+from upload_queue import UploadQueue
+from upload_throttle import upload_throttle
+from transfer_worker import transfer_process
 
 # --- Constants ---
 # Define a safe base directory for all captures
@@ -43,6 +57,28 @@ async def mqtt_log_callback(message):
         "message": message
     })
 
+async def publish_camera_state(camera_path, state, extra):
+    """Publishes lifecycle state changes to WebSocket clients and (retained) to MQTT."""
+    payload = {"camera_path": camera_path, "state": state, "timestamp": time.time(), **extra}
+    await manager.broadcast({"type": "camera_state", **payload})
+    if mqtt_client:
+        hostname = socket.gethostname()
+        mqtt_client.publish(f"dataset_collector/{hostname}/camera/{camera_path}/state", json.dumps(payload), retain=True)
+
+async def publish_storage_error(message, source):
+    """Tells WebSocket clients and MQTT subscribers that a capture was rejected for lack of space."""
+    payload = {"message": message, "source": source, "timestamp": time.time()}
+    await manager.broadcast({"type": "storage_error", **payload})
+    if mqtt_client:
+        hostname = socket.gethostname()
+        mqtt_client.publish(f"dataset_collector/{hostname}/storage/error", json.dumps(payload))
+
+async def on_retention_deleted(deleted):
+    """Called by the storage manager after a retention pass removed captures."""
+    thumbnail_cache.discard(deleted)
+    for rel_path in deleted:
+        await manager.broadcast({"type": "file_deleted", "filename": rel_path})
+
 async def mqtt_callback(data):
     original_data = data.copy() # Keep original for logging
     
@@ -75,7 +111,8 @@ async def mqtt_callback(data):
 
             request = CaptureAllRequest(
                 captures=[single_cap_request],
-                prefix=prefix_val
+                prefix=prefix_val,
+                request_id=data.get('request_id')
             )
     else:
         # Global context (Multi-cam) or invalid context
@@ -157,6 +194,16 @@ async def mqtt_callback(data):
                 hostname = socket.gethostname()
                 mqtt_client.publish(f"dataset_collector/{hostname}/capture/finished", json.dumps(confirmation_payload))
 
+    except StorageFullError as e:
+        # Already announced on the storage error topic; also answer the triggering request
+        if mqtt_client:
+            hostname = socket.gethostname()
+            mqtt_client.publish(f"dataset_collector/{hostname}/capture/finished", json.dumps({
+                "status": "error",
+                "request_id": original_data.get("request_id"),
+                "error": str(e),
+                "timestamp": time.time()
+            }))
     except Exception as e:
         print(f"Error handling MQTT message: {e}", file=sys.stderr)
 
@@ -220,10 +267,92 @@ async def lifespan(app: FastAPI):
     else:
         print("MQTT is disabled in config. Skipping startup.", file=sys.stderr)
         mqtt_client = None
+
+    # --- Stream Limits ---
+    stream_limits = system_config.get('stream_limits', {}) or {}
+    stream_registry.max_per_camera = stream_limits.get('per_camera', stream_registry.max_per_camera)
+    stream_registry.max_total = stream_limits.get('total', stream_registry.max_total)
+
+    # --- Camera Lifecycle (idle auto-suspend) ---
+    camera_lifecycle.idle_timeout = system_config.get('camera_idle_timeout', 0) or 0
+    lifecycle_task = asyncio.create_task(
+        camera_lifecycle.run(lambda: active_cameras, lambda: interval_capture_running)
+    )
+
+    # --- Capture Index ---
+    # First start (or deleted index): build it from disk in the background
+    if capture_index.count() == 0:
+        asyncio.create_task(asyncio.to_thread(capture_index.rebuild))
+
+    # --- Thumbnails ---
+    global thumbnails_at_capture
+    thumb_conf = system_config.get('thumbnails', {}) or {}
+    thumbnail_cache.size = thumb_conf.get('size', thumbnail_cache.size)
+    thumbnail_cache.max_bytes = int(thumb_conf.get('max_cache_mb', 100) * 1024 * 1024)
+    thumbnails_at_capture = thumb_conf.get('at_capture', True)
+
+    # --- Storage Quota / Retention ---
+    storage_manager.configure(system_config.get('storage', {}))
+    storage_task = asyncio.create_task(storage_manager.run())
+    capture_writer.configure(system_config.get('storage', {}))
+    # Clear out captures interrupted by a crash or power cut (a name-only walk, off the loop)
+    recent = [CAPTURE_DIR_BASE / p for p in capture_index.recent(20)]
+    asyncio.create_task(asyncio.to_thread(capture_writer.recover, CAPTURE_DIR_BASE / "images", recent))
+    sync_task = asyncio.create_task(sync_flush_loop())
+
+    # --- RAM Spool ---
+    capture_spool.configure(system_config.get('spool', {}))
+    if capture_spool.enabled:
+        capture_spool.start()
+
+    # --- Filesystem Watcher ---
+    global watcher_settle_s
+    watcher_conf = system_config.get('watcher', {}) or {}
+    watcher_settle_s = watcher_conf.get('settle_s', watcher_settle_s)
+    if watcher_conf.get('enabled', True):
+        capture_tree.on_change = lambda kind, rel: loop.call_soon_threadsafe(
+            loop.call_later, watcher_settle_s, lambda: asyncio.create_task(reconcile_fs_event(kind, rel))
+        )
+        # Initial scan off the loop; listings read the disk until it is done
+        asyncio.create_task(asyncio.to_thread(capture_tree.start))
+
+    # --- Dataset Manifest ---
+    manifest_writer.configure(system_config.get('manifest', {}))
+
+    # --- Tar Shards ---
+    shard_writer.configure(system_config.get('shards', {}))
+    shard_task = None
+    if shard_writer.enabled:
+        # Shards left open by a crash are finalised and uploaded like any other closed shard
+        queue_closed_shards(await asyncio.to_thread(shard_writer.recover))
+        shard_task = asyncio.create_task(shard_close_loop())
+
+    # --- Upload Queue ---
+    upload_throttle.configure(system_config.get('uploads', {}))
+    transfer_process.configure(system_config.get('uploads', {}))
+    # Re-sync the durable queue with the disk, then drain it in the background
+    await reconcile_upload_queue()
+    upload_task = asyncio.create_task(upload_worker())
     
     yield
     
     # --- Shutdown ---
+    lifecycle_task.cancel()
+    storage_task.cancel()
+    sync_task.cancel()
+    if shard_task:
+        shard_task.cancel()
+    upload_task.cancel()
+    if shard_writer.enabled:
+        # Finalise open shards now instead of leaving them to crash recovery on the next start
+        queue_closed_shards(await asyncio.to_thread(shard_writer.close_idle, True))
+    if capture_spool.enabled:
+        print("Flushing capture spool to disk...", file=sys.stderr)
+        capture_spool.stop()
+    capture_writer.flush()
+    manifest_writer.close()
+    capture_tree.stop()
+
     if mqtt_client:
         mqtt_client.stop()
 
@@ -232,6 +361,9 @@ async def lifespan(app: FastAPI):
         if camera.is_running:
             camera.stop()
     print("All cameras stopped.", file=sys.stderr)
+    capture_index.close()
+    await asyncio.to_thread(transfer_process.stop)
+    upload_queue.close()
 
 
 app = FastAPI(lifespan=lifespan)
@@ -241,10 +373,27 @@ app = FastAPI(lifespan=lifespan)
 available_cameras = {}
 active_cameras = {}
 capture_count = 0
-pending_transfers = []
 mqtt_client = None
 interval_capture_running = False
 interval_task = None
+camera_lifecycle = CameraLifecycleManager(publish_callback=publish_camera_state)
+stream_registry = StreamRegistry()
+capture_index = CaptureIndex(capture_dir=CAPTURE_DIR_BASE)
+thumbnail_cache = ThumbnailCache(CAPTURE_DIR_BASE, CAPTURE_DIR_BASE / "thumbs")
+thumbnails_at_capture = True
+shard_writer = ShardWriter(CAPTURE_DIR_BASE / "shards")
+storage_manager = StorageManager(capture_index, CAPTURE_DIR_BASE, delete_callback=on_retention_deleted,
+                                 shard_writer=shard_writer)
+capture_writer = CaptureWriter()
+capture_spool = CaptureSpool(CAPTURE_DIR_BASE / ".spool", CAPTURE_DIR_BASE, capture_writer)
+thumbnail_cache.locate = capture_spool.locate
+upload_queue = UploadQueue(capture_dir=CAPTURE_DIR_BASE)
+upload_wakeup = asyncio.Event()
+upload_flush_requested = False # Set by /api/uploads/flush: send everything due regardless of thresholds
+upload_backlog = 0 # Never-uploaded files from before auto-transfer was enabled, waiting for /api/uploads/backlog
+manifest_writer = ManifestWriter(CAPTURE_DIR_BASE / "manifests", CAPTURE_DIR_BASE)
+capture_tree = CaptureTree(CAPTURE_DIR_BASE / "images")
+watcher_settle_s = 1.0
 
 # --- WebSocket Manager ---
 class ConnectionManager:
@@ -307,6 +456,7 @@ class CaptureAllRequest(BaseModel):
     iso: int | None = None
     autofocus: bool | None = None
     captures: list[PerCameraCaptureSettings] | None = None
+    request_id: str | None = None # Caller's trigger id, recorded in the dataset manifest
 
 class StartIntervalRequest(BaseModel):
     interval_seconds: float
@@ -322,6 +472,9 @@ class SFTPConfig(BaseModel):
     password: str
     remote_path: str
     batch_size: int = 10
+    batch_mb: float = 64
+    batch_max_age_s: int = 600
+    delete_after_upload: bool = True
 
 
 # --- Static Files and Templates ---
@@ -331,29 +484,94 @@ if not CAPTURE_DIR_BASE.exists():
     CAPTURE_DIR_BASE.mkdir(parents=True, exist_ok=True)
 
 app.mount("/static", StaticFiles(directory="static"), name="static")
-app.mount("/captures", StaticFiles(directory=CAPTURE_DIR_BASE), name="captures")
+# Captures still staged in the RAM spool are served from there
+app.mount("/captures", SpoolStaticFiles(directory=CAPTURE_DIR_BASE, spool=capture_spool), name="captures")
 templates = Jinja2Templates(directory="templates")
 
 # --- Helper Functions ---
 def get_recent_captures(limit: int = 20):
     """Returns a list of recent capture filenames (relative to CAPTURE_DIR_BASE)."""
-    image_dir = CAPTURE_DIR_BASE / "images"
-    if not image_dir.exists():
-        return []
-    
-    files = []
-    for path in image_dir.rglob("*.jpg"):
-        files.append(path)
-    
-    # Sort by modification time, newest first
-    files.sort(key=lambda p: p.stat().st_mtime, reverse=True)
-    
-    # Return relative paths
-    return [str(p.relative_to(CAPTURE_DIR_BASE)) for p in files[:limit]]
+    return capture_index.recent(limit)
 
 @app.get("/api/captures")
-async def get_captures():
-    return get_recent_captures()
+async def get_captures(request: Request, since: int | None = None, before: int | None = None,
+                       limit: int = Query(50, ge=1, le=500), camera: str | None = None,
+                       subfolder: str | None = None, prefix: str | None = None,
+                       start: float | None = None, end: float | None = None):
+    """
+    Without parameters: the 20 most recent capture paths (legacy list).
+    With any parameter: a cursor page from the capture index. Pass the returned `cursor`
+    as `since` to receive only entries added/removed after it, or `next_before` as
+    `before` to page back through older captures. `start`/`end` are Unix timestamps.
+    """
+    if not request.query_params:
+        return get_recent_captures()
+    return capture_index.changes(since=since, before=before, limit=limit, camera=camera,
+                                 subfolder=subfolder, prefix=prefix, start=start, end=end)
+@app.get("/api/manifest")
+async def get_manifest(subfolder: str | None = None, camera: str | None = None, request_id: str | None = None,
+                       start: float | None = None, end: float | None = None,
+                       limit: int = Query(1000, ge=1, le=10000)):
+    """Queries the dataset manifest (capture metadata, size, checksum) without opening any image."""
+    return await asyncio.to_thread(manifest_writer.query, subfolder=subfolder, camera=camera,
+                                   request_id=request_id, start=start, end=end, limit=limit)
+
+@app.get("/api/manifest/{subfolder}.jsonl")
+async def download_manifest(subfolder: str):
+    """The raw append-only JSONL manifest of one subfolder."""
+    path = manifest_writer.path_for(subfolder)
+    if not path.exists():
+        raise HTTPException(status_code=404, detail="No manifest for this subfolder")
+    return FileResponse(path, media_type="application/x-ndjson", filename=path.name)
+
+class ExportRequest(BaseModel):
+    format: str = "zip"
+    files: list[str] | None = None # Explicit selection (paths relative to /captures); overrides the filters
+    subfolder: str | None = None
+    camera: str | None = None
+    prefix: str | None = None
+    start: float | None = None
+    end: float | None = None
+
+def export_response(request: ExportRequest):
+    """Streams the selected captures as a ZIP (stored) or TAR archive, built on the fly."""
+    if request.format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported format '{request.format}' (use zip or tar)")
+    stream, media_type = EXPORT_FORMATS[request.format]
+    base = CAPTURE_DIR_BASE.resolve()
+
+    def entries():
+        if request.files is not None:
+            selection = request.files
+        else:
+            selection = capture_index.iter_selection(subfolder=request.subfolder, camera=request.camera,
+                                                     prefix=request.prefix, start=request.start, end=request.end)
+        for rel in selection:
+            target = (CAPTURE_DIR_BASE / rel).resolve()
+            if not str(target).startswith(str(base) + os.sep):
+                print(f"[Export] Access denied: {rel}", file=sys.stderr)
+                continue
+            arcname = target.relative_to(base).as_posix()
+            # Captures still in the RAM spool are read from there
+            yield arcname, capture_spool.locate(target)
+
+    filename = f"captures_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{request.format}"
+    # A plain generator: Starlette iterates it in a worker thread, so file reads never block the loop
+    return StreamingResponse(stream(entries()), media_type=media_type,
+                             headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+@app.get("/api/export")
+async def export_captures(format: str = "zip", subfolder: str | None = None, camera: str | None = None,
+                          prefix: str | None = None, start: float | None = None, end: float | None = None):
+    """Downloads every capture matching the filters (same as /api/captures) as one archive."""
+    return export_response(ExportRequest(format=format, subfolder=subfolder, camera=camera,
+                                         prefix=prefix, start=start, end=end))
+
+@app.post("/api/export")
+async def export_selection(request: ExportRequest):
+    """Like GET /api/export, but also accepts an explicit list of files."""
+    return export_response(request)
+
 def parse_shutter_speed(shutter_speed_str: str) -> int:
     """Parses a shutter speed string (e.g., '1/100s', 'Auto') into an integer in microseconds."""
     if shutter_speed_str.lower() == 'auto':
@@ -369,6 +587,11 @@ def parse_shutter_speed(shutter_speed_str: str) -> int:
     except (ValueError, ZeroDivisionError):
         return 0
 
+def create_usb_camera(cam_info):
+    """USBCamera for an available_cameras entry. MJPEG passthrough is on unless the config turns it off."""
+    return USBCamera(path=cam_info['path'], friendly_name=cam_info['friendly_name'],
+                     mjpeg_passthrough=cam_info.get('mjpeg_passthrough', True))
+
 async def perform_global_capture(request: CaptureAllRequest, source: str = "Unknown"):
     """
     Executes the capture logic for all active cameras based on the request.
@@ -378,6 +601,14 @@ async def perform_global_capture(request: CaptureAllRequest, source: str = "Unkn
         print(f"[{source}] No active or configured cameras to capture from.", file=sys.stderr)
         return None
 
+    # Refuse to write when the disk is nearly full (the OS, logs and config need room too)
+    try:
+        storage_manager.check_capture_allowed()
+    except StorageFullError as e:
+        print(f"[{source}] Capture rejected: {e}", file=sys.stderr)
+        await publish_storage_error(str(e), source)
+        raise
+
     # If active_cameras is empty (e.g. cold start from MQTT), try to populate it from available_cameras
     # This ensures we capture from all known cameras if no specific subset is running
     if not active_cameras:
@@ -385,7 +616,7 @@ async def perform_global_capture(request: CaptureAllRequest, source: str = "Unkn
         for cam_path, cam_info in available_cameras.items():
             try:
                 if cam_info.get('type') == 'usb':
-                     active_cameras[cam_path] = USBCamera(path=cam_info['path'], friendly_name=cam_info['friendly_name'])
+                     active_cameras[cam_path] = create_usb_camera(cam_info)
                 elif cam_info.get('type') == 'pi':
                     active_cameras[cam_path] = PiCamera(
                         camera_id=cam_info['path'],
@@ -422,8 +653,11 @@ async def perform_global_capture(request: CaptureAllRequest, source: str = "Unkn
 
     original_settings = {}
     captured_files = []
+    closed_shards = []
     global capture_count
 
+    # Uploads slow down while capturing so capture latency stays stable
+    upload_throttle.capture_started()
     try:
         # 1. Determine Settings for All Cameras
         print(f"[{source}] !!! ENTERING CAPTURE SEQUENCE !!!", file=sys.stderr, flush=True)
@@ -476,6 +710,9 @@ async def perform_global_capture(request: CaptureAllRequest, source: str = "Unkn
             # Format: PREFIX_WxH_CAM_TIME.jpg
             filename = f"{safe_prefix}_{width}x{height}_{camera_path.replace('/', '_')}_{capture_time}.jpg"
             save_path = current_save_dir / filename
+            # Everything is written to a hidden temp file that is renamed into place when complete
+            use_spool = False
+            write_path = capture_writer.temp_path(save_path)
             
             # Apply other settings (AF, Shutter)
             if isinstance(camera, PiCamera):
@@ -500,11 +737,17 @@ async def perform_global_capture(request: CaptureAllRequest, source: str = "Unkn
             # Perform Capture
             print(f"[{source}] Capturing from {camera_path} to {save_path} (Res: {width}x{height})... setup took {time.time()-t_start_cam:.3f}s", file=sys.stderr)
             t_cap_start = time.time()
+            cam_meta = {}
             try:
-                # Ensure camera is running
-                if not camera.is_running:
-                     camera.start()
-                     # time.sleep(2) # Warmup (removed as it blocks and makes capture slow)
+                # With the RAM spool enabled (and room for this capture) the temp file lives in the spool
+                use_spool = capture_spool.enabled and await asyncio.to_thread(capture_spool.reserve, save_path)
+                if use_spool:
+                    write_path = capture_spool.temp_path(save_path)
+
+                # Ensure camera is running (cold start or resume from idle suspend)
+                start_latency = await camera_lifecycle.ensure_running(camera_path, camera)
+                if start_latency:
+                     print(f"[{source}] {camera_path} was not running. Start added {start_latency:.3f}s to this capture.", file=sys.stderr)
 
                 if isinstance(camera, PiCamera):
                      if capture_req.autofocus:
@@ -516,30 +759,25 @@ async def perform_global_capture(request: CaptureAllRequest, source: str = "Unkn
                           if hasattr(camera.picam2, 'autofocus_cycle'):
                                camera.picam2.autofocus_cycle()
                      
-                     # Direct to File Capture (OOM Safe)
-                     camera.capture_to_file(str(save_path), width=width, height=height)
+                     # Direct to File Capture (OOM Safe). Runs off the event loop so preview
+                     # streams keep being served (with their held frame) while the camera is busy.
+                     # Returns the metadata of the saved frame (used for EXIF and the manifest)
+                     cam_meta = await asyncio.to_thread(camera.capture_to_file, str(write_path), width=width, height=height) or {}
                 
                 else:
                      # USB Camera
-                     camera.capture_to_file(str(save_path), width=width, height=height)
+                     await asyncio.to_thread(camera.capture_to_file, str(write_path), width=width, height=height)
 
                 print(f"[{source}] Core capture_to_file took {time.time()-t_cap_start:.3f}s", file=sys.stderr)
                 t_post_cap = time.time()
 
-                captured_files.append(str(save_path))
-                capture_count += 1
-                
-                # Metadata (Exif) logic - reload file to add exif? 
-                # Picamera2 might handle some, but we did manual insertion before.
-                # If we want ExposureTime, we need to read metadata.
-                # Capture_to_file doesn't return metadata easily unless we access it from picam2 state.
+                # Metadata (Exif) logic: add the saved frame's ExposureTime
                 if isinstance(camera, PiCamera):
-                     metadata = camera.picam2.capture_metadata()
-                     exposure_time_us = metadata.get('ExposureTime', 0)
+                     exposure_time_us = cam_meta.get('ExposureTime', 0)
                      if exposure_time_us > 0:
                           try:
                               exif_dict = {"Exif": {piexif.ExifIFD.ExposureTime: (exposure_time_us, 1_000_000)}}
-                              piexif.insert(piexif.dump(exif_dict), str(save_path))
+                              piexif.insert(piexif.dump(exif_dict), str(write_path))
                           except Exception as e:
                               print(f"Failed to add EXIF: {e}", file=sys.stderr)
 
@@ -551,7 +789,7 @@ async def perform_global_capture(request: CaptureAllRequest, source: str = "Unkn
                         print(f"[{source}] Applying overlay to {save_path}...", file=sys.stderr)
                         
                         # Open Image
-                        with Image.open(str(save_path)) as img:
+                        with Image.open(str(write_path)) as img:
                             draw = ImageDraw.Draw(img)
                             
                             # Prepare Text
@@ -562,9 +800,8 @@ async def perform_global_capture(request: CaptureAllRequest, source: str = "Unkn
                             # Try to get exposure info if available (PiCamera)
                             exposure_info = ""
                             if isinstance(camera, PiCamera):
-                                meta = camera.picam2.capture_metadata() if camera.picam2 else {}
-                                exp_time = meta.get('ExposureTime', 0) / 1000000.0 # seconds
-                                iso_val = meta.get('AnalogueGain', 0) * 100 # Approx ISO
+                                exp_time = cam_meta.get('ExposureTime', 0) / 1000000.0 # seconds
+                                iso_val = cam_meta.get('AnalogueGain', 0) * 100 # Approx ISO
                                 if exp_time > 0:
                                     if exp_time < 1:
                                         exposure_info = f" | 1/{int(1/exp_time)}s"
@@ -595,14 +832,60 @@ async def perform_global_capture(request: CaptureAllRequest, source: str = "Unkn
                             draw.text(text_pos, overlay_text, font=font, fill="white")
                             
                             # Save back
-                            img.save(str(save_path))
+                            img.save(str(write_path))
                             print(f"[{source}] Overlay applied in {time.time()-t_overlay:.3f}s.", file=sys.stderr)
 
                 except Exception as e:
                     print(f"[{source}] Failed to apply overlay: {e}", file=sys.stderr)
 
+                # Publish the finished file under its final name (fsync per the sync policy),
+                # or hand it to the spool, which flushes it to disk in the background
+                if use_spool:
+                    capture_spool.stage(write_path, save_path)
+                else:
+                    await asyncio.to_thread(capture_writer.commit, write_path, save_path)
+                captured_files.append(str(save_path))
+                capture_count += 1
+
+                record = None
+                if manifest_writer.enabled or shard_writer.enabled:
+                    try:
+                        record = await asyncio.to_thread(
+                            write_manifest, save_path,
+                            camera=camera_path,
+                            camera_name=camera.friendly_name,
+                            subfolder=safe_current_subfolder_name,
+                            width=width,
+                            height=height,
+                            timestamp=capture_time / 1000,
+                            sensor_timestamp=cam_meta.get('SensorTimestamp'),
+                            exposure_us=cam_meta.get('ExposureTime'),
+                            analogue_gain=cam_meta.get('AnalogueGain'),
+                            lens_position=cam_meta.get('LensPosition'),
+                            source=source,
+                            request_id=request.request_id
+                        )
+                    except Exception as e:
+                        print(f"[{source}] Failed to write manifest record for {save_path}: {e}", file=sys.stderr)
+
+                if shard_writer.enabled:
+                    try:
+                        sample_meta = record or {"file": str(save_path.relative_to(CAPTURE_DIR_BASE))}
+                        closed_shards.extend(await asyncio.to_thread(pack_into_shard, save_path, safe_current_subfolder_name, sample_meta))
+                    except Exception as e:
+                        print(f"[{source}] Failed to add {save_path} to shard: {e}", file=sys.stderr)
+                    if not shard_writer.keep_files and not capture_spool.locate(save_path).exists():
+                        continue # Packed and removed; the shard is the only copy
+
+                try:
+                    capture_index.add(save_path, camera=camera_path, stat_path=capture_spool.locate(save_path))
+                except Exception as e:
+                    print(f"[{source}] Failed to index {save_path}: {e}", file=sys.stderr)
+
                 # Broadcast
                 relative_filename = str(save_path.relative_to(CAPTURE_DIR_BASE))
+                if thumbnails_at_capture:
+                    asyncio.create_task(generate_thumbnail(relative_filename))
                 await manager.broadcast({
                     "type": "new_file",
                     "filename": relative_filename,
@@ -613,43 +896,26 @@ async def perform_global_capture(request: CaptureAllRequest, source: str = "Unkn
             except Exception as e:
                 print(f"[{source}] Capture failed for {camera_path}: {e}", file=sys.stderr)
                 # Cleanup partial file
-                if save_path.exists() and save_path.stat().st_size == 0:
-                     save_path.unlink()
+                capture_writer.discard(write_path)
+                if use_spool:
+                    capture_spool.release(save_path) # Return the spool space reserved for it
 
         print(f"[{source}] Capture sequence complete. Total files saved: {len(captured_files)}", file=sys.stderr, flush=True)
-        print(f"[{source}] !!! CHECKING SFTP LOGIC !!!", file=sys.stderr, flush=True)
 
         # --- Auto SFTP Transfer Logic ---
-        from sftp_handler import SFTPHandler
+        # Captures go to the durable upload queue; the upload worker sends them in batches
         try:
-            handler = SFTPHandler()
-            is_enabled = handler.config and handler.config.get('enabled', False)
-            
-            
-            global pending_transfers
-            
-            print(f"[{source}] SFTP Debug: ConfigLoaded={bool(handler.config)}, Enabled={is_enabled}, Captured={len(captured_files)}, PendingBefore={len(pending_transfers)}", file=sys.stderr)
-
-            if is_enabled:
-                if captured_files:
-                    pending_transfers.extend(captured_files)
-                    
-                    batch_size = handler.config.get('batch_size', 10)
-                    print(f"[{source}] SFTP Check: Pending={len(pending_transfers)}, BatchSize={batch_size}, Enabled={is_enabled}", file=sys.stderr)
-                    
-                    if len(pending_transfers) >= batch_size:
-                        print(f"[{source}] Triggering SFTP transfer for {len(pending_transfers)} files...", file=sys.stderr)
-                        batch = list(pending_transfers)
-                        pending_transfers.clear()
-                        asyncio.create_task(run_sftp_transfer(batch))
-            else:
-                if pending_transfers:
-                    print(f"[{source}] SFTP disabled. Clearing {len(pending_transfers)} pending items.", file=sys.stderr)
-                    pending_transfers.clear()
+            if shard_writer.enabled:
+                # Closed shards are the upload unit; loose captures are not queued
+                queue_closed_shards(closed_shards)
+            elif captured_files:
+                queued = enqueue_uploads(captured_files)
+                print(f"[{source}] SFTP: {queued} file(s) queued for upload.", file=sys.stderr)
         except Exception as e:
             print(f"Error in SFTP logic: {e}", file=sys.stderr)
 
     finally:
+        upload_throttle.capture_finished()
         # 4. Revert all settings
         print(f"[{source}] Reverting all camera settings...", file=sys.stderr)
         for camera_path, settings in original_settings.items():
@@ -676,83 +942,432 @@ async def perform_global_capture(request: CaptureAllRequest, source: str = "Unkn
 
     return captured_files
 
-async def run_sftp_transfer(file_list):
-    """Runs the SFTP transfer in a separate thread/task."""
-    from sftp_handler import SFTPHandler
-    
-    async def _broadcast_deletions(deleted_files):
-         if not deleted_files: return
-         for fpath in deleted_files:
-             try:
-                rel_path = str(pathlib.Path(fpath).relative_to(CAPTURE_DIR_BASE))
-             except ValueError:
-                rel_path = str(pathlib.Path(fpath).name)
-                
-             await manager.broadcast({
-                 "type": "file_deleted",
-                 "filename": rel_path
-             })
+async def sync_flush_loop():
+    """Makes sure a partially filled fsync group is flushed within sync_group_ms."""
+    while True:
+        await asyncio.sleep(max(capture_writer.group_ms, 100) / 1000)
+        try:
+            await asyncio.to_thread(capture_writer.flush_if_due)
+        except Exception as e:
+            print(f"[Writer] Group fsync failed: {e}", file=sys.stderr)
+
+def write_manifest(save_path, **fields):
+    """Builds a capture's manifest record (size, checksum, metadata) and appends it to its subfolder's manifest when enabled."""
+    with capture_spool.pinned([save_path]) as (read_path,):
+        record = manifest_writer.build_record(save_path, read_path, **fields)
+    if manifest_writer.enabled:
+        manifest_writer.append(fields["subfolder"], record)
+    return record
+
+def pack_into_shard(save_path, subfolder, metadata):
+    """Appends a capture to its subfolder's tar shard (reading the RAM copy if spooled). Returns closed shards."""
+    with capture_spool.pinned([save_path]) as (read_path,):
+        closed = shard_writer.add(subfolder, read_path, metadata, final_path=save_path)
+        if not shard_writer.keep_files:
+            os.remove(read_path)
+    return closed
+
+def queue_closed_shards(shards):
+    """Queues closed shards (tar + index) for upload when SFTP is enabled; otherwise they stay in captures/shards."""
+    if not shards:
+        return
+    paths, members = [], {}
+    for shard in shards:
+        paths.extend([shard["path"], shard["index"]])
+        # Uploading the shard marks the captures packed in it as uploaded
+        members[shard["path"]] = shard["members"]
+    if enqueue_uploads(paths, members=members):
+        print(f"[Shards] Queued {len(shards)} closed shard(s) for upload.", file=sys.stderr)
+
+async def shard_close_loop():
+    """Closes shards that have been open longer than max_age_s so slow subfolders still get uploaded."""
+    while True:
+        await asyncio.sleep(10)
+        try:
+            queue_closed_shards(await asyncio.to_thread(shard_writer.close_idle))
+        except Exception as e:
+            print(f"[Shards] Failed to close idle shards: {e}", file=sys.stderr)
+
+async def reconcile_fs_event(kind, rel):
+    """
+    Applies a filesystem change seen by the watcher (after `settle_s`) to the capture
+    index, thumbnails and WebSocket clients. Changes the app made itself are already
+    reflected in the index by then and are not announced twice.
+    """
+    image_rel = f"images/{rel}"
+    path = CAPTURE_DIR_BASE / image_rel
+    try:
+        if kind == "file_created":
+            if not path.name.lower().endswith(IMAGE_EXTENSIONS) or not path.exists() or capture_index.contains(path):
+                return
+            capture_index.add(path)
+            await manager.broadcast({"type": "new_file", "filename": image_rel, "source": "Watcher"})
+        elif kind == "file_deleted":
+            if path.exists() or capture_spool.locate(path) != path or not capture_index.contains(path):
+                return
+            capture_index.remove(path)
+            thumbnail_cache.discard(image_rel)
+            await manager.broadcast({"type": "file_deleted", "filename": image_rel})
+        elif kind == "dir_deleted":
+            capture_index.remove_tree(path)
+            thumbnail_cache.discard_tree(image_rel)
+        if kind in ("dir_created", "dir_deleted"):
+            parent = rel.rsplit("/", 1)[0] if "/" in rel else ""
+            await manager.broadcast({"type": "directory_changed", "path": parent})
+    except Exception as e:
+        print(f"[Watcher] Failed to apply {kind} for {rel}: {e}", file=sys.stderr)
+
+async def generate_thumbnail(relative_filename):
+    """Pre-generates a gallery thumbnail off the event loop. Failures only mean it is made lazily later."""
+    try:
+        await asyncio.to_thread(thumbnail_cache.generate, relative_filename)
+    except Exception as e:
+        print(f"[Thumbs] Failed to generate thumbnail for {relative_filename}: {e}", file=sys.stderr)
+
+def load_transfer_config():
+    """The transfer config (SFTP or another backend) if auto-transfer is enabled, else None."""
+    from transfer_backends import load_transfer_config as _load
+    config = _load()
+    return config if config and config.get('enabled', False) else None
+
+def upload_exists(path):
+    """Whether a queued file still exists, on disk or in the RAM spool."""
+    return pathlib.Path(capture_spool.locate(path)).exists()
+
+def enqueue_uploads(paths, members=None):
+    """Adds files to the durable upload queue when SFTP is enabled and wakes the worker. Returns how many."""
+    if not paths or not load_transfer_config():
+        return 0
+    sizes = {}
+    for path in paths:
+        try:
+            sizes[path] = pathlib.Path(capture_spool.locate(path)).stat().st_size
+        except OSError:
+            pass
+    count = upload_queue.enqueue(paths, members=members, sizes=sizes)
+    upload_wakeup.set()
+    return count
+
+def upload_candidates():
+    """
+    Files that were never uploaded, split by when auto-transfer was enabled: (since, before).
+    Closed shards that are not marked uploaded in shard mode, otherwise captures the index
+    has not seen uploaded. Both lists are empty while auto-transfer is off.
+    """
+    since = upload_queue.enabled_since()
+    if not load_transfer_config() or since is None:
+        return [], []
+    if shard_writer.enabled:
+        # Shards marked as uploaded (and kept locally) are not sent again
+        recent, backlog = [], []
+        for path, _, mtime in shard_writer.closed_shards(uploaded=False):
+            (recent if mtime >= since else backlog).extend([path, f"{path}.idx.jsonl"])
+        return recent, backlog
+    recent = capture_index.oldest(10 ** 9, uploaded=False, newer_than=since)
+    backlog = capture_index.oldest(10 ** 9, uploaded=False, older_than=since)
+    return [str(CAPTURE_DIR_BASE / p) for p, _ in recent], [str(CAPTURE_DIR_BASE / p) for p, _ in backlog]
+
+async def reconcile_upload_queue():
+    """
+    Syncs the upload queue with the disk: drops entries whose file is gone and, when
+    auto-transfer is enabled, queues files captured since then that never made it into
+    the queue. Older files (captured while transfer was off) are only counted; they are
+    queued by POST /api/uploads/backlog, since uploading usually deletes them locally.
+    """
+    global upload_backlog
+    try:
+        await asyncio.to_thread(upload_queue.set_enabled, bool(await asyncio.to_thread(load_transfer_config)))
+        recent, backlog = await asyncio.to_thread(upload_candidates)
+        _, _, upload_backlog = await asyncio.to_thread(upload_queue.reconcile, upload_exists, recent, backlog)
+        upload_wakeup.set()
+    except Exception as e:
+        print(f"[Uploads] Failed to reconcile upload queue: {e}", file=sys.stderr)
+
+def upload_flush_reason(config, flush=False):
+    """
+    Why the queue should send a batch now, or None to keep collecting: `batch_size`
+    files, `batch_mb` of data, a file waiting longer than `batch_max_age_s`, or `flush`.
+    """
+    count, size, oldest = upload_queue.due()
+    if not count:
+        return None
+    if flush:
+        return "flush requested"
+    if shard_writer.enabled:
+        return "closed shard" # Shards already roll over by size, count and age
+    batch_size = max(1, int(config.get('batch_size', 10)))
+    batch_mb = config.get('batch_mb', 64)
+    max_age_s = config.get('batch_max_age_s', 600)
+    if count >= batch_size:
+        return f"{count} files"
+    if batch_mb and size >= batch_mb * 1024 * 1024:
+        return f"{size / (1024 * 1024):.1f} MB"
+    if max_age_s and time.time() - oldest >= max_age_s:
+        return f"oldest file waited {time.time() - oldest:.0f}s"
+    return None
+
+async def upload_worker():
+    """
+    Background timer for the upload queue: every few seconds (or when woken by a
+    capture) it checks the flush conditions and sends batches while they hold.
+    """
+    global upload_flush_requested
+    while True:
+        try:
+            await asyncio.wait_for(upload_wakeup.wait(), timeout=5)
+        except asyncio.TimeoutError:
+            pass
+        upload_wakeup.clear()
+        try:
+            config = await asyncio.to_thread(load_transfer_config)
+            if not config:
+                continue # Queue is kept until SFTP is enabled again
+            # Taken when the drain starts: a flush requested during a batch wakes the next pass
+            flush, upload_flush_requested = upload_flush_requested, False
+            if not flush and not upload_throttle.in_window():
+                continue # Outside the upload windows; an explicit flush still goes through
+            batch_size = max(1, int(config.get('batch_size', 10)))
+            max_bytes = int((config.get('batch_mb', 64) or 0) * 1024 * 1024)
+            while True:
+                reason = await asyncio.to_thread(upload_flush_reason, config, flush)
+                if not reason:
+                    break
+                entries = await asyncio.to_thread(upload_queue.claim, batch_size, max_bytes)
+                if not entries:
+                    break
+                print(f"[Uploads] Uploading batch of {len(entries)} file(s) ({reason})...", file=sys.stderr)
+                if not await run_transfer(entries):
+                    break # Nothing went through (server down or SFTP disabled); wait before trying more
+        except Exception as e:
+            print(f"[Uploads] Worker error: {e}", file=sys.stderr)
+
+async def run_transfer(entries):
+    """
+    Uploads one batch of queue entries with the configured backend (in the transfer
+    process, or a thread) and records the outcome. Returns the uploaded paths.
+    """
+    file_list = [entry["path"] for entry in entries]
+    # Deleted (e.g. from the gallery) while waiting in the queue
+    missing = await asyncio.to_thread(lambda: [path for path in file_list if not upload_exists(path)])
+    if missing:
+        await asyncio.to_thread(upload_queue.drop, missing)
+        file_list = [path for path in file_list if path not in missing]
+    if not file_list:
+        return []
+
+    loop = asyncio.get_running_loop()
+    progress = {"done": 0, "total": len(file_list)}
+
+    async def _file_uploaded(final_path, sent, deleted):
+        """Reported per file as the transfer process verifies (and deletes) it."""
+        rel_path = pathlib.Path(final_path).relative_to(CAPTURE_DIR_BASE)
+        progress["done"] += 1
+        await manager.broadcast({
+            "type": "upload_progress",
+            "filename": str(rel_path),
+            "bytes": sent,
+            "done": progress["done"],
+            "total": progress["total"]
+        })
+        if deleted and not pathlib.Path(final_path).is_relative_to(shard_writer.shard_dir):
+            await asyncio.to_thread(capture_index.remove, [final_path])
+            thumbnail_cache.discard([rel_path])
+            await manager.broadcast({
+                "type": "file_deleted",
+                "filename": str(rel_path)
+            })
+
+    errors = {}
 
     def _transfer():
         try:
-            handler = SFTPHandler()
-            if handler.config and handler.config.get('enabled', False): 
-                return handler.upload_files(file_list) # Returns list of deleted files
-            return []
+            # Files still in the RAM spool are uploaded from there and held until done
+            with capture_spool.pinned(file_list) as read_paths:
+                final_names = dict(zip(read_paths, file_list))
+
+                def on_file_done(path, sent, deleted):
+                    asyncio.run_coroutine_threadsafe(_file_uploaded(final_names.get(path, path), sent, deleted), loop)
+
+                # Mirror the local layout (images/<subfolder>/..., shards/<prefix>/...) at the destination
+                remote_paths = [pathlib.Path(path).relative_to(CAPTURE_DIR_BASE).as_posix() for path in file_list]
+                result = transfer_process.run(read_paths, remote_paths, on_file_done)
+                result["uploaded"] = [final_names.get(path, path) for path in result["uploaded"]]
+                errors.update({final_names.get(path, path): e for path, e in result["errors"].items()})
+                return result
         except Exception as e:
-            print(f"SFTP Transfer Error: {e}", file=sys.stderr)
-            return []
+            print(f"Transfer Error: {e}", file=sys.stderr)
+            return {"enabled": True, "uploaded": [], "delete_after_upload": True, "max_attempts": 10}
 
-    # Run blocking SFTP IO in a thread
-    deleted = await asyncio.to_thread(_transfer)
-    if deleted:
-         await _broadcast_deletions(deleted)
+    # The calling thread only waits; the upload itself runs in the transfer process
+    result = await asyncio.to_thread(_transfer)
+    if not result["enabled"]:
+        await asyncio.to_thread(upload_queue.release, file_list) # Auto-transfer was disabled meanwhile; keep them queued
+        return []
+    uploaded = result["uploaded"]
+    await asyncio.to_thread(upload_queue.complete, uploaded)
+    failed = [path for path in file_list if path not in set(uploaded)]
+    if failed:
+        # Retried by the worker after a backoff delay, until max_attempts
+        await asyncio.to_thread(upload_queue.fail, failed, "upload failed", max_attempts=result["max_attempts"], errors=errors)
+
+    # Shards are not in the capture index; their uploaded status goes to the captures packed in them
+    packed = [m for entry in entries if entry["path"] in uploaded for m in entry["members"]]
+    if packed:
+        await asyncio.to_thread(capture_index.mark_uploaded, packed)
+    uploaded_captures = [f for f in uploaded if not pathlib.Path(f).is_relative_to(shard_writer.shard_dir)]
+    if uploaded_captures and not result["delete_after_upload"]:
+         # Kept locally; retention deletes these first when space runs low
+         await asyncio.to_thread(capture_index.mark_uploaded, uploaded_captures)
+    if len(uploaded_captures) < len(uploaded) and not result["delete_after_upload"]:
+         # Kept shards become eligible for retention and are not queued again
+         await asyncio.to_thread(shard_writer.mark_uploaded, uploaded)
+    return uploaded
 
 # --- Video Streaming Generator ---
-async def stream_generator(camera_path: str, quality: int = 80, max_width: int = 1280):
+async def stream_generator(camera_path: str, quality: int = 80, max_width: int = 1280, session=None):
     camera = active_cameras.get(camera_path)
     if not camera or not camera.is_running:
         print("Camera not active for streaming", file=sys.stderr)
+        if session:
+            stream_registry.close(session)
         return
 
     encode_param = [int(cv2.IMWRITE_JPEG_QUALITY), quality]
+    last_seq = -1
 
-    while True:
-        try:
-            frame_rgb = camera.capture_array()
-            if frame_rgb is None:
-                await asyncio.sleep(0.01)
-                continue
-
-            # Smart Downscaling: Resize BEFORE color conversion to save CPU/RAM
-            # Check dimensions (height, width, channels)
-            h, w = frame_rgb.shape[:2]
-            if w > max_width:
-                aspect_ratio = w / h
-                new_h = int(max_width / aspect_ratio)
-                # cv2.resize expects (width, height)
-                frame_rgb = cv2.resize(frame_rgb, (max_width, new_h), interpolation=cv2.INTER_AREA)
-
-            if isinstance(camera, PiCamera):
-                frame_bgr = cv2.cvtColor(frame_rgb, cv2.COLOR_RGB2BGR)
-                flag, encoded_image = cv2.imencode(".jpg", frame_bgr, encode_param)
-            else: # USBCamera
-                flag, encoded_image = cv2.imencode(".jpg", frame_rgb, encode_param)
-
-            if not flag:
+    # Register as a consumer so the camera loop runs at full rate while we stream
+    consumer = object()
+    camera.acquire(consumer, kind="stream")
+    try:
+        while True:
+            if session and session.cancelled:
+                print(f"[Streams] Stream {session.id} for {camera_path} stopped ({session.cancel_reason}).", file=sys.stderr)
+                break
+            if camera.preview_paused.is_set():
+                # A still capture owns the camera; the client keeps showing the last frame
+                await asyncio.sleep(0.05)
                 continue
+            try:
+                # USB MJPEG passthrough: forward the camera's own JPEG when no downscale is needed
+                jpeg = camera.get_jpeg() if isinstance(camera, USBCamera) else None
+                if jpeg is not None and camera.width <= max_width:
+                    if camera.frame_seq == last_seq:
+                        await asyncio.sleep(0.01)
+                        continue
+                    last_seq = camera.frame_seq
+                    yield (b'--frame\r\n'
+                           b'Content-Type: image/jpeg\r\n\r\n' + jpeg + b'\r\n')
+                    if session:
+                        session.record_frame(len(jpeg))
+                    perf_mode = system_config.get("_resolved_performance_mode", "high")
+                    await asyncio.sleep(0.1 if perf_mode == "low" else 0.01)
+                    continue
+
+                frame_rgb = camera.capture_array()
+                if frame_rgb is None:
+                    await asyncio.sleep(0.01)
+                    continue
+
+                # Smart Downscaling: Resize BEFORE color conversion to save CPU/RAM
+                # Check dimensions (height, width, channels)
+                h, w = frame_rgb.shape[:2]
+                if w > max_width:
+                    aspect_ratio = w / h
+                    new_h = int(max_width / aspect_ratio)
+                    # cv2.resize expects (width, height)
+                    frame_rgb = cv2.resize(frame_rgb, (max_width, new_h), interpolation=cv2.INTER_AREA)
 
-            yield (b'--frame\r\n'
-                   b'Content-Type: image/jpeg\r\n\r\n' + bytearray(encoded_image) + b'\r\n')
-            
-            # FPS Throttling based on Performance Mode
-            perf_mode = system_config.get("_resolved_performance_mode", "high")
-            sleep_duration = 0.1 if perf_mode == "low" else 0.01
-            await asyncio.sleep(sleep_duration)
-        except Exception as e:
-            print(f"Error in stream_generator for {camera_path}: {e}", file=sys.stderr)
-            # If the client disconnects, this loop will break.
-            break
+                if isinstance(camera, PiCamera):
+                    frame_bgr = cv2.cvtColor(frame_rgb, cv2.COLOR_RGB2BGR)
+                    flag, encoded_image = cv2.imencode(".jpg", frame_bgr, encode_param)
+                else: # USBCamera
+                    flag, encoded_image = cv2.imencode(".jpg", frame_rgb, encode_param)
+
+                if not flag:
+                    continue
+
+                yield (b'--frame\r\n'
+                       b'Content-Type: image/jpeg\r\n\r\n' + bytearray(encoded_image) + b'\r\n')
+                if session:
+                    session.record_frame(len(encoded_image))
+
+                # FPS Throttling based on Performance Mode
+                perf_mode = system_config.get("_resolved_performance_mode", "high")
+                sleep_duration = 0.1 if perf_mode == "low" else 0.01
+                await asyncio.sleep(sleep_duration)
+            except Exception as e:
+                print(f"Error in stream_generator for {camera_path}: {e}", file=sys.stderr)
+                # If the client disconnects, this loop will break.
+                break
+    finally:
+        camera.release(consumer)
+        if session:
+            stream_registry.close(session)
+
+async def mosaic_generator(camera_paths: list[str] | None = None, columns: int = 0, tile_width: int = 480,
+                           quality: int = 70, labels: bool = True, session=None):
+    """Streams one composite MJPEG feed tiling the latest frame of every active camera."""
+    # 16:9 tiles; frames with other aspect ratios are letterboxed
+    tile_width = max(64, tile_width - tile_width % 2)
+    tile_height = (tile_width * 9 // 16) & ~1
+
+    consumer = object()
+    held = {}
+    resuming = {} # cam_path -> ensure_running task; other tiles keep streaming meanwhile
+    retry_at = {}
+    try:
+        while True:
+            if session and session.cancelled:
+                print(f"[Streams] Mosaic stream {session.id} stopped ({session.cancel_reason}).", file=sys.stderr)
+                break
+            try:
+                paths = camera_paths or list(active_cameras.keys())
+                tiles = []
+                for cam_path in paths:
+                    camera = active_cameras.get(cam_path)
+                    if held.get(cam_path) is not None and held[cam_path] is not camera:
+                        # Restarted, reconfigured or removed: let the old object drop to idle
+                        held.pop(cam_path).release(consumer)
+                    if camera and cam_path not in held:
+                        camera.acquire(consumer, kind="mosaic")
+                        held[cam_path] = camera
+                    task = resuming.get(cam_path)
+                    if task and task.done():
+                        resuming.pop(cam_path)
+                        if task.exception():
+                            print(f"[Streams] Mosaic could not start {cam_path}: {task.exception()}", file=sys.stderr)
+                    if camera and not camera.is_running and cam_path not in resuming and time.time() >= retry_at.get(cam_path, 0):
+                        # Cold or auto-suspended: resume it like /video_feed does
+                        retry_at[cam_path] = time.time() + 5
+                        resuming[cam_path] = asyncio.create_task(camera_lifecycle.ensure_running(cam_path, camera))
+                    frame = camera.capture_array() if camera and camera.is_running else None
+                    label = camera.friendly_name if camera else cam_path
+                    tiles.append((label, frame, isinstance(camera, PiCamera)))
+
+                canvas = compose_mosaic(tiles, tile_width=tile_width, tile_height=tile_height,
+                                        columns=columns, labels=labels)
+                if canvas is None:
+                    await asyncio.sleep(0.5)
+                    continue
+
+                part = encode_mjpeg_part(canvas, quality)
+                if part:
+                    yield part
+                    if session:
+                        session.record_frame(len(part))
+
+                # FPS Throttling based on Performance Mode
+                perf_mode = system_config.get("_resolved_performance_mode", "high")
+                sleep_duration = 0.2 if perf_mode == "low" else 0.05
+                await asyncio.sleep(sleep_duration)
+            except Exception as e:
+                print(f"Error in mosaic_generator: {e}", file=sys.stderr)
+                break
+    finally:
+        for camera in held.values():
+            camera.release(consumer)
+        if session:
+            stream_registry.close(session)
 
 
 # --- API Endpoints ---
@@ -772,6 +1387,7 @@ async def get_detected_cameras():
         print(f"Closing camera: {camera_path}", file=sys.stderr)
         camera.close()
     active_cameras.clear()
+    camera_lifecycle.forget()
     print("--- ALL CAMERAS CLOSED ---", file=sys.stderr)
 
     try:
@@ -905,7 +1521,7 @@ async def get_camera_info(camera_path: str):
     # We still need to create the camera object if it's not active
     if camera_path not in active_cameras:
         if cam_info.get('type') == 'usb':
-             active_cameras[camera_path] = USBCamera(path=cam_info['path'], friendly_name=cam_info['friendly_name'])
+             active_cameras[camera_path] = create_usb_camera(cam_info)
         elif cam_info.get('type') == 'pi':
             cam_obj = PiCamera(
                 camera_id=cam_info['path'],
@@ -919,6 +1535,7 @@ async def get_camera_info(camera_path: str):
             if cam_info.get('iso') is not None:
                 cam_obj._iso = cam_info['iso']
             active_cameras[camera_path] = cam_obj
+        await camera_lifecycle.register(camera_path)
     
     camera = active_cameras.get(camera_path)
 
@@ -949,6 +1566,28 @@ async def get_camera_info(camera_path: str):
         "subfolder": cam_info.get('subfolder', 'default')
     }
 
+@app.get("/api/camera_status")
+async def get_camera_status():
+    """Runtime state of every instantiated camera (lifecycle state, consumers, warm-up/start latency)."""
+    return {
+        camera_path: {**camera.get_status(), **camera_lifecycle.get_status(camera_path)}
+        for camera_path, camera in active_cameras.items()
+    }
+
+@app.get("/api/streams")
+async def get_streams():
+    """Lists every live preview stream with its client, parameters, fps and bytes sent."""
+    return {
+        "limits": {"per_camera": stream_registry.max_per_camera, "total": stream_registry.max_total},
+        "streams": stream_registry.list()
+    }
+
+@app.delete("/api/streams/{stream_id}")
+async def cancel_stream(stream_id: int):
+    if not stream_registry.cancel(stream_id):
+        raise HTTPException(status_code=404, detail="Stream not found")
+    return {"status": "success", "message": f"Stream {stream_id} cancelled"}
+
 @app.get("/api/cameras")
 async def get_cameras():
     return available_cameras
@@ -1014,6 +1653,8 @@ async def capture_image(request: CaptureRequest):
             "filename": first_file # Key required by script.js
         })
 
+    except StorageFullError as e:
+        raise HTTPException(status_code=507, detail=str(e))
     except Exception as e:
         print(f"Error in /api/capture: {e}", file=sys.stderr, flush=True)
         raise HTTPException(status_code=500, detail=str(e))
@@ -1098,7 +1739,10 @@ async def set_active_camera(request: SetActiveCameraRequest):
 
 @app.post("/api/capture_all")
 async def capture_all_images(request: CaptureAllRequest):
-    captured_files = await perform_global_capture(request, source="WebUI")
+    try:
+        captured_files = await perform_global_capture(request, source="WebUI")
+    except StorageFullError as e:
+        raise HTTPException(status_code=507, detail=str(e))
     
     if captured_files is None:
         raise HTTPException(status_code=500, detail="Capture failed")
@@ -1143,8 +1787,12 @@ async def interval_capture_loop(request: CaptureAllRequest, interval: float, cou
             
             # Execute Capture
             print(f"Interval Capture {current_count + 1}/{count if count > 0 else 'Inf'}", file=sys.stderr)
-            await perform_global_capture(request, source="Interval")
-            current_count += 1
+            try:
+                await perform_global_capture(request, source="Interval")
+                current_count += 1
+            except StorageFullError:
+                # Keep the schedule but skip this shot; retention may free space meanwhile
+                pass
             
             # Calculate sleep to maintain accurate interval
             elapsed = time.time() - start_time
@@ -1215,6 +1863,57 @@ async def stop_interval():
 async def get_interval_status():
     return {"status": "running" if interval_capture_running else "stopped"}
 
+@app.get("/api/uploads/status")
+async def uploads_status():
+    """Upload queue counts per state, pending bytes, oldest pending age, recent failures, unqueued backlog, the current throttle and backend metrics."""
+    status = await asyncio.to_thread(upload_queue.get_status)
+    status["backlog"] = upload_backlog
+    status["throttle"] = upload_throttle.get_status()
+    status["transfer"] = await asyncio.to_thread(transfer_process.get_status)
+    return status
+
+@app.post("/api/uploads/flush")
+async def flush_uploads():
+    """Sends everything waiting in the upload queue now, without waiting for the batch thresholds."""
+    global upload_flush_requested
+    if not load_transfer_config():
+        raise HTTPException(status_code=409, detail="Auto-transfer is disabled.")
+    count, size, _ = await asyncio.to_thread(upload_queue.due)
+    upload_flush_requested = True
+    upload_wakeup.set()
+    return JSONResponse({"status": "success", "files": count, "bytes": size})
+
+@app.post("/api/uploads/backlog")
+async def queue_upload_backlog():
+    """
+    Queues the never-uploaded files from before auto-transfer was enabled. They are
+    deleted locally after upload if delete_after_upload is on.
+    """
+    global upload_backlog
+    if not load_transfer_config():
+        raise HTTPException(status_code=409, detail="Auto-transfer is disabled.")
+    _, backlog = await asyncio.to_thread(upload_candidates)
+    count = await asyncio.to_thread(enqueue_uploads, await asyncio.to_thread(upload_queue.unqueued, backlog))
+    upload_backlog = 0
+    print(f"[Uploads] Queued {count} backlog file(s) on request.", file=sys.stderr)
+    return JSONResponse({"status": "success", "queued": count})
+
+@app.post("/api/uploads/retry")
+async def retry_failed_uploads():
+    """Puts failed uploads back in the queue."""
+    count = await asyncio.to_thread(upload_queue.retry_failed)
+    upload_wakeup.set()
+    return JSONResponse({"status": "success", "requeued": count})
+
+@app.get("/api/sftp/status")
+async def sftp_status():
+    """Shared SFTP connection state: handshakes performed vs. batches that reused the connection."""
+    if transfer_process.enabled:
+        # The pool lives in the transfer process; this is its state after the last batch
+        return transfer_process.get_status().get("sftp") or {"connected": False}
+    from sftp_handler import connection_pool
+    return connection_pool.get_status()
+
 @app.post("/api/sftp_config")
 async def save_sftp_config_endpoint(config: SFTPConfig):
     from sftp_handler import SFTP_CONFIG_PATH
@@ -1223,13 +1922,14 @@ async def save_sftp_config_endpoint(config: SFTPConfig):
     try:
         # Load existing to check for password update if it is masked
         existing_pass = None
+        load_c = {}
         if os.path.exists(SFTP_CONFIG_PATH):
              with open(SFTP_CONFIG_PATH, 'r') as f:
                   load_c = json.load(f)
                   existing_pass = load_c.get('password')
         
-        # Prepare data
-        data = config.dict()
+        # Prepare data (advanced keys that are not on the form, e.g. keepalive_s, are kept)
+        data = {**load_c, **config.dict()}
         
         # If password is mask ********, keep existing
         if data['password'] == "********" and existing_pass:
@@ -1239,6 +1939,8 @@ async def save_sftp_config_endpoint(config: SFTPConfig):
             json.dump(data, f, indent=4)
             
         print(f"SFTP Config saved. Enabled: {data['enabled']}", file=sys.stderr)
+        # Records when auto-transfer was switched on; captures from before stay local until confirmed
+        asyncio.create_task(reconcile_upload_queue())
         return JSONResponse({"status": "success", "message": "SFTP Configuration saved"})
         
     except Exception as e:
@@ -1308,6 +2010,13 @@ async def list_directories(path: str = ""):
         if not target_path.exists():
             return []
 
+        # Served from the watcher's in-memory tree when it is running
+        if capture_tree.running:
+            rel_dir = "" if target_path == base_path else target_path.relative_to(base_path).as_posix()
+            directories = capture_tree.list_dirs(rel_dir)
+            if directories is not None:
+                return directories
+
         directories = []
         for item in target_path.iterdir():
             if item.is_dir():
@@ -1317,17 +2026,55 @@ async def list_directories(path: str = ""):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/directory_stats")
+async def directory_stats(path: str = ""):
+    """File count and size of a capture directory (direct and recursive), from the watcher's tree."""
+    target_path = (CAPTURE_DIR_BASE / "images" / path).resolve()
+    base_path = (CAPTURE_DIR_BASE / "images").resolve()
+    if not str(target_path).startswith(str(base_path)):
+        raise HTTPException(status_code=403, detail="Access denied: Path outside capture directory.")
+    if not capture_tree.running:
+        raise HTTPException(status_code=503, detail="Filesystem watcher is not running.")
+    stats = capture_tree.stats("" if target_path == base_path else target_path.relative_to(base_path).as_posix())
+    if stats is None:
+        raise HTTPException(status_code=404, detail="Directory not found.")
+    return stats
+
 @app.get("/api/captured_files")
 async def list_captured_files():
-    # ... logic for listing captured files ...
-    files = []
-    if os.path.exists(CAPTURE_DIR_BASE): # Assuming CAPTURE_DIR_BASE is the root for captures
-        for root, dirs, filenames in os.walk(CAPTURE_DIR_BASE):
-             for filename in filenames:
-                # Make paths relative to CAPTURE_DIR_BASE for cleaner output
-                relative_path = os.path.relpath(os.path.join(root, filename), CAPTURE_DIR_BASE)
-                files.append(relative_path)
-    return sorted(files)
+    # Served from the capture index (paths relative to CAPTURE_DIR_BASE)
+    return capture_index.all_paths()
+
+@app.get("/thumbs/{path:path}")
+async def get_thumbnail(path: str):
+    """Serves a cached thumbnail for a capture (same relative path as under /captures/)."""
+    image_base = (CAPTURE_DIR_BASE / "images").resolve()
+    target_path = (CAPTURE_DIR_BASE / path).resolve()
+    if not str(target_path).startswith(str(image_base) + os.sep):
+        raise HTTPException(status_code=403, detail="Access denied: Path outside capture directory.")
+    rel_path = target_path.relative_to(CAPTURE_DIR_BASE.resolve()).as_posix()
+    try:
+        thumb = await asyncio.to_thread(thumbnail_cache.get, rel_path)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Capture not found.")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    # Captures are never rewritten after the capture sequence, so clients can keep thumbnails
+    return FileResponse(thumb, media_type="image/jpeg",
+                        headers={"Cache-Control": "public, max-age=2592000, immutable"})
+
+@app.get("/api/thumbnails/status")
+async def thumbnail_status():
+    return thumbnail_cache.get_status()
+
+@app.post("/api/captures/reindex")
+async def reindex_captures():
+    """Rebuilds the capture index from the files on disk."""
+    try:
+        count = await asyncio.to_thread(capture_index.rebuild)
+        return JSONResponse({"status": "success", "indexed": count})
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
 
 class MQTTUpdateRequest(BaseModel):
@@ -1449,15 +2196,20 @@ async def delete_directory(request: DeleteDirectoryRequest):
         if not str(target_path).startswith(str(base_path)):
             raise HTTPException(status_code=403, detail="Access denied: Path outside capture directory.")
 
-        if not target_path.exists():
-             raise HTTPException(status_code=404, detail="Directory not found.")
-        
-        if not target_path.is_dir():
+        if target_path.exists() and not target_path.is_dir():
             raise HTTPException(status_code=400, detail="Path is not a directory.")
 
+        # Captures not flushed yet go first, or the flusher would recreate the directory
+        spooled = capture_spool.discard_tree(target_path) if capture_spool.enabled else 0
+        if not target_path.exists() and not spooled:
+             raise HTTPException(status_code=404, detail="Directory not found.")
+
         # Recursive delete
         import shutil
-        shutil.rmtree(target_path)
+        if target_path.exists():
+            shutil.rmtree(target_path)
+        capture_index.remove_tree(target_path)
+        thumbnail_cache.discard_tree(target_path.relative_to(CAPTURE_DIR_BASE.resolve()))
         
         return JSONResponse({"status": "success", "message": f"Deleted directory: {request.path}"})
     except Exception as e:
@@ -1495,8 +2247,15 @@ async def delete_images(request: DeleteImagesRequest):
                 try:
                     target_path.unlink()
                     deleted_count += 1
+                    capture_index.remove(target_path)
+                    thumbnail_cache.discard(target_path.relative_to(CAPTURE_DIR_BASE.resolve()))
                 except Exception as e:
                     errors.append(f"Failed to delete {filename}: {e}")
+            elif capture_spool.enabled and capture_spool.discard(target_path):
+                # Deleted before the spool flushed it to disk
+                deleted_count += 1
+                capture_index.remove(target_path)
+                thumbnail_cache.discard(target_path.relative_to(CAPTURE_DIR_BASE.resolve()))
             else:
                 errors.append(f"File not found: {filename}")
                 
@@ -1508,6 +2267,15 @@ async def delete_images(request: DeleteImagesRequest):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/storage/status")
+async def storage_status():
+    status = await asyncio.to_thread(storage_manager.get_status)
+    status["writer"] = capture_writer.get_status()
+    status["spool"] = capture_spool.get_status()
+    status["shards"] = shard_writer.get_status()
+    status["watcher"] = capture_tree.get_status()
+    return status
+
 @app.get("/api/system_stats")
 async def api_system_stats():
     try:
@@ -1520,16 +2288,28 @@ async def api_system_stats():
         return {"error": str(e)}
 
 @app.get("/video_feed")
-async def video_feed(camera_path: str, resolution: str = "1280x720", shutter_speed: str = "Auto", iso: int = 0,
-                     preview_quality: int = 70, preview_width: int = 1280):
+async def video_feed(request: Request, camera_path: str, resolution: str = "1280x720", shutter_speed: str = "Auto", iso: int = 0,
+                     preview_quality: int = 70, preview_width: int = 1280, client_id: str | None = None):
+    session = None
     try:
         if camera_path not in available_cameras:
             raise HTTPException(status_code=404, detail="Camera not found")
 
+        # Register the stream first so a superseded stream from the same viewer slot stops
+        # before we touch the camera, and limits are enforced before any work is done
+        try:
+            session = stream_registry.open(
+                request.client.host if request.client else "unknown", client_id, camera_path,
+                {"resolution": resolution, "shutter_speed": shutter_speed, "iso": iso,
+                 "quality": preview_quality, "width": preview_width}
+            )
+        except StreamLimitError as e:
+            raise HTTPException(status_code=429, detail=str(e))
+
         if camera_path not in active_cameras:
             cam_info = available_cameras[camera_path]
             if cam_info.get('type') == 'usb':
-                active_cameras[camera_path] = USBCamera(path=cam_info['path'], friendly_name=cam_info['friendly_name'])
+                active_cameras[camera_path] = create_usb_camera(cam_info)
             elif cam_info.get('type') == 'pi':
                 cam_obj = PiCamera(
                     camera_id=cam_info['path'],
@@ -1547,9 +2327,8 @@ async def video_feed(camera_path: str, resolution: str = "1280x720", shutter_spe
                 active_cameras[camera_path] = cam_obj
         
         camera = active_cameras[camera_path]
-        # Ensure camera is started before streaming
-        if not camera.is_running:
-            camera.start()
+        # Ensure camera is started (or resumed from suspend) before streaming
+        await camera_lifecycle.ensure_running(camera_path, camera)
 
         # Prepare resolution
         width, height = map(int, resolution.split('x'))
@@ -1575,18 +2354,58 @@ async def video_feed(camera_path: str, resolution: str = "1280x720", shutter_spe
             camera.set_iso(iso)
 
         return StreamingResponse(
-            stream_generator(camera_path, quality=preview_quality, max_width=preview_width), 
+            stream_generator(camera_path, quality=preview_quality, max_width=preview_width, session=session), 
             media_type="multipart/x-mixed-replace; boundary=frame"
         )
 
+    except HTTPException:
+        if session:
+            stream_registry.close(session)
+        raise
     except ValueError:
+        if session:
+            stream_registry.close(session)
         raise HTTPException(status_code=400, detail="Invalid resolution format. Please use WxH (e.g., 1280x720).")
     except Exception as e:
+        if session:
+            stream_registry.close(session)
         import traceback
         print(f"Error in video_feed endpoint: {e}", file=sys.stderr)
         traceback.print_exc(file=sys.stderr)
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/video_feed/mosaic")
+async def video_feed_mosaic(request: Request, cameras: str | None = None, columns: int = 0, tile_width: int = 480,
+                            preview_quality: int = 70, labels: bool = True, client_id: str | None = None):
+    """
+    Single composite stream for the dashboard: one connection and one JPEG encode
+    for all active cameras instead of one /video_feed per camera.
+    `cameras` is an optional comma-separated list of camera paths (default: all active).
+    """
+    camera_paths = None
+    if cameras:
+        camera_paths = [c.strip() for c in cameras.split(',') if c.strip()]
+        unknown = [c for c in camera_paths if c not in available_cameras]
+        if unknown:
+            raise HTTPException(status_code=404, detail=f"Camera not found: {', '.join(unknown)}")
+
+    if tile_width < 64 or tile_width > 1920:
+        raise HTTPException(status_code=400, detail="tile_width must be between 64 and 1920.")
+
+    try:
+        session = stream_registry.open(
+            request.client.host if request.client else "unknown", client_id, "mosaic",
+            {"cameras": cameras, "columns": columns, "tile_width": tile_width, "quality": preview_quality}
+        )
+    except StreamLimitError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+
+    return StreamingResponse(
+        mosaic_generator(camera_paths, columns=columns, tile_width=tile_width,
+                         quality=preview_quality, labels=labels, session=session),
+        media_type="multipart/x-mixed-replace; boundary=frame"
+    )
+
 # --- Main Execution ---
 if __name__ == "__main__":
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
@@ -0,0 +1,168 @@
+import hashlib
+import json
+import pathlib
+import sys
+from threading import Lock
+
+CHUNK = 256 * 1024
+
+
+def file_checksum(path, algorithm="sha256"):
+    """Hex digest of a file, read in chunks."""
+    digest = hashlib.new(algorithm)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ManifestWriter:
+    """
+    Append-only dataset manifest: one JSON line per capture in
+    `manifests/<subfolder>.jsonl`, written as each capture completes. A record holds
+    the capture metadata that otherwise lives only in EXIF or the filename (camera,
+    sensor timestamp, exposure, gain, lens position, resolution, trigger source and
+    request_id) plus the file size and checksum, so downstream tools can select and
+    verify images without opening them.
+
+    The manifest is history: deleting or uploading a capture does not rewrite it.
+    With `parquet_rows` set (and pyarrow installed), every full block of that many
+    lines is also rolled into `manifests/<subfolder>-000000.parquet`, `-000001`, and so on.
+    """
+    def __init__(self, manifest_dir, capture_dir):
+        self.manifest_dir = pathlib.Path(manifest_dir)
+        self.capture_dir = pathlib.Path(capture_dir)
+        self.enabled = True
+        self.checksum = "sha256" # hashlib name, or None to skip checksums
+        self.parquet_rows = 0
+        self._files = {} # subfolder -> open append handle
+        self._lines = {} # subfolder -> number of lines in its manifest
+        self._lock = Lock()
+        self.records = 0
+
+    def configure(self, config):
+        """Applies the `manifest:` section of the system config."""
+        config = config or {}
+        self.enabled = config.get('enabled', True)
+        self.checksum = config.get('checksum', self.checksum) or None
+        self.parquet_rows = config.get('parquet_rows', 0) or 0
+        if self.parquet_rows:
+            try:
+                import pyarrow # noqa: F401
+            except ImportError:
+                print("[Manifest] parquet_rows is set but pyarrow is not installed. Writing JSONL only.", file=sys.stderr)
+                self.parquet_rows = 0
+
+    @staticmethod
+    def _name(subfolder):
+        """Manifest basename for a subfolder (its last path component)."""
+        return pathlib.Path(subfolder or 'default').name
+
+    def path_for(self, subfolder):
+        return self.manifest_dir / f"{self._name(subfolder)}.jsonl"
+
+    def parquet_path_for(self, subfolder, block):
+        """Parquet file for rows `block * parquet_rows` onwards, next to the subfolder's JSONL manifest."""
+        return self.manifest_dir / f"{self._name(subfolder)}-{block:06d}.parquet"
+
+    def build_record(self, final_path, read_path=None, **fields):
+        """
+        Returns the manifest record for a finished capture. `read_path` is where its bytes
+        are (e.g. the spool copy); extra fields with a None value are left out.
+        """
+        final_path = pathlib.Path(final_path)
+        read_path = pathlib.Path(read_path or final_path)
+        record = {
+            "file": final_path.relative_to(self.capture_dir).as_posix(),
+            "size": read_path.stat().st_size
+        }
+        if self.checksum:
+            record[self.checksum] = file_checksum(read_path, self.checksum)
+        record.update({k: v for k, v in fields.items() if v is not None})
+        return record
+
+    def _handle(self, subfolder):
+        """Open append handle for a subfolder's manifest. Caller holds the lock."""
+        handle = self._files.get(subfolder)
+        if handle is None:
+            path = self.path_for(subfolder)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            torn = False
+            if path.exists():
+                with open(path, "rb") as f:
+                    self._lines[subfolder] = sum(1 for _ in f)
+                    f.seek(0, 2)
+                    if f.tell():
+                        f.seek(-1, 2)
+                        torn = f.read(1) != b"\n"
+            else:
+                self._lines[subfolder] = 0
+            handle = open(path, "a")
+            if torn:
+                handle.write("\n") # Terminate a line cut short by a crash so the next record stays intact
+            self._files[subfolder] = handle
+        return handle
+
+    def append(self, subfolder, record):
+        """Appends one record as a single line (a crash can only lose or truncate the last line)."""
+        with self._lock:
+            handle = self._handle(subfolder)
+            handle.write(json.dumps(record, sort_keys=True) + "\n")
+            handle.flush()
+            self._lines[subfolder] += 1
+            self.records += 1
+            if self.parquet_rows and self._lines[subfolder] % self.parquet_rows == 0:
+                self._roll_parquet(subfolder)
+
+    def _roll_parquet(self, subfolder):
+        """Writes the latest full block of lines to a Parquet file. Caller holds the lock."""
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        block = self._lines[subfolder] // self.parquet_rows - 1
+        target = self.parquet_path_for(subfolder, block)
+        try:
+            rows = list(self.iter_records(subfolder))[block * self.parquet_rows:(block + 1) * self.parquet_rows]
+            pq.write_table(pa.Table.from_pylist(rows), target)
+            print(f"[Manifest] Rolled {len(rows)} records into {target.name}", file=sys.stderr)
+        except Exception as e:
+            print(f"[Manifest] Failed to write {target.name}: {e}", file=sys.stderr)
+
+    def iter_records(self, subfolder):
+        """Yields the records of one subfolder's manifest, skipping a torn last line."""
+        path = self.path_for(subfolder)
+        if not path.exists():
+            return
+        with open(path) as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+
+    def subfolders(self):
+        if not self.manifest_dir.exists():
+            return []
+        return sorted(p.stem for p in self.manifest_dir.glob("*.jsonl"))
+
+    def query(self, subfolder=None, camera=None, request_id=None, start=None, end=None, limit=1000):
+        """Filters manifest records (oldest first) without touching the image files."""
+        results = []
+        for sub in ([subfolder] if subfolder else self.subfolders()):
+            for record in self.iter_records(sub):
+                if camera and record.get("camera") != camera:
+                    continue
+                if request_id and record.get("request_id") != request_id:
+                    continue
+                timestamp = record.get("timestamp", 0)
+                if (start is not None and timestamp < start) or (end is not None and timestamp > end):
+                    continue
+                results.append(record)
+        results.sort(key=lambda r: r.get("timestamp", 0))
+        return results[:limit]
+
+    def close(self):
+        with self._lock:
+            for handle in self._files.values():
+                handle.close()
+            self._files.clear()
@@ -1,93 +1,337 @@
 import paramiko
-import json
+import hashlib
 import os
 import sys
+import time
 import logging
+import posixpath
+from collections import deque
+from contextlib import contextmanager
+from threading import Lock, Thread
 
-import pathlib
+from manifest_writer import file_checksum
+from transfer_backends import MB, PARTIAL_SUFFIX, READ_CHUNK, TRANSFER_CONFIG_PATH, TransferBackend
 
-BASE_DIR = pathlib.Path(__file__).parent.absolute()
-SFTP_CONFIG_PATH = BASE_DIR / "sftp_config.json"
+SFTP_CONFIG_PATH = TRANSFER_CONFIG_PATH
 
-class SFTPHandler:
+
+class SFTPConnectionPool:
+    """
+    Long-lived SFTP connection shared by all upload batches.
+
+    The SSH handshake and authentication are the expensive part of an upload on a Pi
+    Zero, so the transport is kept open between batches with SSH keepalives and only
+    closed after `idle_timeout_s` without use. A dead connection (server restart,
+    network drop) is detected on the next use and replaced transparently. Changing
+    the host, credentials or window settings opens a new connection.
+
+    One transport carries up to `concurrency` SFTP channels so several files can be
+    in flight at once. The SSH window (`window_mb`) and maximum packet size
+    (`max_packet_kb`) are set when the transport is opened.
+
+    Remote directories known to exist are cached for the life of the connection, so
+    a batch does not stat or mkdir a directory it (or an earlier batch) has already seen.
+    """
     def __init__(self):
-        self.config = self.load_config()
+        self._transport = None
+        self._channels = [] # SFTPClient per channel on the shared transport
+        self._key = None
+        self.known_dirs = set() # Remote directories that exist, valid for the current connection
+        self.home_dir = None # Login directory; relative remote paths resolve against it
+        self._lock = Lock() # One batch uses the connection at a time
+        self._last_used = 0.0
+        self.keepalive_s = 30
+        self.idle_timeout_s = 120
+        self._reaper = None
+        self.handshakes = 0
+        self.reuses = 0
+        self.reconnects = 0
+        self.last_error = None
+        self.batches = deque(maxlen=20) # Throughput of recent batches, newest last
 
-    def load_config(self):
-        if not os.path.exists(SFTP_CONFIG_PATH):
-            print(f"SFTP Config file not found at {SFTP_CONFIG_PATH}", file=sys.stderr)
-            return None
+    @staticmethod
+    def _config_key(config):
+        return (config.get('host'), config.get('port', 22), config.get('username'), config.get('password'),
+                config.get('window_mb', 4), config.get('max_packet_kb', 32))
+
+    def _alive(self):
+        return self._transport is not None and self._transport.is_active() and bool(self._channels)
+
+    def _close(self):
+        """Caller holds the lock."""
+        for obj in [*self._channels, self._transport]:
+            try:
+                if obj:
+                    obj.close()
+            except Exception:
+                pass
+        self._channels = []
+        self._transport = None
+        self.known_dirs = set()
+        self.home_dir = None
+
+    def _connect(self, config, channels):
+        """Caller holds the lock."""
+        host, port, username, password, window_mb, max_packet_kb = self._config_key(config)
+        print(f"Connecting to SFTP server {host}...", file=sys.stderr)
+        transport = paramiko.Transport((host, port), default_window_size=int(window_mb * MB),
+                                       default_max_packet_size=int(max_packet_kb * 1024))
+        try:
+            transport.connect(username=username, password=password)
+            transport.set_keepalive(self.keepalive_s)
+            self._channels = [paramiko.SFTPClient.from_transport(transport) for _ in range(channels)]
+        except Exception:
+            transport.close()
+            raise
+        self._transport = transport
+        self._key = self._config_key(config)
+        self.handshakes += 1
+        self._start_reaper()
+
+    def _acquire(self, config, channels):
+        """Returns `channels` working SFTP clients for `config`. Caller holds the lock."""
+        self.keepalive_s = config.get('keepalive_s', self.keepalive_s)
+        self.idle_timeout_s = config.get('idle_timeout_s', self.idle_timeout_s)
+        if self._alive() and self._key == self._config_key(config):
+            self.reuses += 1
+            while len(self._channels) < channels:
+                self._channels.append(paramiko.SFTPClient.from_transport(self._transport))
+            for client in self._channels:
+                client.chdir(None) # Start from the login directory, like a fresh connection
+            return self._channels[:channels]
+        if self._transport is not None:
+            self.reconnects += 1
+            self._close()
         try:
-            with open(SFTP_CONFIG_PATH, 'r') as f:
-                return json.load(f)
+            self._connect(config, channels)
         except Exception as e:
-            print(f"Error loading SFTP config: {e}", file=sys.stderr)
-            return None
+            self.last_error = str(e)
+            raise
+        return self._channels[:channels]
+
+    @contextmanager
+    def session(self, config, channels=1):
+        """
+        Yields (clients, reconnect) with exclusive use of the shared connection.
+        `reconnect()` replaces a connection that failed mid-batch and returns the new clients.
+        """
+        with self._lock:
+            clients = self._acquire(config, channels)
+
+            def reconnect():
+                self.reconnects += 1
+                self._close()
+                self._connect(config, channels)
+                return list(self._channels)
+
+            try:
+                yield clients, reconnect
+            finally:
+                self._last_used = time.time()
+
+    def is_alive(self):
+        return self._alive()
+
+    def record_batch(self, stats):
+        self.batches.append(stats)
+
+    def _start_reaper(self):
+        if self._reaper is None or not self._reaper.is_alive():
+            self._reaper = Thread(target=self._reap_idle, name="sftp-idle", daemon=True)
+            self._reaper.start()
+
+    def _reap_idle(self):
+        """Closes the connection after idle_timeout_s without a batch (0 keeps it open)."""
+        while True:
+            time.sleep(5)
+            with self._lock:
+                if self._transport is None:
+                    return
+                if self.idle_timeout_s and time.time() - self._last_used > self.idle_timeout_s:
+                    print(f"[SFTP] Closing connection idle for {self.idle_timeout_s}s.", file=sys.stderr)
+                    self._close()
+                    return
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+    def get_status(self):
+        return {
+            "connected": self._alive(),
+            "channels": len(self._channels),
+            "handshakes": self.handshakes,
+            "reuses": self.reuses,
+            "reconnects": self.reconnects,
+            "idle_s": round(time.time() - self._last_used, 1) if self._transport else None,
+            "last_error": self.last_error,
+            "batches": list(self.batches)
+        }
 
-    def upload_files(self, file_paths):
-        if not self.config:
-            print("SFTP configuration missing. Skipping upload.", file=sys.stderr)
-            return False
 
-        if not self.config.get('enabled', False):
-            print("SFTP Auto-Transfer is disabled. Skipping upload.", file=sys.stderr)
-            return False
+# Shared by every SFTPHandler so batches reuse one connection
+connection_pool = SFTPConnectionPool()
 
-        host = self.config.get('host')
-        port = self.config.get('port', 22)
-        username = self.config.get('username')
-        password = self.config.get('password')
-        remote_base_path = self.config.get('remote_path', '.')
 
-        if not host or not username:
-             print("SFTP Host or Username missing in config.", file=sys.stderr)
-             return False
+class SFTPHandler(TransferBackend):
+    """
+    SFTP backend on the shared pooled connection: one channel per worker, pipelined
+    writes, resumable `.part` uploads verified by size (and optionally checksum) and
+    a per-connection cache of remote directories.
+    """
+    name = "sftp"
+    label = "SFTP"
 
-        transport = None
-        sftp = None
-        success = True
-        uploaded_files = []
+    def validate(self):
+        if not self.config.get('host') or not self.config.get('username'):
+            return "SFTP Host or Username missing in config."
+        return None
 
+    def session(self, channels):
+        return connection_pool.session(self.config, channels=channels)
+
+    def is_alive(self):
+        return connection_pool.is_alive()
+
+    def resolve_targets(self, client, relative_paths):
+        remote_dir = self._remote_dir(client, self.config.get('remote_path', '.'))
+        return {rel: posixpath.join(remote_dir, rel) for rel in relative_paths}
+
+    def prepare(self, client, targets, refresh=False):
+        if refresh:
+            connection_pool.known_dirs.clear()
+        for directory in sorted({posixpath.dirname(t) for t in targets}):
+            self._makedirs(client, directory)
+
+    def batch_info(self):
+        return {"pipelined": self.config.get('pipelined', True)}
+
+    def record_batch(self, stats):
+        connection_pool.record_batch(stats)
+        super().record_batch(stats)
+
+    @staticmethod
+    def _remote_dir(sftp, remote_base_path):
+        """Absolute remote base path (relative paths resolve against the login directory)."""
+        if posixpath.isabs(remote_base_path):
+            return posixpath.normpath(remote_base_path)
+        if connection_pool.home_dir is None:
+            connection_pool.home_dir = sftp.normalize(".")
+        return posixpath.normpath(posixpath.join(connection_pool.home_dir, remote_base_path))
+
+    @staticmethod
+    def _makedirs(sftp, path):
+        """Creates a remote directory and any missing parents, using the connection's directory cache."""
+        known = connection_pool.known_dirs
+        missing = []
+        current = path
+        while current not in known and current not in ("/", ""):
+            try:
+                sftp.stat(current)
+                break
+            except IOError:
+                missing.append(current)
+                current = posixpath.dirname(current)
+        for directory in reversed(missing):
+            print(f"Creating remote directory {directory}...", file=sys.stderr)
+            try:
+                sftp.mkdir(directory)
+            except IOError:
+                sftp.stat(directory) # Created meanwhile is fine; anything else is an error
+        while path not in ("/", ""):
+            known.add(path)
+            path = posixpath.dirname(path)
+
+    @staticmethod
+    def _remote_size(sftp, remote_path):
         try:
-            print(f"Connecting to SFTP server {host}...", file=sys.stderr)
-            transport = paramiko.Transport((host, port))
-            transport.connect(username=username, password=password)
-            sftp = paramiko.SFTPClient.from_transport(transport)
+            return sftp.stat(remote_path).st_size
+        except IOError:
+            return None
+
+    @staticmethod
+    def _remote_checksum(sftp, remote_path, algorithm):
+        """Hex digest of a remote file: computed by the server if it supports check-file, else read back."""
+        with sftp.open(remote_path, 'rb') as f:
+            try:
+                return f.check(algorithm).hex()
+            except (IOError, ValueError):
+                pass # No check-file extension (e.g. OpenSSH)
+            digest = hashlib.new(algorithm)
+            f.prefetch()
+            for chunk in iter(lambda: f.read(READ_CHUNK), b""):
+                digest.update(chunk)
+            return digest.hexdigest()
 
-            # Ensure remote directory exists (basic check)
-            # This might fail if nested directories don't exist, strictly assumes basic path
+    @staticmethod
+    def _rename(sftp, source, target):
+        try:
+            sftp.posix_rename(source, target) # Atomic overwrite
+        except IOError:
+            # Plain SFTP rename fails if the target exists
             try:
-                sftp.chdir(remote_base_path)
+                sftp.remove(target)
             except IOError:
-                print(f"Remote path {remote_base_path} not found. Attempting to create...", file=sys.stderr)
-                try:
-                    sftp.mkdir(remote_base_path)
-                    sftp.chdir(remote_base_path)
-                except IOError as e:
-                     print(f"Failed to create/change to remote dir: {e}", file=sys.stderr)
-                     # Continue? might fail uploads
-            
-            for local_path in file_paths:
-                if not os.path.exists(local_path):
-                    print(f"File not found: {local_path}", file=sys.stderr)
-                    continue
-                
-                filename = os.path.basename(local_path)
-                print(f"Uploading {filename}...", file=sys.stderr)
-                try:
-                    sftp.put(local_path, filename)
-                    print(f"Successfully uploaded {filename}. Deleting local file...", file=sys.stderr)
-                    os.remove(local_path)
-                    uploaded_files.append(local_path)
-                except Exception as e:
-                    print(f"Failed to upload {filename}: {e}", file=sys.stderr)
-                    success = False
+                pass
+            sftp.rename(source, target)
 
-        except Exception as e:
-            print(f"SFTP connection error: {e}", file=sys.stderr)
-            success = False
-        finally:
-            if sftp: sftp.close()
-            if transport: transport.close()
-        
-        return uploaded_files
+    def put(self, sftp, local_path, remote_path):
+        """
+        Uploads one file to `<remote_path>.part`, verifies it and renames it into place.
+        A partial file left by an earlier attempt is resumed from its current size, and
+        the result is then always checksummed.
+        With pipelining, writes are sent without waiting for each 32 KB request to be
+        acknowledged; errors surface when the file is closed.
+        Returns (bytes sent, bytes resumed).
+        """
+        partial = remote_path + PARTIAL_SUFFIX
+        local_size = os.path.getsize(local_path)
+        offset = self._remote_size(sftp, partial) or 0
+        if offset > local_size:
+            offset = 0 # Not a prefix of this file; start over
+        checksum = self.checksum_for(offset)
+        sent = 0
+        with open(local_path, 'rb') as src, sftp.open(partial, 'r+b' if offset else 'wb') as dest:
+            dest.set_pipelined(self.config.get('pipelined', True))
+            if offset:
+                src.seek(offset)
+                dest.seek(offset)
+            for chunk in self.read_chunks(src):
+                dest.write(chunk)
+                sent += len(chunk)
+
+        remote_size = self._remote_size(sftp, partial)
+        if remote_size != local_size:
+            raise IOError(f"size mismatch after upload ({remote_size} != {local_size} bytes)")
+        if checksum and self._remote_checksum(sftp, partial, checksum) != file_checksum(local_path, checksum):
+            sftp.remove(partial) # Corrupt; the next attempt starts from zero
+            raise IOError(f"{checksum} mismatch after upload")
+        self._rename(sftp, partial, remote_path)
+        return sent, offset
+
+
+def benchmark(file_paths):
+    """Uploads the same files sequentially (one channel, no pipelining) and with the configured settings."""
+    handler = SFTPHandler()
+    if not handler.config:
+        sys.exit("SFTP configuration missing.")
+    configured = dict(handler.config, delete_after_upload=False, enabled=True)
+    modes = [("sequential", dict(configured, concurrency=1, pipelined=False)), ("configured", configured)]
+    for label, config in modes:
+        handler.config = config
+        handler.upload_files(file_paths)
+        stats = connection_pool.batches[-1] if connection_pool.batches else None
+        print(f"{label}: {stats}")
+    connection_pool.close()
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="SFTP upload tools")
+    parser.add_argument("--benchmark", nargs="+", metavar="FILE",
+                        help="upload FILEs sequentially and with the configured concurrency/pipelining (local files are kept)")
+    args = parser.parse_args()
+    if args.benchmark:
+        benchmark(args.benchmark)
+    else:
+        parser.print_help()
@@ -0,0 +1,312 @@
+import json
+import os
+import pathlib
+import sys
+import tarfile
+import time
+from threading import Lock
+
+MB = 1024 * 1024
+BLOCK = tarfile.BLOCKSIZE
+OPEN_SUFFIX = ".partial"
+INDEX_SUFFIX = ".idx.jsonl"
+UPLOADED_SUFFIX = ".uploaded" # Empty marker next to a closed shard kept locally after its upload
+
+
+def shard_prefix(subfolder):
+    """Shard basename prefix for a subfolder ("a/b" -> "a_b"; the root subfolder -> "default")."""
+    return (subfolder or "default").strip("/").replace("/", "_")
+
+
+def read_sample(shard_path, entry):
+    """Random access to one member using its index entry (no tar scan)."""
+    with open(shard_path, "rb") as f:
+        f.seek(entry["offset"])
+        return f.read(entry["size"])
+
+
+def load_index(shard_path):
+    """Returns the index entries of a shard: [{key, name, offset, size}]."""
+    with open(str(shard_path) + INDEX_SUFFIX) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+class _OpenShard:
+    def __init__(self, path, number):
+        self.path = path # Final name; data is written to path + OPEN_SUFFIX until closed
+        self.number = number
+        self.file = open(str(path) + OPEN_SUFFIX, "ab")
+        self.index = open(str(path) + INDEX_SUFFIX, "a")
+        self.size = self.file.tell()
+        self.count = 0
+        self.opened = time.time()
+        self.members = []
+
+
+class ShardWriter:
+    """
+    Packs captures into rolling, WebDataset-compatible tar shards per subfolder
+    (`shards/<subfolder>/<subfolder>-000000.tar`). Each sample is a `<key>.jpg` plus a
+    `<key>.json` with its metadata, where the key is the capture filename stem.
+
+    A shard is written as `<name>.tar.partial` by plain appends (header, data, padding),
+    so a crash loses at most the sample being written. It is closed (end-of-archive
+    blocks written, renamed to `.tar`) once it reaches `max_mb`, `max_count` samples or
+    `max_age_s` seconds, and closed shards are the unit of upload. Every member is also
+    recorded in `<name>.tar.idx.jsonl` with its data offset and size for random access.
+
+    Shards kept locally after upload get a `<name>.tar.uploaded` marker, which makes
+    them eligible for retention (see StorageManager) and keeps them out of the queue.
+    """
+    def __init__(self, shard_dir):
+        self.shard_dir = pathlib.Path(shard_dir)
+        self.enabled = False
+        self.max_bytes = 256 * MB
+        self.max_count = 1000
+        self.max_age_s = 300
+        self.keep_files = True
+        self._open = {} # subfolder -> _OpenShard
+        self._lock = Lock()
+        self._state_path = self.shard_dir / "state.json"
+        self._next = {}
+        self.closed_total = 0
+        self._bytes = None # Running total of everything under shard_dir; None until scanned
+
+    def configure(self, config):
+        """Applies the `shards:` section of the system config."""
+        config = config or {}
+        self.enabled = config.get('enabled', False)
+        self.max_bytes = int(config.get('max_mb', self.max_bytes / MB) * MB)
+        self.max_count = config.get('max_count', self.max_count)
+        self.max_age_s = config.get('max_age_s', self.max_age_s)
+        self.keep_files = config.get('keep_files', self.keep_files)
+
+    def _load_state(self):
+        try:
+            with open(self._state_path) as f:
+                self._next = json.load(f)
+        except (OSError, ValueError):
+            self._next = {}
+
+    def _save_state(self):
+        self.shard_dir.mkdir(parents=True, exist_ok=True)
+        tmp = self._state_path.with_name(".state.json.tmp")
+        with open(tmp, "w") as f:
+            json.dump(self._next, f)
+        os.replace(tmp, self._state_path)
+
+    def _open_shard(self, subfolder):
+        """Starts the next shard for a subfolder. Numbers persist so uploaded shards are never reused."""
+        prefix = shard_prefix(subfolder)
+        number = self._next.get(prefix, 0)
+        self._next[prefix] = number + 1
+        self._save_state()
+        directory = self.shard_dir / prefix
+        directory.mkdir(parents=True, exist_ok=True)
+        shard = _OpenShard(directory / f"{prefix}-{number:06d}.tar", number)
+        self._open[subfolder] = shard
+        return shard
+
+    def _append(self, shard, name, data, mtime):
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = int(mtime)
+        header = info.tobuf(tarfile.GNU_FORMAT)
+        offset = shard.size + len(header)
+        padding = (BLOCK - len(data) % BLOCK) % BLOCK
+        shard.file.write(header + data + b"\0" * padding)
+        shard.file.flush()
+        shard.size += len(header) + len(data) + padding
+        return {"name": name, "offset": offset, "size": len(data)}
+
+    def add(self, subfolder, image_path, metadata, final_path=None):
+        """
+        Appends one capture (JPEG + metadata JSON) to its subfolder's shard. `image_path`
+        is where to read it from (e.g. the spool copy); `final_path` is recorded as the
+        sample's source. Returns the list of shards closed by this call.
+        """
+        image_path = pathlib.Path(image_path)
+        key = pathlib.Path(final_path or image_path).stem.replace(".", "_") # WebDataset keys must not contain dots
+        data = image_path.read_bytes()
+        mtime = image_path.stat().st_mtime
+        meta = json.dumps(metadata, sort_keys=True).encode()
+
+        with self._lock:
+            shard = self._open.get(subfolder) or self._open_shard(subfolder)
+            size_before = shard.size
+            entries = [
+                self._append(shard, f"{key}.jpg", data, mtime),
+                self._append(shard, f"{key}.json", meta, mtime)
+            ]
+            # Index lines go after the data, so every indexed member is complete on disk
+            written = shard.size - size_before
+            for entry in entries:
+                line = json.dumps({"key": key, **entry}) + "\n"
+                shard.index.write(line)
+                written += len(line.encode())
+            shard.index.flush()
+            if self._bytes is not None:
+                self._bytes += written
+            shard.count += 1
+            shard.members.append(str(final_path or image_path))
+
+            if shard.size >= self.max_bytes or shard.count >= self.max_count:
+                return [self._close(subfolder)]
+        return []
+
+    def _close(self, subfolder):
+        """Finalises an open shard. Caller holds the lock. Returns its info dict."""
+        shard = self._open.pop(subfolder)
+        shard.file.write(b"\0" * (2 * BLOCK)) # End-of-archive marker
+        if self._bytes is not None:
+            self._bytes += 2 * BLOCK
+        shard.file.flush()
+        os.fsync(shard.file.fileno())
+        shard.file.close()
+        shard.index.close()
+        os.replace(str(shard.path) + OPEN_SUFFIX, shard.path)
+        self.closed_total += 1
+        print(f"[Shards] Closed {shard.path.name} ({shard.count} samples, {shard.size / MB:.1f} MB)", file=sys.stderr)
+        return {
+            "path": str(shard.path),
+            "index": str(shard.path) + INDEX_SUFFIX,
+            "count": shard.count,
+            "bytes": shard.size,
+            "members": shard.members
+        }
+
+    def close_idle(self, force=False):
+        """Closes shards older than max_age_s (or all shards if force). Returns their info."""
+        now = time.time()
+        closed = []
+        with self._lock:
+            for subfolder, shard in list(self._open.items()):
+                if shard.count and (force or now - shard.opened >= self.max_age_s):
+                    closed.append(self._close(subfolder))
+        return closed
+
+    def recover(self):
+        """
+        Finalises shards left open by a crash: truncates after the last indexed member
+        and writes the end-of-archive marker. Returns their info so they can be uploaded;
+        `members` comes from the `file` field of each sample's metadata (capture-relative).
+        """
+        self._load_state()
+        recovered = []
+        if not self.shard_dir.exists():
+            return recovered
+        for partial in self.shard_dir.rglob("*.tar" + OPEN_SUFFIX):
+            final = pathlib.Path(str(partial)[:-len(OPEN_SUFFIX)])
+            try:
+                entries = load_index(final)
+            except OSError:
+                entries = []
+            file_size = partial.stat().st_size
+            valid = [e for e in entries if e["offset"] + e["size"] <= file_size]
+            # Keep whole samples only (image + metadata)
+            keys = [e["key"] for e in valid]
+            complete = [e for e in valid if keys.count(e["key"]) == 2]
+            if not complete:
+                partial.unlink()
+                pathlib.Path(str(final) + INDEX_SUFFIX).unlink(missing_ok=True)
+                continue
+            last = complete[-1]
+            end = last["offset"] + last["size"]
+            end += (BLOCK - end % BLOCK) % BLOCK
+            with open(partial, "r+b") as f:
+                f.truncate(end)
+                f.seek(end)
+                f.write(b"\0" * (2 * BLOCK))
+            with open(str(final) + INDEX_SUFFIX, "w") as f:
+                for entry in complete:
+                    f.write(json.dumps(entry) + "\n")
+            os.replace(partial, final)
+            members = []
+            for entry in complete:
+                if not entry["name"].endswith(".json"):
+                    continue
+                try:
+                    members.append(json.loads(read_sample(final, entry))["file"])
+                except (ValueError, KeyError, TypeError):
+                    pass # Metadata without a source path; the capture stays marked as not uploaded
+            print(f"[Shards] Recovered {final.name} ({len(complete) // 2} samples)", file=sys.stderr)
+            recovered.append({"path": str(final), "index": str(final) + INDEX_SUFFIX,
+                              "count": len(complete) // 2, "bytes": end + 2 * BLOCK, "members": members})
+        self.refresh_usage()
+        return recovered
+
+    def usage_bytes(self):
+        """Disk space used by shards (open and closed, with indexes). Kept as a running total, so O(1)."""
+        if self._bytes is None:
+            return self.refresh_usage()
+        return self._bytes
+
+    def refresh_usage(self):
+        """
+        Rescans shard_dir for usage_bytes(). Needed from time to time because uploads
+        that delete shards run in the transfer process. Returns the new total.
+        """
+        size = 0
+        if self.shard_dir.exists():
+            for root, dirs, files in os.walk(self.shard_dir):
+                for name in files:
+                    try:
+                        size += os.stat(os.path.join(root, name)).st_size
+                    except FileNotFoundError:
+                        pass # Deleted by an upload meanwhile
+        with self._lock:
+            self._bytes = size
+        return size
+
+    def closed_shards(self, uploaded=None):
+        """Closed shards as [(path, bytes incl. index, mtime)], oldest first; optionally only (not) uploaded ones."""
+        shards = []
+        if not self.shard_dir.exists():
+            return shards
+        for path in self.shard_dir.rglob("*.tar"):
+            marked = os.path.exists(str(path) + UPLOADED_SUFFIX)
+            if uploaded is not None and marked != uploaded:
+                continue
+            try:
+                stat = path.stat()
+                size = stat.st_size + os.path.getsize(str(path) + INDEX_SUFFIX)
+            except FileNotFoundError:
+                continue
+            shards.append((str(path), size, stat.st_mtime))
+        return sorted(shards, key=lambda shard: shard[2])
+
+    def mark_uploaded(self, paths):
+        """Records that closed shards were uploaded and kept locally."""
+        for path in paths:
+            if str(path).endswith(".tar") and os.path.exists(path):
+                pathlib.Path(str(path) + UPLOADED_SUFFIX).touch()
+
+    def delete(self, path):
+        """Deletes a closed shard with its index and marker. Returns False if the shard could not be removed."""
+        sizes = 0
+        for name in (str(path), str(path) + INDEX_SUFFIX):
+            try:
+                sizes += os.path.getsize(name)
+            except OSError:
+                pass
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"[Shards] Failed to delete {path}: {e}", file=sys.stderr)
+            return False
+        for suffix in (INDEX_SUFFIX, UPLOADED_SUFFIX):
+            pathlib.Path(str(path) + suffix).unlink(missing_ok=True)
+        with self._lock:
+            if self._bytes is not None:
+                self._bytes = max(self._bytes - sizes, 0)
+        return True
+
+    def get_status(self):
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "open": {sub: {"name": s.path.name, "count": s.count, "bytes": s.size} for sub, s in self._open.items()},
+                "closed_total": self.closed_total
+            }
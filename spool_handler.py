@@ -0,0 +1,341 @@
+import os
+import pathlib
+import shutil
+import sys
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from threading import Condition, Thread
+
+from fastapi.staticfiles import StaticFiles
+
+from capture_writer import PARTIAL_PREFIX
+
+MB = 1024 * 1024
+
+
+def filesystem_type(path):
+    """Returns the filesystem type (e.g. 'tmpfs', 'ext4') that `path` lives on, or None."""
+    path = os.path.realpath(path)
+    best, fstype = "", None
+    try:
+        with open("/proc/mounts") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) < 3:
+                    continue
+                mount_point = parts[1]
+                if (path == mount_point or path.startswith(mount_point.rstrip("/") + "/")) and len(mount_point) > len(best):
+                    best, fstype = mount_point, parts[2]
+    except OSError:
+        return None
+    return fstype
+
+
+class CaptureSpool:
+    """
+    Optional RAM staging area for captures.
+
+    With the spool enabled, captures are written and post-processed in `spool_dir`
+    (which must be a tmpfs mount) under the same relative layout as the capture
+    directory. A background flusher later copies them to persistent storage, one whole
+    file at a time, through the CaptureWriter (temp file, rename, sync policy), and
+    then drops the RAM copy. Burst and interval captures therefore run at RAM speed
+    while the SD card sees sequential writes.
+
+    While a file is spooled, locate() returns its RAM copy, which the /captures mount,
+    thumbnails and SFTP uploads use. pinned() holds files in RAM while they are being
+    uploaded, so an upload that deletes the local file never touches the SD card.
+    """
+    def __init__(self, spool_dir, capture_dir, writer):
+        self.spool_dir = pathlib.Path(spool_dir)
+        self.capture_dir = pathlib.Path(capture_dir)
+        self.writer = writer
+        self.enabled = False
+        self.max_bytes = 128 * MB
+        self.flush_delay_s = 2.0 # Let bursts finish in RAM before writing to the card
+        self.wait_s = 5.0 # Backpressure: how long a capture waits for room before bypassing the spool
+        self._files = OrderedDict() # rel path -> (size, staged time), oldest first
+        self._pinned = {}
+        self._flushing = None # rel path being copied right now
+        self.bytes = 0
+        self._reserved = {} # rel path -> bytes held for a capture that is being written
+        self._recent_sizes = deque(maxlen=8) # Sizes of the last staged captures, for reservations
+        self._cond = Condition()
+        self._running = False
+        self._thread = None
+        self.flushed = 0
+        self.flushed_bytes = 0
+        self.bypassed = 0
+        self.recovered = 0
+
+    def configure(self, config):
+        """Applies the `spool:` section of the system config."""
+        config = config or {}
+        self.enabled = config.get('enabled', False)
+        if config.get('path'):
+            self.spool_dir = pathlib.Path(config['path'])
+        self.max_bytes = int(config.get('max_mb', self.max_bytes / MB) * MB)
+        self.flush_delay_s = config.get('flush_delay_s', self.flush_delay_s)
+        self.wait_s = config.get('wait_s', self.wait_s)
+
+    def _rel(self, final_path):
+        final_path = pathlib.Path(final_path)
+        try:
+            return final_path.relative_to(self.capture_dir).as_posix()
+        except ValueError:
+            return final_path.relative_to(self.capture_dir.resolve()).as_posix()
+
+    def spool_path(self, final_path):
+        return self.spool_dir / self._rel(final_path)
+
+    def temp_path(self, final_path):
+        """Where a capture destined for `final_path` is written while in the spool."""
+        path = self.spool_path(final_path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        return path.with_name(PARTIAL_PREFIX + path.name)
+
+    def locate(self, final_path):
+        """Returns the RAM copy of a capture while it is spooled, else `final_path`."""
+        try:
+            rel = self._rel(final_path)
+        except ValueError:
+            return final_path
+        with self._cond:
+            if rel in self._files:
+                return self.spool_dir / rel
+        return final_path
+
+    def reserve(self, final_path):
+        """
+        Backpressure for a new capture. Waits up to `wait_s` for the flusher to make room for
+        one more capture of the expected size, and holds that room until stage() or release().
+        Returns False if the spool is still full; the capture should then go straight to disk.
+        """
+        rel = self._rel(final_path)
+        deadline = time.time() + self.wait_s
+        with self._cond:
+            # Largest recent capture (2 MB before the first one): errs on the side of RAM
+            estimate = max(self._recent_sizes, default=2 * MB)
+            # Concurrent captures count the room already promised to each other
+            while self._used() and self._used() + estimate > self.max_bytes:
+                remaining = deadline - time.time()
+                if remaining <= 0 or not self._running:
+                    self.bypassed += 1
+                    print(f"[Spool] Full ({self._used() / MB:.0f} MB); writing capture directly to disk.", file=sys.stderr)
+                    return False
+                self._cond.notify_all() # Wake the flusher early
+                self._cond.wait(remaining)
+            self._reserved[rel] = estimate
+        return True
+
+    def release(self, final_path):
+        """Returns the room reserved for a capture that failed before stage()."""
+        with self._cond:
+            if self._reserved.pop(self._rel(final_path), None) is not None:
+                self._cond.notify_all()
+
+    def _used(self):
+        """Spooled plus reserved bytes. Caller holds the lock."""
+        return self.bytes + sum(self._reserved.values())
+
+    def stage(self, temp_path, final_path):
+        """Publishes a finished capture in the spool and queues it for flushing (settling its reservation)."""
+        spooled = self.spool_path(final_path)
+        os.replace(temp_path, spooled)
+        size = spooled.stat().st_size
+        rel = self._rel(final_path)
+        with self._cond:
+            self._reserved.pop(rel, None)
+            self._files[rel] = (size, time.time())
+            self.bytes += size
+            self._recent_sizes.append(size)
+            self._cond.notify_all()
+
+    def _forget(self, rel):
+        """Drops bookkeeping for a file. Caller holds the lock."""
+        entry = self._files.pop(rel, None)
+        if entry:
+            self.bytes -= entry[0]
+        self._cond.notify_all()
+
+    def discard(self, final_path):
+        """Deletes a spooled capture (e.g. deleted from the gallery before it was flushed). Returns True if it was spooled."""
+        rel = self._rel(final_path)
+        with self._cond:
+            while self._flushing == rel:
+                self._cond.wait()
+            if rel not in self._files:
+                return False
+            self._forget(rel)
+        (self.spool_dir / rel).unlink(missing_ok=True)
+        return True
+
+    def discard_tree(self, final_dir):
+        """Deletes every spooled capture below a directory (e.g. a deleted subfolder). Returns how many there were."""
+        prefix = self._rel(final_dir).rstrip("/") + "/"
+        with self._cond:
+            while self._flushing and self._flushing.startswith(prefix):
+                self._cond.wait() # Let the copy finish; the caller deletes the flushed file with the directory
+            rels = [rel for rel in self._files if rel.startswith(prefix)]
+            for rel in rels:
+                self._forget(rel)
+        for rel in rels:
+            (self.spool_dir / rel).unlink(missing_ok=True)
+        return len(rels)
+
+    @contextmanager
+    def pinned(self, final_paths):
+        """Keeps files in RAM while in use; yields the path to read each one from."""
+        rels = []
+        with self._cond:
+            for path in final_paths:
+                try:
+                    rel = self._rel(path)
+                except ValueError:
+                    continue
+                rels.append(rel)
+                self._pinned[rel] = self._pinned.get(rel, 0) + 1
+            while self._flushing in rels:
+                self._cond.wait() # Let an in-progress copy finish so the path we hand out stays valid
+        try:
+            yield [str(self.locate(path)) for path in final_paths]
+        finally:
+            with self._cond:
+                for rel in rels:
+                    self._pinned[rel] -= 1
+                    if not self._pinned[rel]:
+                        del self._pinned[rel]
+                    # Uploaded and deleted straight from RAM: nothing left to flush
+                    if rel in self._files and not (self.spool_dir / rel).exists():
+                        self._forget(rel)
+
+    def _next_due(self):
+        """Oldest unpinned file that is ready to flush, or None. Caller holds the lock."""
+        now = time.time()
+        under_pressure = self._used() >= self.max_bytes / 2
+        for rel, (size, staged) in self._files.items():
+            if rel in self._pinned:
+                continue
+            if under_pressure or now - staged >= self.flush_delay_s or not self._running:
+                return rel
+        return None
+
+    def _flush_file(self, rel):
+        source = self.spool_dir / rel
+        final = self.capture_dir / rel
+        if not source.exists():
+            return # Deleted while spooled
+        final.parent.mkdir(parents=True, exist_ok=True)
+        temp = self.writer.temp_path(final)
+        shutil.copy2(source, temp) # One sequential write; keeps the mtime the index and thumbnails saw
+        self.writer.commit(temp, final)
+        size = source.stat().st_size
+        source.unlink()
+        self.flushed += 1
+        self.flushed_bytes += size
+
+    def _flush_loop(self):
+        while True:
+            with self._cond:
+                rel = self._next_due()
+                while rel is None:
+                    if not self._running:
+                        return
+                    self._cond.wait(0.5)
+                    rel = self._next_due()
+                self._flushing = rel
+            try:
+                self._flush_file(rel)
+                failed = False
+            except Exception as e:
+                print(f"[Spool] Failed to flush {rel}: {e}", file=sys.stderr)
+                failed = True
+            with self._cond:
+                self._flushing = None
+                if not failed:
+                    self._forget(rel)
+                self._cond.notify_all()
+            if failed:
+                time.sleep(1.0) # Disk full or gone: retry later instead of spinning
+
+    def recover(self):
+        """Re-queues captures left in the spool by a crash and removes unfinished writes."""
+        if not self.spool_dir.exists():
+            return 0
+        for root, dirs, files in os.walk(self.spool_dir):
+            for name in files:
+                path = pathlib.Path(root) / name
+                if name.startswith(PARTIAL_PREFIX):
+                    path.unlink(missing_ok=True)
+                    continue
+                rel = path.relative_to(self.spool_dir).as_posix()
+                size = path.stat().st_size
+                with self._cond:
+                    if rel not in self._files:
+                        self._files[rel] = (size, 0.0) # Flush right away
+                        self.bytes += size
+                        self.recovered += 1
+        if self.recovered:
+            print(f"[Spool] Recovered {self.recovered} unflushed capture(s).", file=sys.stderr)
+        return self.recovered
+
+    def start(self):
+        """Starts the flusher. Returns False (and disables the spool) if `spool_dir` is not in RAM."""
+        self.spool_dir.mkdir(parents=True, exist_ok=True)
+        fstype = filesystem_type(self.spool_dir)
+        if fstype not in ("tmpfs", "ramfs"):
+            # Staging on the SD card would double every write instead of saving any
+            print(f"[Spool] {self.spool_dir} is on '{fstype}', not tmpfs. Spool disabled; mount a tmpfs there to use it.", file=sys.stderr)
+            self.enabled = False
+            if self.recover():
+                self._flush_loop() # Not running: writes out whatever a previous run left, then returns
+            return False
+        self.recover()
+        self._running = True
+        self._thread = Thread(target=self._flush_loop, name="spool-flusher", daemon=True)
+        self._thread.start()
+        print(f"[Spool] Started at {self.spool_dir} (cap {self.max_bytes / MB:.0f} MB).", file=sys.stderr)
+        return True
+
+    def stop(self, timeout=30.0):
+        """Flushes everything still spooled, then stops the flusher."""
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def get_status(self):
+        with self._cond:
+            return {
+                "enabled": self.enabled,
+                "path": str(self.spool_dir),
+                "files": len(self._files),
+                "bytes": self.bytes,
+                "reserved_bytes": sum(self._reserved.values()),
+                "max_bytes": self.max_bytes,
+                "flushed": self.flushed,
+                "flushed_bytes": self.flushed_bytes,
+                "bypassed": self.bypassed,
+                "recovered": self.recovered
+            }
+
+
+class SpoolStaticFiles(StaticFiles):
+    """StaticFiles for the capture directory that also serves captures still in the spool."""
+    def __init__(self, *args, spool=None, **kwargs):
+        self.spool = spool
+        super().__init__(*args, **kwargs)
+
+    def lookup_path(self, path):
+        full_path, stat_result = super().lookup_path(path)
+        if stat_result is None and self.spool is not None and self.spool.enabled:
+            spool_dir = os.path.realpath(self.spool.spool_dir)
+            candidate = os.path.realpath(os.path.join(spool_dir, path))
+            if os.path.commonpath([candidate, spool_dir]) == spool_dir:
+                try:
+                    return candidate, os.stat(candidate)
+                except (FileNotFoundError, NotADirectoryError):
+                    pass
+        return full_path, stat_result
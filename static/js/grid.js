@@ -8,6 +8,9 @@ document.addEventListener('DOMContentLoaded', async () => {
 
     let availableCameras = {};
 
+    // Identifies this page's viewer slots so the server can cancel streams we replace
+    const streamClientId = Math.random().toString(36).slice(2, 10);
+
     // Reset Context to Global (Multi-Camera)
     fetch('/api/set_active_camera', {
         method: 'POST',
@@ -269,7 +272,7 @@ document.addEventListener('DOMContentLoaded', async () => {
                      class="w-full preview-box rounded-lg relative overflow-hidden bg-black cursor-pointer hover:border-blue-400 hover:shadow-[0_0_25px_rgba(59,130,246,0.6)] transition duration-300"
                      onclick="openVideoPopup('${camPath}', '${safeId}')"
                      title="Click to expand">
-                    <img id="feed-${safeId}" src="/video_feed?camera_path=${camPath}" class="w-full h-full object-contain" alt="Live Feed">
+                    <img id="feed-${safeId}" src="/video_feed?camera_path=${camPath}&client_id=${streamClientId}-${safeId}" class="w-full h-full object-contain" alt="Live Feed">
                     
                     <div class="absolute top-2 left-2 bg-gray-900/80 px-3 py-1 rounded-lg text-xs font-medium backdrop-blur-sm border border-gray-700 pointer-events-none">
                         Focus: <span id="preview-focus-status-${safeId}" class="text-yellow-400">Loading...</span>
@@ -568,7 +571,7 @@ document.addEventListener('DOMContentLoaded', async () => {
         const shutter = document.getElementById(`shutter-speed-${safeId}`).value;
         const img = document.getElementById(`feed-${safeId}`);
 
-        img.src = `/video_feed?camera_path=${camPath}&resolution=${res}&shutter_speed=${shutter}&t=${new Date().getTime()}`;
+        img.src = `/video_feed?camera_path=${camPath}&resolution=${res}&shutter_speed=${shutter}&client_id=${streamClientId}-${safeId}&t=${new Date().getTime()}`;
 
         document.getElementById(`preview-resolution-${safeId}`).textContent = res;
         document.getElementById(`preview-shutter-${safeId}`).textContent = shutter;
@@ -816,6 +819,13 @@ document.addEventListener('DOMContentLoaded', async () => {
                 logMessage(`[Interval] Status: ${data.status}`);
             } else if (data.type === 'file_deleted') {
                 logMessage(`[System] Auto-Deleted: ${data.filename}`);
+            } else if (data.type === 'directory_changed') {
+                // A folder was created or removed (possibly outside the app); refresh an open explorer
+                if (!explorerModal.classList.contains('hidden') && currentBrowsePath === data.path) {
+                    loadDirectory(currentBrowsePath);
+                }
+            } else if (data.type === 'storage_error') {
+                logMessage(`[Storage] Capture rejected (${data.source}): ${data.message}`);
             }
         };
 
@@ -849,7 +859,7 @@ document.addEventListener('DOMContentLoaded', async () => {
         popupDetails.textContent = `Resolution: ${resolution} | Shutter: ${shutter}`;
 
         // Set Source (Force reload with timestamp)
-        popupImg.src = `/video_feed?camera_path=${camPath}&resolution=${resolution}&shutter_speed=${shutter}&t=${new Date().getTime()}`;
+        popupImg.src = `/video_feed?camera_path=${camPath}&resolution=${resolution}&shutter_speed=${shutter}&client_id=${streamClientId}-popup&t=${new Date().getTime()}`;
 
         // Show Modal
         modal.classList.remove('hidden');
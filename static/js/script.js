@@ -1,5 +1,8 @@
 document.addEventListener('DOMContentLoaded', () => {
 
+    // Identifies this page's viewer slots so the server can cancel streams we replace
+    const streamClientId = Math.random().toString(36).slice(2, 10);
+
     // Get UI elements
     const cameraSelect = document.getElementById('camera-select');
     const cameraFeed = document.getElementById('camera-feed');
@@ -129,7 +132,7 @@ document.addEventListener('DOMContentLoaded', () => {
         const iso = isoSelect ? isoSelect.value : '0';
 
         if (selectedCameraPath) {
-            cameraFeed.src = `/video_feed?camera_path=${selectedCameraPath}&resolution=${resolution}&shutter_speed=${shutterSpeed}&iso=${iso}`;
+            cameraFeed.src = `/video_feed?camera_path=${selectedCameraPath}&resolution=${resolution}&shutter_speed=${shutterSpeed}&iso=${iso}&client_id=${streamClientId}-main`;
             if (resolutionDisplay) resolutionDisplay.textContent = `Resolution: ${resolution}`;
             logMessage(`Feed active: ${availableCameras[selectedCameraPath].friendly_name}`);
 
@@ -268,35 +271,57 @@ document.addEventListener('DOMContentLoaded', () => {
         updateDeleteButton();
     }
 
+    // Cursor into the capture index; null until the first page has been loaded
+    let galleryCursor = null;
+
+    function removeFromGallery(filename) {
+        const el = document.querySelector(`div[data-filename="${filename}"]`);
+        if (el) el.remove();
+        knownFiles.delete(filename);
+        if (selectedFiles.has(filename)) {
+            selectedFiles.delete(filename);
+            updateDeleteButton(); // Refresh counts
+        }
+    }
+
     function loadGallery() {
         if (!galleryContainer) return;
 
-        fetch('/api/captures')
+        // First load fetches the newest page; afterwards only changes since the last cursor
+        const url = galleryCursor === null
+            ? '/api/captures?limit=20'
+            : `/api/captures?since=${galleryCursor}&limit=100`;
+
+        fetch(url)
             .then(response => response.json())
-            .then(files => {
-                if (files.length > 0 && galleryPlaceholder) {
-                    galleryPlaceholder.style.display = 'none';
-                } else if (files.length === 0 && galleryPlaceholder) {
-                    galleryPlaceholder.style.display = 'block'; // Show if empty
+            .then(page => {
+                if (page.reset) {
+                    galleryContainer.querySelectorAll('div[data-filename]').forEach(el => el.remove());
+                    knownFiles.clear();
                 }
 
-                // Incremental update
-                let hasNewFiles = false;
-                files.forEach(file => {
-                    if (!knownFiles.has(file)) {
-                        knownFiles.add(file);
-                        addToGallery(file); // Adds to top
-                        hasNewFiles = true;
+                page.removed.forEach(removeFromGallery);
+
+                // Initial/reset pages are newest first; addToGallery prepends, so add oldest first
+                const firstPage = galleryCursor === null || page.reset;
+                const added = firstPage ? page.added.slice().reverse() : page.added;
+                added.forEach(entry => {
+                    if (!knownFiles.has(entry.path)) {
+                        knownFiles.add(entry.path);
+                        addToGallery(entry.path); // Adds to top
                     }
                 });
+                galleryCursor = page.cursor;
 
-                if (hasNewFiles || files.length > 0) {
+                const hasItems = galleryContainer.querySelector('div[data-filename]') !== null;
+                if (galleryPlaceholder) {
+                    galleryPlaceholder.style.display = hasItems ? 'none' : 'block';
+                }
+                if (added.length > 0 || page.removed.length > 0) {
                     updateDeleteButton(); // Refresh "Select All" visibility
                 }
 
-                // Note: If files were deleted from backend but still in knownFiles, we might need a full refresh logic eventually.
-                // For now, we assume simple append-only or manual delete via UI.
-
+                if (page.has_more && !firstPage) loadGallery();
             })
             .catch(err => console.error("Error loading gallery:", err));
     }
@@ -343,7 +368,8 @@ document.addEventListener('DOMContentLoaded', () => {
 
         // Image
         const img = document.createElement('img');
-        img.src = url;
+        img.src = `/thumbs/${filename}`; // Small cached thumbnail; click opens the full image
+        img.loading = 'lazy';
         img.alt = filename;
         img.className = "w-full h-32 object-cover cursor-pointer hover:opacity-90 transition";
         img.onclick = () => window.open(url, '_blank');
@@ -632,7 +658,7 @@ document.addEventListener('DOMContentLoaded', () => {
         popupDetails.textContent = `Resolution: ${resolution} | Shutter: ${shutter} | ISO: ${iso === '0' ? 'Auto' : iso}`;
 
         // Set Source (Force reload)
-        popupImg.src = `/video_feed?camera_path=${selectedCameraPath}&resolution=${resolution}&shutter_speed=${shutter}&iso=${iso}&t=${new Date().getTime()}`;
+        popupImg.src = `/video_feed?camera_path=${selectedCameraPath}&resolution=${resolution}&shutter_speed=${shutter}&iso=${iso}&client_id=${streamClientId}-popup&t=${new Date().getTime()}`;
 
         // Show Modal
         modal.classList.remove('hidden');
@@ -1025,22 +1051,19 @@ document.addEventListener('DOMContentLoaded', () => {
                 const filename = data.filename;
                 logMessage(`[System] Auto-Deleted: ${filename}`);
 
-                // Remove from gallery UI
-                const el = document.querySelector(`div[data-filename="${filename}"]`);
-                if (el) el.remove();
-
-                // Cleanup internal state
-                if (knownFiles.has(filename)) knownFiles.delete(filename);
-                if (selectedFiles.has(filename)) {
-                    selectedFiles.delete(filename);
-                    updateDeleteButton(); // Refresh counts
-                }
+                // Remove from gallery UI and internal state
+                removeFromGallery(filename);
 
                 // Show placeholder if empty
                 if (galleryContainer && galleryContainer.children.length === 0 && galleryPlaceholder) {
                     galleryPlaceholder.style.display = 'block';
                 }
 
+            } else if (data.type === 'directory_changed') {
+                // A folder was created or removed (possibly outside the app); refresh an open explorer
+                if (!explorerModal.classList.contains('hidden') && currentBrowsePath === data.path) {
+                    loadDirectory(currentBrowsePath);
+                }
             } else if (data.type === 'mqtt_log') {
                 const logBox = document.getElementById('mqtt-log-box');
                 if (logBox) {
@@ -1074,6 +1097,8 @@ document.addEventListener('DOMContentLoaded', () => {
                     if (stopBtn) stopBtn.classList.add('hidden');
                     if (closeBtn) closeBtn.textContent = "Close";
                 }
+            } else if (data.type === 'storage_error') {
+                logMessage(`[Storage] Capture rejected (${data.source}): ${data.message}`);
             }
         };
 
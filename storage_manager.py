@@ -0,0 +1,244 @@
+import asyncio
+import os
+import shutil
+import sys
+import time
+
+MB = 1024 * 1024
+
+
+class StorageFullError(Exception):
+    """Raised when a capture is rejected because free space or the quota is exhausted."""
+    pass
+
+
+class StorageManager:
+    """
+    Keeps the capture directory within a quota and the filesystem above a free-space
+    watermark.
+
+    Captures are rejected (StorageFullError) while free space is below `min_free_mb` or
+    the indexed captures exceed `quota_mb`. A background job applies the retention rules
+    in small batches, oldest files first:
+
+    1. `max_age_days`: files older than this are deleted.
+    2. `subfolder_caps`: {subfolder: max files}; the oldest files above the cap are deleted.
+    3. Space: while usage is above the quota, or free space is below `target_free_mb`.
+
+    Every rule deletes files already uploaded by SFTP (and kept locally) first. Files
+    that were never uploaded are only deleted if `delete_unuploaded` is enabled, so
+    without it a rule may stay unmet until those files are uploaded.
+
+    Tar shards (with `shard_writer`) count towards the quota. Uploaded shards are
+    removed by the age rule, and by the space rule before any loose capture, since the
+    captures they contain stay browsable; shards that were not uploaded are never deleted.
+
+    File selection is an indexed query on the capture index, so a pass costs the same
+    whatever the size of the dataset. The capture-time check only reads running totals
+    (index and shard usage); each pass rescans the shard directory to correct the latter.
+    """
+    def __init__(self, capture_index, capture_dir, delete_callback=None, check_interval=60.0, shard_writer=None):
+        self.capture_index = capture_index
+        self.capture_dir = capture_dir
+        self.shard_writer = shard_writer
+        self.delete_callback = delete_callback # async fn(list of deleted relative paths)
+        self.check_interval = check_interval
+        self.batch_size = 200 # Deletions per pass; the job reschedules itself while work remains
+        self.quota_mb = 0 # 0 = no quota
+        self.min_free_mb = 200
+        self.target_free_mb = 500
+        self.max_age_days = 0
+        self.subfolder_caps = {}
+        self.delete_unuploaded = False
+        self.deleted_total = 0
+        self.shards_deleted = 0
+        self.last_run = None
+        self.last_deleted = 0
+        self._wake = asyncio.Event()
+
+    def configure(self, config):
+        """Applies the `storage:` section of the system config."""
+        config = config or {}
+        self.quota_mb = config.get('quota_mb', self.quota_mb) or 0
+        self.min_free_mb = config.get('min_free_mb', self.min_free_mb)
+        self.target_free_mb = max(config.get('target_free_mb', self.target_free_mb), self.min_free_mb)
+        self.max_age_days = config.get('max_age_days', self.max_age_days) or 0
+        self.subfolder_caps = config.get('subfolder_caps', self.subfolder_caps) or {}
+        self.delete_unuploaded = config.get('delete_unuploaded', self.delete_unuploaded)
+        self.batch_size = config.get('batch_size', self.batch_size)
+
+    def free_bytes(self):
+        return shutil.disk_usage(self.capture_dir).free
+
+    def shard_bytes(self):
+        return self.shard_writer.usage_bytes() if self.shard_writer else 0
+
+    def used_bytes(self):
+        """Indexed captures plus tar shards, which hold a second copy of each capture they pack."""
+        return self.capture_index.total_bytes() + self.shard_bytes()
+
+    def blocked_reason(self):
+        """Returns why captures are currently rejected, or None."""
+        free_mb = self.free_bytes() / MB
+        if free_mb < self.min_free_mb:
+            return f"Free space {free_mb:.0f} MB is below the {self.min_free_mb} MB watermark."
+        if self.quota_mb:
+            used_mb = self.used_bytes() / MB
+            if used_mb >= self.quota_mb:
+                return f"Capture quota reached ({used_mb:.0f} / {self.quota_mb} MB)."
+        return None
+
+    def check_capture_allowed(self):
+        """Raises StorageFullError if a capture must not be written right now."""
+        reason = self.blocked_reason()
+        if reason:
+            self._wake.set()
+            raise StorageFullError(reason)
+        if self.free_bytes() < self.target_free_mb * MB:
+            self._wake.set() # Not critical yet, but start freeing space now
+
+    def _delete(self, rows):
+        """Deletes files and drops them from the index. Returns the deleted relative paths."""
+        deleted = []
+        for rel, _ in rows:
+            try:
+                os.remove(os.path.join(self.capture_dir, rel))
+            except FileNotFoundError:
+                pass # Already gone; still drop it from the index
+            except OSError as e:
+                print(f"[Storage] Failed to delete {rel}: {e}", file=sys.stderr)
+                continue
+            deleted.append(rel)
+        if deleted:
+            self.capture_index.remove(deleted)
+        return deleted
+
+    def _delete_shards(self, shards, need=None):
+        """Deletes uploaded shards, oldest first, until `need` bytes are freed (all if None). Returns (count, bytes)."""
+        count = freed = 0
+        for path, size, _ in shards:
+            if need is not None and freed >= need:
+                break
+            if self.shard_writer.delete(path):
+                count += 1
+                freed += size
+        if count:
+            self.shards_deleted += count
+            print(f"[Storage] Retention deleted {count} uploaded shard(s).", file=sys.stderr)
+        return count, freed
+
+    def _tiers(self):
+        """`uploaded` filters to select from, in order: uploaded files, then any file if allowed."""
+        return [True, None] if self.delete_unuploaded else [True]
+
+    def _space_needed(self):
+        """Bytes to free to get back under the quota and above the free-space target."""
+        need = self.target_free_mb * MB - self.free_bytes()
+        if self.quota_mb:
+            need = max(need, self.used_bytes() - self.quota_mb * MB)
+        return need
+
+    def enforce_once(self):
+        """
+        Runs one bounded retention pass (at most `batch_size` deletions).
+        Returns (deleted relative paths, whether more work remains).
+        """
+        budget = self.batch_size
+        deleted = []
+        if self.shard_writer:
+            self.shard_writer.refresh_usage() # Shards deleted by uploads in the transfer process
+
+        if self.max_age_days:
+            cutoff = time.time() - self.max_age_days * 86400
+            if self.shard_writer:
+                old = [s for s in self.shard_writer.closed_shards(uploaded=True) if s[2] < cutoff]
+                budget -= self._delete_shards(old[:budget])[0]
+            for uploaded in self._tiers():
+                if budget <= 0:
+                    break
+                removed = self._delete(self.capture_index.oldest(budget, uploaded=uploaded, older_than=cutoff))
+                deleted += removed
+                budget -= len(removed)
+
+        if budget > 0 and self.subfolder_caps:
+            counts = self.capture_index.subfolder_counts()
+            for subfolder, cap in self.subfolder_caps.items():
+                excess = counts.get(subfolder, 0) - cap
+                for uploaded in self._tiers():
+                    if excess <= 0 or budget <= 0:
+                        break
+                    rows = self.capture_index.oldest(min(excess, budget), uploaded=uploaded, subfolder=subfolder)
+                    removed = self._delete(rows)
+                    deleted += removed
+                    budget -= len(removed)
+                    excess -= len(removed)
+
+        need = self._space_needed()
+        if self.shard_writer and need > 0 and budget > 0:
+            count, freed = self._delete_shards(self.shard_writer.closed_shards(uploaded=True)[:budget], need)
+            budget -= count
+            need -= freed
+        for uploaded in self._tiers():
+            if budget <= 0 or need <= 0:
+                break
+            rows = self.capture_index.oldest(budget, uploaded=uploaded)
+            picked = []
+            for rel, size in rows:
+                if need <= 0:
+                    break
+                picked.append((rel, size))
+                need -= size or 0
+            removed = self._delete(picked)
+            # Files that could not be deleted free nothing and do not use up the batch
+            done = set(removed)
+            need += sum(size or 0 for rel, size in picked if rel not in done)
+            deleted += removed
+            budget -= len(removed)
+
+        self.deleted_total += len(deleted)
+        self.last_deleted = len(deleted)
+        self.last_run = time.time()
+        if deleted:
+            print(f"[Storage] Retention pass deleted {len(deleted)} files.", file=sys.stderr)
+        return deleted, budget <= 0
+
+    def get_status(self):
+        usage = shutil.disk_usage(self.capture_dir)
+        shard_bytes = self.shard_bytes()
+        used_bytes = self.capture_index.total_bytes() + shard_bytes
+        blocked_reason = self.blocked_reason()
+        return {
+            "free_mb": round(usage.free / MB, 1),
+            "total_mb": round(usage.total / MB, 1),
+            "captures_mb": round(used_bytes / MB, 1),
+            "shards_mb": round(shard_bytes / MB, 1),
+            "quota_mb": self.quota_mb,
+            "min_free_mb": self.min_free_mb,
+            "target_free_mb": self.target_free_mb,
+            "captures_blocked": blocked_reason is not None,
+            "blocked_reason": blocked_reason,
+            "deleted_total": self.deleted_total,
+            "shards_deleted": self.shards_deleted,
+            "last_deleted": self.last_deleted,
+            "last_run": self.last_run
+        }
+
+    async def run(self):
+        """Background loop: one bounded pass per interval, or back-to-back while behind."""
+        print(f"[Storage] Retention job started (quota={self.quota_mb} MB, min_free={self.min_free_mb} MB).", file=sys.stderr)
+        while True:
+            more = False
+            try:
+                deleted, more = await asyncio.to_thread(self.enforce_once)
+                if deleted and self.delete_callback:
+                    await self.delete_callback(deleted)
+            except Exception as e:
+                print(f"[Storage] Error in retention job: {e}", file=sys.stderr)
+            if more:
+                await asyncio.sleep(0.5) # Yield the disk to captures between batches
+                continue
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.check_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
@@ -0,0 +1,194 @@
+import cv2
+import itertools
+import math
+import numpy as np
+import sys
+import time
+from threading import Lock
+
+
+def compute_grid_layout(count, columns=0):
+    """
+    Returns (rows, cols) for a mosaic of `count` tiles.
+    columns=0 picks a near-square layout automatically.
+    """
+    if count <= 0:
+        return 0, 0
+    if columns and columns > 0:
+        cols = min(columns, count)
+    else:
+        cols = math.ceil(math.sqrt(count))
+    rows = math.ceil(count / cols)
+    return rows, cols
+
+
+def _draw_tile_label(tile, text):
+    """Draws a label with a dark background in the top-left corner of a tile (in place)."""
+    font = cv2.FONT_HERSHEY_SIMPLEX
+    scale = max(0.4, tile.shape[1] / 960.0)
+    thickness = 1
+    (text_w, text_h), baseline = cv2.getTextSize(text, font, scale, thickness)
+    cv2.rectangle(tile, (0, 0), (text_w + 10, text_h + baseline + 10), (0, 0, 0), -1)
+    cv2.putText(tile, text, (5, text_h + 5), font, scale, (255, 255, 255), thickness, cv2.LINE_AA)
+
+
+def compose_mosaic(tiles, tile_width=480, tile_height=270, columns=0, labels=True):
+    """
+    Tiles frames into a single BGR canvas.
+
+    `tiles` is a list of (label, frame, is_rgb) tuples. `frame` may be None (camera not
+    ready) and is then rendered as a black tile. Frames are letterboxed into the tile
+    to preserve their aspect ratio. All tiles are written into one preallocated
+    (N, H, W, 3) buffer and reshaped into the final grid in a single NumPy operation.
+    """
+    rows, cols = compute_grid_layout(len(tiles), columns)
+    if rows == 0:
+        return None
+
+    # One contiguous buffer for every slot in the grid (including empty trailing slots)
+    slots = np.zeros((rows * cols, tile_height, tile_width, 3), dtype=np.uint8)
+
+    for index, (label, frame, is_rgb) in enumerate(tiles):
+        slot = slots[index]
+        if frame is not None and frame.ndim == 3 and frame.shape[0] > 0 and frame.shape[1] > 0:
+            h, w = frame.shape[:2]
+            scale = min(tile_width / w, tile_height / h)
+            new_w = max(1, int(w * scale))
+            new_h = max(1, int(h * scale))
+            resized = cv2.resize(frame, (new_w, new_h), interpolation=cv2.INTER_AREA)
+            y0 = (tile_height - new_h) // 2
+            x0 = (tile_width - new_w) // 2
+            # Drop any padding channel (XBGR) and swap RGB -> BGR with a strided view
+            if is_rgb:
+                slot[y0:y0 + new_h, x0:x0 + new_w] = resized[:, :, 2::-1]
+            else:
+                slot[y0:y0 + new_h, x0:x0 + new_w] = resized[:, :, :3]
+        elif labels:
+            label = f"{label} (no signal)"
+
+        if labels and label:
+            _draw_tile_label(slot, label)
+
+    # (rows*cols, h, w, 3) -> (rows, h, cols, w, 3) -> (rows*h, cols*w, 3)
+    canvas = slots.reshape(rows, cols, tile_height, tile_width, 3).swapaxes(1, 2)
+    return canvas.reshape(rows * tile_height, cols * tile_width, 3)
+
+
+def encode_mjpeg_part(image, quality=80):
+    """Encodes a BGR image as one multipart MJPEG part. Returns None if encoding fails."""
+    flag, encoded_image = cv2.imencode(".jpg", image, [int(cv2.IMWRITE_JPEG_QUALITY), quality])
+    if not flag:
+        print("[Mosaic] Failed to encode frame.", file=sys.stderr)
+        return None
+    return (b'--frame\r\n'
+            b'Content-Type: image/jpeg\r\n\r\n' + encoded_image.tobytes() + b'\r\n')
+
+
+class StreamLimitError(Exception):
+    """Raised when opening a stream would exceed the per-camera or global stream limit."""
+    pass
+
+
+class StreamSession:
+    """One live MJPEG stream. Generators poll `cancelled` and stop when it is set."""
+    def __init__(self, session_id, client, client_id, camera_path, params):
+        self.id = session_id
+        self.client = client
+        self.client_id = client_id
+        self.camera_path = camera_path
+        self.params = params
+        self.started = time.time()
+        self.last_activity = self.started
+        self.frames = 0
+        self.bytes_sent = 0
+        self.cancelled = False
+        self.cancel_reason = None
+        self.fps = 0.0
+        self._window_start = self.started
+        self._window_frames = 0
+
+    def record_frame(self, size):
+        """Called after a frame was handed to the server for sending."""
+        now = time.time()
+        self.frames += 1
+        self.bytes_sent += size
+        self.last_activity = now
+        self._window_frames += 1
+        elapsed = now - self._window_start
+        if elapsed >= 2.0:
+            self.fps = round(self._window_frames / elapsed, 1)
+            self._window_start = now
+            self._window_frames = 0
+
+    def cancel(self, reason):
+        self.cancelled = True
+        self.cancel_reason = reason
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "client": self.client,
+            "client_id": self.client_id,
+            "camera_path": self.camera_path,
+            "params": self.params,
+            "started": self.started,
+            "duration_s": round(time.time() - self.started, 1),
+            "frames": self.frames,
+            "bytes_sent": self.bytes_sent,
+            "fps": self.fps
+        }
+
+
+class StreamRegistry:
+    """
+    Tracks every live preview stream. `client_id` names the viewer slot (one <img>
+    element), so opening a stream from the same host with the same client_id cancels
+    the stream it replaces, e.g. when the UI re-requests with a fresh `t=`.
+    """
+    def __init__(self, max_per_camera=4, max_total=8, stale_after=60.0):
+        self.max_per_camera = max_per_camera
+        self.max_total = max_total
+        self.stale_after = stale_after # Drop sessions that have not sent a frame for this long
+        self.sessions = {}
+        self._lock = Lock()
+        self._counter = itertools.count(1)
+
+    def open(self, client, client_id, camera_path, params=None):
+        with self._lock:
+            now = time.time()
+            for session in list(self.sessions.values()):
+                if client_id and session.client == client and session.client_id == client_id:
+                    session.cancel("superseded")
+                    del self.sessions[session.id]
+                    print(f"[Streams] Cancelled superseded stream {session.id} ({client}/{client_id} -> {session.camera_path})", file=sys.stderr)
+                elif now - session.last_activity > self.stale_after:
+                    session.cancel("stale")
+                    del self.sessions[session.id]
+                    print(f"[Streams] Dropped stale stream {session.id} ({session.client} -> {session.camera_path})", file=sys.stderr)
+
+            per_camera = sum(1 for s in self.sessions.values() if s.camera_path == camera_path)
+            if self.max_per_camera and per_camera >= self.max_per_camera:
+                raise StreamLimitError(f"Too many streams for {camera_path} (limit {self.max_per_camera}).")
+            if self.max_total and len(self.sessions) >= self.max_total:
+                raise StreamLimitError(f"Too many streams in total (limit {self.max_total}).")
+
+            session = StreamSession(next(self._counter), client, client_id, camera_path, params or {})
+            self.sessions[session.id] = session
+            return session
+
+    def close(self, session):
+        with self._lock:
+            self.sessions.pop(session.id, None)
+
+    def cancel(self, session_id, reason="cancelled"):
+        """Cancels a stream by id. Returns False if it does not exist."""
+        with self._lock:
+            session = self.sessions.pop(session_id, None)
+        if not session:
+            return False
+        session.cancel(reason)
+        return True
+
+    def list(self):
+        with self._lock:
+            return [s.to_dict() for s in self.sessions.values()]
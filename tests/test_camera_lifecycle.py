@@ -0,0 +1,129 @@
+import sys
+import os
+import asyncio
+import time
+import unittest
+from threading import Event
+
+# Add project root to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from camera_lifecycle import (
+    CameraLifecycleManager, STATE_COLD, STATE_STREAMING, STATE_SUSPENDED
+)
+
+
+class FakeCamera:
+    def __init__(self):
+        self.is_running = False
+        self.ready_event = Event()
+        self.consumers = 0
+        self.starts = 0
+        self.suspends = 0
+
+    def start(self):
+        self.starts += 1
+        self.is_running = True
+        self.ready_event.set()
+
+    def suspend(self):
+        self.suspends += 1
+        self.is_running = False
+        self.ready_event.clear()
+
+    def has_consumers(self):
+        return self.consumers > 0
+
+
+class TestCameraLifecycle(unittest.TestCase):
+    def setUp(self):
+        self.published = []
+
+        async def publish(camera_path, state, extra):
+            self.published.append((camera_path, state))
+
+        self.manager = CameraLifecycleManager(idle_timeout=0.05, publish_callback=publish)
+        self.camera = FakeCamera()
+
+    def run_async(self, coro):
+        return asyncio.run(coro)
+
+    def test_cold_start_and_idle_suspend(self):
+        async def scenario():
+            await self.manager.register("pi_0")
+            await self.manager.ensure_running("pi_0", self.camera)
+            await asyncio.sleep(0.1)
+            await self.manager.check_idle({"pi_0": self.camera})
+
+        self.run_async(scenario())
+        self.assertEqual(self.camera.suspends, 1)
+        self.assertEqual(self.manager.get_status("pi_0")["state"], STATE_SUSPENDED)
+        self.assertEqual([state for _, state in self.published], [STATE_COLD, "warming", STATE_STREAMING, STATE_SUSPENDED])
+
+    def test_consumers_and_jobs_prevent_suspend(self):
+        async def scenario():
+            await self.manager.ensure_running("pi_0", self.camera)
+            await asyncio.sleep(0.1)
+            self.camera.consumers = 1
+            await self.manager.check_idle({"pi_0": self.camera})
+            self.camera.consumers = 0
+            await asyncio.sleep(0.1)
+            await self.manager.check_idle({"pi_0": self.camera}, jobs_running=True)
+
+        self.run_async(scenario())
+        self.assertEqual(self.camera.suspends, 0)
+        self.assertEqual(self.manager.get_status("pi_0")["state"], STATE_STREAMING)
+
+    def test_resume_records_latency(self):
+        async def scenario():
+            await self.manager.ensure_running("pi_0", self.camera)
+            await asyncio.sleep(0.1)
+            await self.manager.check_idle({"pi_0": self.camera})
+            return await self.manager.ensure_running("pi_0", self.camera)
+
+        latency = self.run_async(scenario())
+        self.assertEqual(self.camera.starts, 2)
+        self.assertGreaterEqual(latency, 0.0)
+        status = self.manager.get_status("pi_0")
+        self.assertEqual(status["state"], STATE_STREAMING)
+        self.assertEqual(status["suspend_count"], 1)
+        self.assertIsNotNone(status["last_start_latency_s"])
+
+    def test_disabled_timeout_never_suspends(self):
+        self.manager.idle_timeout = 0
+
+        async def scenario():
+            await self.manager.ensure_running("pi_0", self.camera)
+            self.manager.last_active["pi_0"] = time.time() - 3600
+            await self.manager.check_idle({"pi_0": self.camera})
+
+        self.run_async(scenario())
+        self.assertEqual(self.camera.suspends, 0)
+
+    def test_resume_does_not_block_event_loop(self):
+        slow_start = self.camera.start
+
+        def start():
+            time.sleep(0.3) # Sensor configuration / device open
+            slow_start()
+
+        self.camera.start = start
+        ticks = []
+
+        async def ticker():
+            while True:
+                ticks.append(time.time())
+                await asyncio.sleep(0.02)
+
+        async def scenario():
+            task = asyncio.create_task(ticker())
+            await self.manager.ensure_running("pi_0", self.camera)
+            task.cancel()
+
+        self.run_async(scenario())
+        self.assertTrue(self.camera.is_running)
+        self.assertGreater(len(ticks), 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+import sys
+import os
+import time
+import unittest
+from threading import Thread
+from unittest.mock import MagicMock, patch
+
+import cv2  # Imported up front so patch.dict does not unload it between tests
+import numpy as np
+
+# Add project root to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+
+class TestCaptureArbitration(unittest.TestCase):
+    def setUp(self):
+        # Hardware-only modules are mocked so camera_handler can be imported anywhere
+        self.picamera2_module = MagicMock()
+        self.patcher = patch.dict(sys.modules, {
+            'picamera2': self.picamera2_module, 'picamera2.encoders': MagicMock(),
+            'picamera2.outputs': MagicMock(), 'libcamera': MagicMock()
+        })
+        self.patcher.start()
+        if 'camera_handler' in sys.modules:
+            del sys.modules['camera_handler']
+        import camera_handler
+
+        self.picam2 = MagicMock()
+        self.picam2.camera_controls = {}
+        self.device_calls_while_busy = 0
+        self.busy = False
+
+        def capture_array():
+            if self.busy:
+                self.device_calls_while_busy += 1
+            return np.full((4, 4, 4), 7, dtype=np.uint8)
+
+        def capture_file(path):
+            self.busy = True
+            time.sleep(0.3)
+            self.busy = False
+
+        self.picam2.capture_array.side_effect = capture_array
+        self.picam2.capture_file.side_effect = capture_file
+        camera_handler.Picamera2 = MagicMock(return_value=self.picam2)
+
+        self.camera = camera_handler.PiCamera(0, "Fake Pi", 4608, 2592)
+        self.camera.start()
+
+    def tearDown(self):
+        self.patcher.stop()
+
+    def test_preview_holds_last_frame_during_still_capture(self):
+        first = self.camera.capture_array()
+        self.assertIsNotNone(first)
+
+        frames = []
+        worker = Thread(target=self.camera.capture_to_file, args=("/tmp/still.jpg", 4608, 2592))
+        worker.start()
+        time.sleep(0.05)
+        while worker.is_alive():
+            frames.append(self.camera.capture_array())
+            time.sleep(0.02)
+        worker.join()
+
+        self.assertTrue(frames)
+        self.assertTrue(all(frame is first for frame in frames))
+        self.assertEqual(self.device_calls_while_busy, 0)
+
+        status = self.camera.get_status()
+        self.assertFalse(status["preview_paused"])
+        self.assertEqual(status["preview_pauses"]["count"], 1)
+        self.assertGreaterEqual(status["preview_pauses"]["last_s"], 0.25)
+        self.assertTrue(self.camera.is_running)
+        self.assertFalse(self.camera.has_consumers())
+
+        # Preview resumes with fresh frames afterwards
+        self.assertIsNot(self.camera.capture_array(), first)
+
+    def test_same_resolution_capture_does_not_pause(self):
+        self.camera.capture_to_file("/tmp/still.jpg", self.camera.width, self.camera.height)
+        self.assertEqual(self.camera.get_status()["preview_pauses"]["count"], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
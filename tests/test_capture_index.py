@@ -0,0 +1,149 @@
+import sys
+import os
+import tempfile
+import pathlib
+import unittest
+
+# Add project root to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from capture_index import CaptureIndex
+
+
+class TestCaptureIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.capture_dir = pathlib.Path(self.tmp.name) / "captures"
+        (self.capture_dir / "images" / "default").mkdir(parents=True)
+        (self.capture_dir / "images" / "session1").mkdir(parents=True)
+        self.index = CaptureIndex(pathlib.Path(self.tmp.name) / "index.db", self.capture_dir)
+
+    def tearDown(self):
+        self.index.close()
+        self.tmp.cleanup()
+
+    def make_file(self, rel, mtime):
+        path = self.capture_dir / rel
+        path.write_bytes(b"\xff\xd8jpeg")
+        os.utime(path, (mtime, mtime))
+        return path
+
+    def test_recent_is_ordered_by_mtime(self):
+        for i, rel in enumerate(["images/default/a.jpg", "images/session1/b.jpg", "images/default/c.jpg"]):
+            self.index.add(self.make_file(rel, 1000 + i), camera="pi_0")
+        self.assertEqual(self.index.recent(2), ["images/default/c.jpg", "images/session1/b.jpg"])
+        self.assertEqual(self.index.count(), 3)
+
+    def test_remove_and_remove_tree(self):
+        a = self.make_file("images/default/a.jpg", 1000)
+        self.index.add(a)
+        self.index.add(self.make_file("images/session1/b.jpg", 1001))
+        self.index.add(self.make_file("images/session1/c.jpg", 1002))
+
+        self.index.remove([str(a)])
+        self.index.remove_tree(self.capture_dir / "images" / "session1")
+        self.assertEqual(self.index.count(), 0)
+
+    def test_rebuild_from_disk(self):
+        self.index.add(self.make_file("images/default/a.jpg", 1000), camera="usb_0")
+        self.make_file("images/session1/b.jpg", 1001)
+        self.make_file("images/session1/.partial_c.jpg", 1002)
+        (self.capture_dir / "images" / "default" / "notes.txt").write_text("x")
+        os.remove(self.capture_dir / "images" / "default" / "a.jpg")
+        self.make_file("images/default/a.jpg", 1003)
+
+        self.assertEqual(self.index.rebuild(), 2)
+        self.assertEqual(self.index.all_paths(), ["images/default/a.jpg", "images/session1/b.jpg"])
+        self.assertEqual(self.index.recent(1), ["images/default/a.jpg"])
+
+    def test_cursor_returns_only_changes(self):
+        a = self.make_file("images/default/IMG_a.jpg", 1000)
+        self.index.add(a, camera="pi_0")
+        self.index.add(self.make_file("images/default/IMG_b.jpg", 1001), camera="usb_0")
+        first = self.index.changes(limit=20)
+        self.assertEqual([e["path"] for e in first["added"]], ["images/default/IMG_b.jpg", "images/default/IMG_a.jpg"])
+
+        self.index.add(self.make_file("images/session1/IMG_c.jpg", 1002), camera="pi_0")
+        self.index.remove(a)
+        page = self.index.changes(since=first["cursor"])
+        self.assertEqual([e["path"] for e in page["added"]], ["images/session1/IMG_c.jpg"])
+        self.assertEqual(page["removed"], ["images/default/IMG_a.jpg"])
+        self.assertFalse(page["reset"])
+
+        idle = self.index.changes(since=page["cursor"])
+        self.assertEqual((idle["added"], idle["removed"]), ([], []))
+
+    def test_pages_and_filters(self):
+        for i in range(5):
+            self.index.add(self.make_file(f"images/default/IMG_{i}.jpg", 1000 + i), camera="pi_0")
+        self.index.add(self.make_file("images/session1/INT_x.jpg", 1010), camera="usb_0")
+
+        page = self.index.changes(limit=2, camera="pi_0")
+        self.assertEqual([e["path"] for e in page["added"]], ["images/default/IMG_4.jpg", "images/default/IMG_3.jpg"])
+        older = self.index.changes(limit=10, camera="pi_0", before=page["next_before"])
+        self.assertEqual(len(older["added"]), 3)
+        self.assertFalse(older["has_more"])
+
+        self.assertEqual([e["path"] for e in self.index.changes(prefix="INT")["added"]], ["images/session1/INT_x.jpg"])
+        self.assertEqual(len(self.index.changes(subfolder="default", start=1003)["added"]), 2)
+
+        incremental = self.index.changes(since=0, limit=4)
+        self.assertTrue(incremental["has_more"])
+        rest = self.index.changes(since=incremental["cursor"], limit=4)
+        self.assertEqual(len(rest["added"]), 2)
+
+    def test_iter_selection_pages_through_matches(self):
+        for i in range(7):
+            self.index.add(self.make_file(f"images/default/{i}.jpg", 1000 + i), camera="pi_0")
+        self.index.add(self.make_file("images/session1/x.jpg", 2000), camera="usb_0")
+        self.assertEqual(list(self.index.iter_selection(page=3, subfolder="default")),
+                         [f"images/default/{i}.jpg" for i in range(7)])
+        self.assertEqual(list(self.index.iter_selection(camera="usb_0")), ["images/session1/x.jpg"])
+
+    def test_rebuild_resets_old_cursors(self):
+        self.index.add(self.make_file("images/default/a.jpg", 1000))
+        cursor = self.index.changes()["cursor"]
+        self.index.rebuild()
+        page = self.index.changes(since=cursor)
+        self.assertTrue(page["reset"])
+        self.assertFalse(self.index.changes(since=page["cursor"])["reset"])
+
+
+    def test_cursor_from_a_recreated_index_resets(self):
+        for name in ("a", "b", "c"):
+            self.index.add(self.make_file(f"images/default/{name}.jpg", 1000))
+        cursor = self.index.changes()["cursor"]
+        self.index.close()
+        os.remove(pathlib.Path(self.tmp.name) / "index.db")
+
+        self.index = CaptureIndex(pathlib.Path(self.tmp.name) / "index.db", self.capture_dir)
+        self.index.add(self.make_file("images/default/d.jpg", 1001))
+        page = self.index.changes(since=cursor)
+        self.assertTrue(page["reset"])
+        self.assertEqual([entry["path"] for entry in page["added"]], ["images/default/d.jpg"])
+        self.assertFalse(self.index.changes(since=page["cursor"])["reset"])
+
+    def test_total_bytes_is_kept_up_to_date(self):
+        def stored():
+            return self.index._conn.execute("SELECT COALESCE(SUM(size), 0) FROM captures").fetchone()[0]
+
+        a = self.make_file("images/default/a.jpg", 1000)
+        self.index.add(a)
+        self.index.add(self.make_file("images/session1/b.jpg", 1001))
+        a.write_bytes(b"x" * 100)
+        self.index.add(a) # Re-indexed with a new size
+        self.assertEqual(self.index.total_bytes(), 100 + 6)
+        self.index.remove([str(a), "images/default/unknown.jpg"])
+        self.assertEqual(self.index.total_bytes(), stored())
+        self.index.remove_tree(self.capture_dir / "images" / "session1")
+        self.assertEqual(self.index.total_bytes(), 0)
+
+        self.make_file("images/session1/c.jpg", 1002)
+        self.index.rebuild()
+        self.assertEqual(self.index.total_bytes(), stored())
+        self.index.close()
+        self.index = CaptureIndex(pathlib.Path(self.tmp.name) / "index.db", self.capture_dir)
+        self.assertEqual(self.index.total_bytes(), stored())
+
+if __name__ == '__main__':
+    unittest.main()
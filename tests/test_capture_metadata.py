@@ -0,0 +1,102 @@
+import sys
+import os
+import asyncio
+import tempfile
+import pathlib
+import unittest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import cv2  # Imported up front so patch.dict does not unload it between tests
+import numpy as np
+
+# Add project root to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+JPEG = cv2.imencode(".jpg", np.full((48, 64, 3), 120, dtype=np.uint8))[1].tobytes()
+SAVED_FRAME = {"ExposureTime": 20000, "AnalogueGain": 2.0, "SensorTimestamp": 123456789, "LensPosition": 1.5}
+PREVIEW_FRAME = {"ExposureTime": 999, "AnalogueGain": 8.0, "SensorTimestamp": 987654321, "LensPosition": 0.0}
+
+
+class TestCaptureMetadata(unittest.TestCase):
+    def setUp(self):
+        # Hardware-only modules are mocked so camera_handler and main can be imported anywhere
+        self.patcher = patch.dict(sys.modules, {
+            'picamera2': MagicMock(), 'picamera2.encoders': MagicMock(),
+            'picamera2.outputs': MagicMock(), 'libcamera': MagicMock()
+        })
+        self.patcher.start()
+        for name in ('main', 'camera_handler'):
+            sys.modules.pop(name, None)
+        import camera_handler
+        import main
+        from capture_index import CaptureIndex
+        from manifest_writer import ManifestWriter
+        self.main = main
+
+        self.tmp = tempfile.TemporaryDirectory()
+        self.capture_dir = pathlib.Path(self.tmp.name) / "captures"
+        self.capture_dir.mkdir()
+        self.index = CaptureIndex(db_path=pathlib.Path(self.tmp.name) / "index.db", capture_dir=self.capture_dir)
+        self.manifest = ManifestWriter(self.capture_dir / "manifests", self.capture_dir)
+
+        self.picam2 = MagicMock()
+        self.picam2.camera_controls = {}
+        self.picam2.capture_array.return_value = np.zeros((4, 4, 4), dtype=np.uint8)
+        self.picam2.capture_metadata.return_value = PREVIEW_FRAME # What a later preview frame reports
+
+        def capture_file(path):
+            with open(path, "wb") as f:
+                f.write(JPEG)
+            return dict(SAVED_FRAME)
+
+        self.picam2.capture_file.side_effect = capture_file
+        camera_handler.Picamera2 = MagicMock(return_value=self.picam2)
+        self.camera = camera_handler.PiCamera("pi_0", "Fake Pi", 4608, 2592)
+        self.camera.start()
+
+        for target, attribute, value in [
+            (main, "CAPTURE_DIR_BASE", self.capture_dir),
+            (main, "capture_index", self.index),
+            (main, "manifest_writer", self.manifest),
+            (main, "thumbnails_at_capture", False),
+            (main, "enqueue_uploads", MagicMock(return_value=0)),
+            (main, "load_config", MagicMock(return_value={})),
+            (main.storage_manager, "check_capture_allowed", MagicMock()),
+            (main.camera_lifecycle, "ensure_running", AsyncMock(return_value=0.0)),
+        ]:
+            patcher = patch.object(target, attribute, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        active = patch.dict(main.active_cameras, {"pi_0": self.camera}, clear=True)
+        active.start()
+        self.addCleanup(active.stop)
+
+    def tearDown(self):
+        self.manifest.close()
+        self.index.close()
+        self.tmp.cleanup()
+        self.patcher.stop()
+
+    def test_capture_returns_metadata_of_saved_frame(self):
+        path = pathlib.Path(self.tmp.name) / "still.jpg"
+        self.assertEqual(self.camera.capture_to_file(str(path), 4608, 2592), SAVED_FRAME)
+        self.assertTrue(self.camera.is_running) # Video mode restored afterwards
+
+    def test_manifest_record_matches_saved_frame(self):
+        request = self.main.CaptureAllRequest(resolution="4608x2592", request_id="r1")
+        files = asyncio.run(self.main.perform_global_capture(request, source="Test"))
+        self.assertEqual(len(files), 1)
+
+        record, = self.manifest.iter_records("default")
+        self.assertEqual(record["sensor_timestamp"], SAVED_FRAME["SensorTimestamp"])
+        self.assertEqual(record["exposure_us"], SAVED_FRAME["ExposureTime"])
+        self.assertEqual(record["analogue_gain"], SAVED_FRAME["AnalogueGain"])
+        self.assertEqual(record["lens_position"], SAVED_FRAME["LensPosition"])
+
+        import piexif
+        exif = piexif.load(files[0])
+        self.assertEqual(exif["Exif"][piexif.ExifIFD.ExposureTime], (20000, 1_000_000))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import sys
+import os
+import tempfile
+import pathlib
+import time
+import unittest
+from unittest.mock import patch
+
+# Add project root to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from capture_writer import CaptureWriter, PARTIAL_PREFIX, is_complete_jpeg
+
+JPEG = b"\xff\xd8" + b"\x00" * 64 + b"\xff\xd9"
+
+
+class TestCaptureWriter(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.image_dir = pathlib.Path(self.tmp.name) / "images" / "default"
+        self.image_dir.mkdir(parents=True)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write(self, writer, name):
+        final = self.image_dir / name
+        temp = writer.temp_path(final)
+        temp.write_bytes(JPEG)
+        self.assertFalse(final.exists())
+        writer.commit(temp, final)
+        return final
+
+    def test_temp_name_keeps_extension_and_rename_is_atomic(self):
+        writer = CaptureWriter(policy="none")
+        temp = writer.temp_path(self.image_dir / "IMG_1.jpg")
+        self.assertEqual(temp.name, PARTIAL_PREFIX + "IMG_1.jpg")
+        final = self.write(writer, "IMG_1.jpg")
+        self.assertTrue(final.exists())
+        self.assertFalse(temp.exists())
+        self.assertEqual(writer.fsyncs, 0)
+
+    def test_file_policy_syncs_every_commit(self):
+        writer = CaptureWriter(policy="file")
+        with patch("capture_writer.os.fsync") as fsync:
+            self.write(writer, "IMG_1.jpg")
+            self.write(writer, "IMG_2.jpg")
+        # File data + directory for each commit
+        self.assertEqual(fsync.call_count, 4)
+
+    def test_group_policy_batches_by_count_and_time(self):
+        writer = CaptureWriter(policy="group", group_files=3, group_ms=50)
+        with patch("capture_writer.os.fsync") as fsync:
+            self.write(writer, "IMG_1.jpg")
+            self.write(writer, "IMG_2.jpg")
+            self.assertEqual(fsync.call_count, 0)
+            self.write(writer, "IMG_3.jpg")
+            self.assertEqual(fsync.call_count, 4) # 3 files + 1 directory
+            self.assertEqual(writer.get_status()["pending_sync"], 0)
+
+            self.write(writer, "IMG_4.jpg")
+            writer.flush_if_due()
+            self.assertEqual(fsync.call_count, 4)
+            time.sleep(0.06)
+            writer.flush_if_due()
+            self.assertEqual(fsync.call_count, 6)
+
+    def test_recover_removes_orphans_and_flags_truncated(self):
+        writer = CaptureWriter()
+        (self.image_dir / (PARTIAL_PREFIX + "IMG_9.jpg")).write_bytes(JPEG[:10])
+        good = self.image_dir / "IMG_1.jpg"
+        good.write_bytes(JPEG)
+        bad = self.image_dir / "IMG_2.jpg"
+        bad.write_bytes(JPEG[:20])
+
+        result = writer.recover(self.image_dir.parent, [good, bad])
+        self.assertEqual(result["orphans_removed"], 1)
+        self.assertEqual(result["truncated"], [str(bad)])
+        self.assertEqual(sorted(p.name for p in self.image_dir.iterdir()), ["IMG_1.jpg", "IMG_2.jpg"])
+        self.assertTrue(is_complete_jpeg(good))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import sys
+import os
+import io
+import tarfile
+import tempfile
+import pathlib
+import unittest
+import zipfile
+
+# Add project root to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import export_handler
+from export_handler import stream_zip, stream_tar
+
+
+class TestStreamingExport(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = pathlib.Path(self.tmp.name)
+        self.files = {}
+        for i, size in enumerate([10, 1000, 600 * 1024]):
+            path = self.dir / f"IMG_{i}.jpg"
+            path.write_bytes(os.urandom(size))
+            self.files[f"images/default/IMG_{i}.jpg"] = path
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def entries(self):
+        return list(self.files.items())
+
+    def test_zip_is_stored_and_complete(self):
+        chunks = list(stream_zip(self.entries()))
+        self.assertLessEqual(max(len(c) for c in chunks), export_handler.CHUNK + 1024)
+        with zipfile.ZipFile(io.BytesIO(b"".join(chunks))) as zf:
+            self.assertIsNone(zf.testzip())
+            self.assertEqual(zf.namelist(), list(self.files))
+            for name, path in self.files.items():
+                self.assertEqual(zf.getinfo(name).compress_type, zipfile.ZIP_STORED)
+                self.assertEqual(zf.read(name), path.read_bytes())
+
+    def test_tar_streams_in_chunks(self):
+        chunks = list(stream_tar(self.entries()))
+        self.assertLessEqual(max(len(c) for c in chunks), export_handler.CHUNK + 1024)
+        with tarfile.open(fileobj=io.BytesIO(b"".join(chunks))) as tar:
+            self.assertEqual(tar.getnames(), list(self.files))
+            for name, path in self.files.items():
+                self.assertEqual(tar.extractfile(name).read(), path.read_bytes())
+
+    def test_missing_files_are_skipped(self):
+        entries = self.entries() + [("images/default/gone.jpg", self.dir / "gone.jpg")]
+        with zipfile.ZipFile(io.BytesIO(b"".join(stream_zip(entries)))) as zf:
+            self.assertEqual(len(zf.namelist()), 3)
+        with tarfile.open(fileobj=io.BytesIO(b"".join(stream_tar(entries)))) as tar:
+            self.assertEqual(len(tar.getnames()), 3)
+
+    def test_generator_is_lazy(self):
+        opened = []
+        def entries():
+            for item in self.entries():
+                opened.append(item[0])
+                yield item
+        stream = stream_tar(entries())
+        next(stream)
+        self.assertEqual(len(opened), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import sys
+import os
+import shutil
+import tempfile
+import pathlib
+import time
+import unittest
+
+# Add project root to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from fs_watcher import CaptureTree, Inotify
+
+try:
+    Inotify().close()
+    HAS_INOTIFY = True
+except OSError:
+    HAS_INOTIFY = False
+
+
+@unittest.skipUnless(HAS_INOTIFY, "inotify not available")
+class TestCaptureTree(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = pathlib.Path(self.tmp.name) / "images"
+        (self.root / "default").mkdir(parents=True)
+        (self.root / "default" / "IMG_1.jpg").write_bytes(b"x" * 100)
+        self.events = []
+        self.tree = CaptureTree(self.root, on_change=lambda kind, rel: self.events.append((kind, rel)))
+        self.assertTrue(self.tree.start())
+
+    def tearDown(self):
+        self.tree.stop()
+        self.tmp.cleanup()
+
+    def wait_for(self, event, timeout=3.0):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if event in self.events:
+                return True
+            time.sleep(0.02)
+        return False
+
+    def test_initial_scan_counts_and_sizes(self):
+        self.assertEqual(self.tree.list_dirs(""), ["default"])
+        self.assertEqual(self.tree.stats("default")["bytes"], 100)
+        self.assertEqual(self.tree.stats("")["total_files"], 1)
+        self.assertIsNone(self.tree.list_dirs("missing"))
+        self.assertEqual(self.events, [])
+
+    def test_atomic_rename_reports_final_name_only(self):
+        temp = self.root / "default" / ".partial_IMG_2.jpg"
+        temp.write_bytes(b"y" * 50)
+        os.replace(temp, self.root / "default" / "IMG_2.jpg")
+        self.assertTrue(self.wait_for(("file_created", "default/IMG_2.jpg")))
+        self.assertFalse(any(".partial_" in rel for _, rel in self.events))
+        self.assertEqual(self.tree.stats("")["total_bytes"], 150)
+
+    def test_external_delete_and_new_subfolder(self):
+        os.remove(self.root / "default" / "IMG_1.jpg")
+        self.assertTrue(self.wait_for(("file_deleted", "default/IMG_1.jpg")))
+
+        (self.root / "session" / "a").mkdir(parents=True)
+        (self.root / "session" / "a" / "IMG_3.jpg").write_bytes(b"z" * 10)
+        self.assertTrue(self.wait_for(("file_created", "session/a/IMG_3.jpg")))
+        self.assertEqual(self.tree.list_dirs(""), ["default", "session"])
+        self.assertEqual(self.tree.stats("session")["total_files"], 1)
+
+        shutil.rmtree(self.root / "session")
+        self.assertTrue(self.wait_for(("dir_deleted", "session")))
+        self.assertEqual(self.tree.list_dirs(""), ["default"])
+        self.assertEqual(self.tree.stats("")["total_bytes"], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
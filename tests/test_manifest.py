@@ -0,0 +1,75 @@
+import sys
+import os
+import json
+import hashlib
+import tempfile
+import pathlib
+import unittest
+
+# Add project root to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from manifest_writer import ManifestWriter
+
+JPEG = b"\xff\xd8" + b"\x00" * 1000 + b"\xff\xd9"
+
+
+class TestManifestWriter(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.capture_dir = pathlib.Path(self.tmp.name) / "captures"
+        (self.capture_dir / "images" / "default").mkdir(parents=True)
+        self.manifest = ManifestWriter(self.capture_dir / "manifests", self.capture_dir)
+
+    def tearDown(self):
+        self.manifest.close()
+        self.tmp.cleanup()
+
+    def capture(self, name, subfolder="default", **fields):
+        path = self.capture_dir / "images" / "default" / name
+        path.write_bytes(JPEG)
+        record = self.manifest.build_record(path, **fields)
+        self.manifest.append(subfolder, record)
+        return record
+
+    def test_record_has_size_checksum_and_metadata(self):
+        record = self.capture("IMG_1.jpg", camera="pi_0", exposure_us=10000, request_id="r1", lens_position=None, timestamp=1.0)
+        self.assertEqual(record["file"], "images/default/IMG_1.jpg")
+        self.assertEqual(record["size"], len(JPEG))
+        self.assertEqual(record["sha256"], hashlib.sha256(JPEG).hexdigest())
+        self.assertEqual(record["exposure_us"], 10000)
+        self.assertNotIn("lens_position", record) # Unknown values are left out
+
+        lines = (self.capture_dir / "manifests" / "default.jsonl").read_text().splitlines()
+        self.assertEqual(json.loads(lines[0]), record)
+
+    def test_query_filters_without_images(self):
+        self.capture("IMG_1.jpg", camera="pi_0", request_id="a", timestamp=10.0)
+        self.capture("IMG_2.jpg", camera="usb_0", request_id="a", timestamp=20.0)
+        self.capture("IMG_3.jpg", subfolder="other", camera="pi_0", request_id="b", timestamp=30.0)
+        for path in (self.capture_dir / "images" / "default").iterdir():
+            path.unlink()
+
+        self.assertEqual([r["file"] for r in self.manifest.query(request_id="a")],
+                         ["images/default/IMG_1.jpg", "images/default/IMG_2.jpg"])
+        self.assertEqual(len(self.manifest.query(camera="pi_0")), 2)
+        self.assertEqual(len(self.manifest.query(subfolder="other")), 1)
+        self.assertEqual(len(self.manifest.query(start=15, end=25)), 1)
+        self.assertEqual(len(self.manifest.query(limit=1)), 1)
+
+    def test_nested_subfolder_keeps_jsonl_and_parquet_together(self):
+        jsonl = self.manifest.path_for("site1/session2")
+        parquet = self.manifest.parquet_path_for("site1/session2", 0)
+        self.assertEqual(jsonl.parent, parquet.parent)
+        self.assertEqual((jsonl.name, parquet.name), ("session2.jsonl", "session2-000000.parquet"))
+
+    def test_torn_line_is_skipped_and_terminated(self):
+        path = self.capture_dir / "manifests" / "default.jsonl"
+        path.parent.mkdir()
+        path.write_text('{"file": "a", "timestamp": 1}\n{"file": "b", "time')
+        self.capture("IMG_1.jpg", timestamp=2.0)
+        self.assertEqual([r["file"] for r in self.manifest.query()], ["a", "images/default/IMG_1.jpg"])
+
+
+if __name__ == '__main__':
+    unittest.main()
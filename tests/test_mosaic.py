@@ -0,0 +1,53 @@
+import sys
+import os
+import unittest
+
+import numpy as np
+
+# Add project root to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from stream_handler import compute_grid_layout, compose_mosaic, encode_mjpeg_part
+
+
+class TestMosaic(unittest.TestCase):
+    def test_layout(self):
+        self.assertEqual(compute_grid_layout(0), (0, 0))
+        self.assertEqual(compute_grid_layout(1), (1, 1))
+        self.assertEqual(compute_grid_layout(3), (2, 2))
+        self.assertEqual(compute_grid_layout(5, columns=5), (1, 5))
+        self.assertEqual(compute_grid_layout(2, columns=4), (1, 2))
+
+    def test_tiles_are_placed_in_grid_order(self):
+        red_rgb = np.zeros((90, 160, 4), dtype=np.uint8)
+        red_rgb[:, :, 0] = 255  # XBGR8888 frame from a PiCamera: channel 0 is red
+        blue_bgr = np.zeros((90, 160, 3), dtype=np.uint8)
+        blue_bgr[:, :, 0] = 255  # BGR frame from a USB camera: channel 0 is blue
+
+        canvas = compose_mosaic(
+            [("pi", red_rgb, True), ("usb", blue_bgr, False), ("off", None, False)],
+            tile_width=160, tile_height=90, labels=False
+        )
+        self.assertEqual(canvas.shape, (180, 320, 3))
+        # Tile 0 (top-left) is red in BGR
+        self.assertEqual(tuple(canvas[45, 80]), (0, 0, 255))
+        # Tile 1 (top-right) is blue in BGR
+        self.assertEqual(tuple(canvas[45, 240]), (255, 0, 0))
+        # Missing frame and the unused slot stay black
+        self.assertEqual(int(canvas[90:, :].max()), 0)
+
+    def test_letterbox_keeps_aspect_ratio(self):
+        square = np.full((100, 100, 3), 200, dtype=np.uint8)
+        canvas = compose_mosaic([("sq", square, False)], tile_width=160, tile_height=90, labels=False)
+        # 90x90 image centred in a 160x90 tile -> black side bars
+        self.assertEqual(int(canvas[:, :30].max()), 0)
+        self.assertEqual(int(canvas[45, 80, 0]), 200)
+
+    def test_encode_part(self):
+        canvas = compose_mosaic([("a", None, False)], tile_width=64, tile_height=36)
+        part = encode_mjpeg_part(canvas)
+        self.assertTrue(part.startswith(b'--frame\r\nContent-Type: image/jpeg\r\n\r\n\xff\xd8'))
+
+
+if __name__ == '__main__':
+    unittest.main()
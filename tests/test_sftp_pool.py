@@ -0,0 +1,246 @@
+import sys
+import os
+import io
+import tempfile
+import pathlib
+import posixpath
+import unittest
+from threading import Lock
+from unittest.mock import MagicMock, patch
+
+# Add project root to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import sftp_handler
+import transfer_backends
+from sftp_handler import SFTPHandler, SFTPConnectionPool
+
+CONFIG = {"enabled": True, "host": "test", "username": "user", "password": "pw",
+          "remote_path": "upload", "delete_after_upload": False, "concurrency": 1, "backoff_s": 0}
+
+
+class RemoteFile(io.BytesIO):
+    """In-memory stand-in for paramiko's SFTPFile."""
+    def __init__(self, store, path, mode="wb"):
+        super().__init__(store.get(path, b"") if "r" in mode else b"")
+        self.store, self.path = store, path
+        self.pipelined = None
+
+    def set_pipelined(self, pipelined=True):
+        self.pipelined = pipelined
+
+    def prefetch(self):
+        pass
+
+    def check(self, hash_algorithm, offset=0, length=0, block_size=0):
+        raise IOError("check-file not supported") # Like OpenSSH
+
+    def close(self):
+        self.store[self.path] = self.getvalue()
+        super().close()
+
+
+class TestSFTPConnectionPool(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.files = []
+        for i in range(4):
+            path = pathlib.Path(self.tmp.name) / f"IMG_{i}.jpg"
+            path.write_bytes(b"\xff\xd8" + bytes([i]) * 1000 + b"\xff\xd9")
+            self.files.append(str(path))
+
+        self.remote = {}
+        self.remote_dirs = {"/", "/home", "/home/user"}
+        self.mkdirs = []
+        self.opened = []
+        self.fail_open = None # fn(remote_path) -> exception to raise, or None
+        self.lock = Lock()
+        self.transports = []
+        self.clients = []
+
+        def make_transport(*args, **kwargs):
+            transport = MagicMock()
+            transport.is_active.return_value = True
+            transport.kwargs = kwargs
+            self.transports.append(transport)
+            return transport
+
+        def make_client(transport):
+            client = MagicMock()
+            client.normalize.return_value = "/home/user"
+            def open_remote(path, mode):
+                with self.lock:
+                    self.opened.append(path)
+                error = self.fail_open(path) if self.fail_open else None
+                if error:
+                    raise error
+                return RemoteFile(self.remote, path, mode)
+            def stat(path):
+                if path in self.remote_dirs:
+                    return MagicMock(st_size=4096)
+                if path not in self.remote:
+                    raise IOError(2, "No such file")
+                return MagicMock(st_size=len(self.remote[path]))
+            def mkdir(path):
+                if posixpath.dirname(path) not in self.remote_dirs:
+                    raise IOError(2, "No such file")
+                self.mkdirs.append(path)
+                self.remote_dirs.add(path)
+            def rename(source, target):
+                self.remote[target] = self.remote.pop(source)
+            client.open.side_effect = open_remote
+            client.stat.side_effect = stat
+            client.mkdir.side_effect = mkdir
+            client.posix_rename.side_effect = rename
+            client.remove.side_effect = lambda path: self.remote.pop(path)
+            self.clients.append(client)
+            return client
+
+        self.pool = SFTPConnectionPool()
+        self.patches = [
+            patch.object(sftp_handler, "connection_pool", self.pool),
+            patch.object(sftp_handler.paramiko, "Transport", side_effect=make_transport),
+            patch.object(sftp_handler.paramiko.SFTPClient, "from_transport", side_effect=make_client),
+            patch.object(SFTPHandler, "load_config", return_value=dict(CONFIG)),
+        ]
+        for p in self.patches:
+            p.start()
+
+    def tearDown(self):
+        for p in self.patches:
+            p.stop()
+        self.tmp.cleanup()
+
+    def handler(self, **overrides):
+        handler = SFTPHandler()
+        handler.config.update(overrides)
+        return handler
+
+    def test_batches_share_one_handshake(self):
+        self.assertEqual(self.handler().upload_files(self.files[:2]), self.files[:2])
+        self.assertEqual(self.handler().upload_files(self.files[2:]), self.files[2:])
+        status = self.pool.get_status()
+        self.assertEqual(status["handshakes"], 1)
+        self.assertEqual(status["reuses"], 1)
+        self.assertTrue(status["connected"])
+        self.transports[0].set_keepalive.assert_called_with(30)
+        self.assertEqual(self.remote["/home/user/upload/IMG_3.jpg"], pathlib.Path(self.files[3]).read_bytes())
+
+    def test_dead_connection_is_replaced(self):
+        self.handler().upload_files(self.files[:1])
+        self.transports[0].is_active.return_value = False
+        self.handler().upload_files(self.files[1:2])
+        self.assertEqual(self.pool.get_status()["handshakes"], 2)
+        self.assertEqual(self.pool.get_status()["reconnects"], 1)
+
+    def test_drop_mid_batch_reconnects_and_retries_file(self):
+        def fail_once(path):
+            if path.endswith("IMG_1.jpg.part") and len(self.transports) == 1:
+                self.transports[0].is_active.return_value = False
+                return EOFError()
+        self.fail_open = fail_once
+        uploaded = self.handler().upload_files(self.files[:3])
+        self.assertEqual(uploaded, self.files[:3])
+        names = [p.rsplit("/", 1)[-1] for p in self.opened]
+        self.assertEqual(names.count("IMG_1.jpg.part"), 2)
+        self.assertEqual(self.pool.get_status()["handshakes"], 2)
+
+    def test_parallel_channels_and_transport_tuning(self):
+        handler = self.handler(concurrency=3, window_mb=8, max_packet_kb=64)
+        self.assertEqual(handler.upload_files(self.files), self.files)
+        self.assertEqual(len(self.clients), 3) # One SFTP channel each, one handshake
+        self.assertEqual(self.pool.get_status()["handshakes"], 1)
+        self.assertEqual(self.transports[0].kwargs, {"default_window_size": 8 * 1024 * 1024,
+                                                     "default_max_packet_size": 64 * 1024})
+        self.assertEqual(len(self.remote), 4)
+        batch = self.pool.get_status()["batches"][-1]
+        self.assertEqual((batch["files"], batch["concurrency"], batch["pipelined"]), (4, 3, True))
+        self.assertEqual(batch["bytes"], sum(os.path.getsize(f) for f in self.files))
+
+    def test_failed_file_is_not_reported_or_deleted(self):
+        self.fail_open = lambda path: IOError("permission denied") if path.endswith("IMG_0.jpg.part") else None
+        uploaded = self.handler(delete_after_upload=True, concurrency=2).upload_files(self.files)
+        self.assertEqual(uploaded, self.files[1:])
+        self.assertTrue(os.path.exists(self.files[0]))
+        self.assertFalse(any(os.path.exists(f) for f in self.files[1:]))
+
+    def test_partial_upload_is_resumed_and_renamed(self):
+        data = pathlib.Path(self.files[0]).read_bytes()
+        self.remote["/home/user/upload/IMG_0.jpg.part"] = data[:400] # Left by a dropped connection
+        handler = self.handler()
+        self.assertEqual(handler.upload_files(self.files[:1]), self.files[:1])
+        self.assertEqual(self.remote, {"/home/user/upload/IMG_0.jpg": data})
+        batch = self.pool.get_status()["batches"][-1]
+        self.assertEqual((batch["bytes"], batch["resumed_bytes"]), (len(data) - 400, 400))
+
+    def test_stale_partial_of_another_file_is_not_spliced(self):
+        data = pathlib.Path(self.files[0]).read_bytes()
+        self.remote["/home/user/upload/IMG_0.jpg.part"] = b"\xff\xd8" + b"\x07" * 400 # Another file's upload
+        handler = self.handler(delete_after_upload=True, retries=1)
+        with patch.object(transfer_backends, "backoff_delay", return_value=0):
+            self.assertEqual(handler.upload_files(self.files[:1]), self.files[:1])
+        self.assertEqual(self.remote, {"/home/user/upload/IMG_0.jpg": data}) # Resent from zero after the mismatch
+        self.assertEqual(self.pool.get_status()["batches"][-1]["retries"], 1)
+
+    def test_failing_file_is_retried_with_backoff(self):
+        attempts = []
+        def fail_twice(path):
+            attempts.append(path)
+            return IOError("timeout") if len(attempts) <= 2 else None
+        self.fail_open = fail_twice
+        with patch.object(transfer_backends, "backoff_delay", return_value=0) as backoff:
+            uploaded = self.handler(retries=3, backoff_s=1).upload_files(self.files[:1])
+        self.assertEqual(uploaded, self.files[:1])
+        self.assertEqual([c.args for c in backoff.call_args_list], [(0, 1, 30), (1, 1, 30)])
+        self.assertEqual(self.pool.get_status()["batches"][-1]["retries"], 2)
+
+        self.fail_open = lambda path: IOError("disk full")
+        handler = self.handler(retries=1, delete_after_upload=True)
+        self.assertEqual(handler.upload_files(self.files[1:2]), [])
+        self.assertEqual(handler.errors, {self.files[1]: "disk full"})
+        self.assertTrue(os.path.exists(self.files[1]))
+
+    def test_checksum_mismatch_keeps_local_file(self):
+        handler = self.handler(verify_checksum="sha256", delete_after_upload=True)
+        with patch.object(SFTPHandler, "_remote_checksum", return_value="0" * 64):
+            self.assertEqual(handler.upload_files(self.files[:1]), [])
+        self.assertTrue(os.path.exists(self.files[0]))
+        self.assertNotIn("/home/user/upload/IMG_0.jpg", self.remote)
+        self.assertIn("mismatch", handler.errors[self.files[0]])
+
+        self.assertEqual(self.handler(verify_checksum="sha256", delete_after_upload=True).upload_files(self.files[:1]), self.files[:1])
+        self.assertFalse(os.path.exists(self.files[0]))
+
+    def test_remote_layout_mirrors_subfolders_with_cached_mkdir(self):
+        handler = self.handler()
+        remote_paths = ["images/a/IMG_0.jpg", "images/b/IMG_0.jpg", "images/a/IMG_2.jpg"]
+        files = [self.files[0], self.files[1], self.files[2]]
+        self.assertEqual(handler.upload_files(files, remote_paths), files)
+        self.assertIn("/home/user/upload/images/a/IMG_0.jpg", self.remote)
+        self.assertIn("/home/user/upload/images/b/IMG_0.jpg", self.remote) # Same name, no collision
+        self.assertEqual(self.mkdirs, ["/home/user/upload", "/home/user/upload/images",
+                                       "/home/user/upload/images/a", "/home/user/upload/images/b"])
+
+        # Known directories are not checked again on the same connection
+        stats = self.clients[0].stat.call_count
+        handler.upload_files(self.files[3:], ["images/a/IMG_3.jpg"])
+        self.assertEqual(len(self.mkdirs), 4)
+        self.assertEqual(self.clients[0].stat.call_count - stats, 2) # Only the .part size checks
+
+        flat = self.handler(mirror_subfolders=False)
+        flat.upload_files(self.files[3:], ["images/a/IMG_3.jpg"])
+        self.assertIn("/home/user/upload/IMG_3.jpg", self.remote)
+
+    def test_idle_timeout_closes_connection(self):
+        self.pool.idle_timeout_s = 0.01
+        self.handler().upload_files(self.files[:1])
+        self.pool._last_used -= 1
+        # Run one reaper check directly instead of waiting for its timer
+        with patch.object(sftp_handler.time, "sleep"):
+            self.pool._reap_idle()
+        self.assertFalse(self.pool.is_alive())
+        self.transports[0].close.assert_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+import sys
+import os
+import json
+import tarfile
+import tempfile
+import pathlib
+import unittest
+
+# Add project root to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from shard_writer import ShardWriter, OPEN_SUFFIX, load_index, read_sample
+
+JPEG = b"\xff\xd8" + b"\x00" * 1000 + b"\xff\xd9"
+
+
+class TestShardWriter(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = pathlib.Path(self.tmp.name)
+        self.image_dir = self.root / "images" / "default"
+        self.image_dir.mkdir(parents=True)
+        self.writer = ShardWriter(self.root / "shards")
+        self.writer.configure({"enabled": True, "max_count": 3})
+        self.writer.recover()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def add(self, name, subfolder="default"):
+        path = self.image_dir / name
+        path.write_bytes(JPEG)
+        return self.writer.add(subfolder, path, {"camera": "pi_0", "file": f"images/default/{name}"})
+
+    def test_shard_closes_at_count_and_is_webdataset_tar(self):
+        self.assertEqual(self.add("IMG_1.jpg"), [])
+        self.assertEqual(self.add("IMG_2.jpg"), [])
+        closed = self.add("IMG_3.jpg")
+        self.assertEqual(len(closed), 1)
+        shard = pathlib.Path(closed[0]["path"])
+        self.assertEqual(shard.name, "default-000000.tar")
+        self.assertEqual(closed[0]["count"], 3)
+
+        with tarfile.open(shard) as tar:
+            names = tar.getnames()
+            self.assertEqual(names[:2], ["IMG_1.jpg", "IMG_1.json"])
+            self.assertEqual(len(names), 6)
+            self.assertEqual(tar.extractfile("IMG_2.jpg").read(), JPEG)
+            self.assertEqual(json.loads(tar.extractfile("IMG_2.json").read())["camera"], "pi_0")
+
+        # The next capture starts a new shard with the next number
+        self.add("IMG_4.jpg")
+        self.assertEqual(self.writer.get_status()["open"]["default"]["name"], "default-000001.tar")
+
+    def test_index_gives_random_access(self):
+        for i in range(3):
+            closed = self.add(f"IMG_{i}.jpg")
+        shard = closed[0]["path"]
+        entries = {e["name"]: e for e in load_index(shard)}
+        self.assertEqual(read_sample(shard, entries["IMG_1.jpg"]), JPEG)
+        self.assertEqual(json.loads(read_sample(shard, entries["IMG_1.json"]))["file"], "images/default/IMG_1.jpg")
+
+    def test_size_threshold_and_subfolders_are_separate(self):
+        self.writer.max_bytes = 3000
+        self.add("IMG_1.jpg", subfolder="a")
+        self.add("IMG_2.jpg", subfolder="b")
+        closed = self.add("IMG_3.jpg", subfolder="a")
+        self.assertEqual([pathlib.Path(c["path"]).name for c in closed], ["a-000000.tar"])
+        self.assertIn("b", self.writer.get_status()["open"])
+
+    def test_numbers_persist_across_restarts(self):
+        closed = self.writer.close_idle(force=True)
+        self.assertEqual(closed, [])
+        self.add("IMG_1.jpg")
+        self.writer.close_idle(force=True)
+
+        restarted = ShardWriter(self.root / "shards")
+        restarted.configure({"enabled": True})
+        restarted.recover()
+        self.writer = restarted
+        self.add("IMG_2.jpg")
+        self.assertEqual(restarted.get_status()["open"]["default"]["name"], "default-000001.tar")
+
+    def test_recover_truncates_partial_sample(self):
+        self.add("IMG_1.jpg")
+        self.add("IMG_2.jpg")
+        shard = self.writer._open["default"]
+        shard.file.write(b"garbage from an interrupted write")
+        shard.file.flush()
+
+        restarted = ShardWriter(self.root / "shards")
+        recovered = restarted.recover()
+        self.assertEqual(len(recovered), 1)
+        path = pathlib.Path(recovered[0]["path"])
+        self.assertFalse(pathlib.Path(str(path) + OPEN_SUFFIX).exists())
+        with tarfile.open(path) as tar:
+            self.assertEqual(tar.getnames(), ["IMG_1.jpg", "IMG_1.json", "IMG_2.jpg", "IMG_2.json"])
+        # Uploading it marks the captures inside as uploaded, like a shard closed normally
+        self.assertEqual(recovered[0]["members"], ["images/default/IMG_1.jpg", "images/default/IMG_2.jpg"])
+
+    def test_uploaded_marker_and_delete(self):
+        for i in range(3):
+            closed = self.add(f"IMG_{i}.jpg")
+        shard = closed[0]["path"]
+        self.assertEqual([p for p, _, _ in self.writer.closed_shards(uploaded=False)], [shard])
+        self.assertGreater(self.writer.usage_bytes(), 3 * len(JPEG))
+
+        self.writer.mark_uploaded([shard, closed[0]["index"]])
+        self.assertEqual(self.writer.closed_shards(uploaded=False), [])
+        self.assertEqual([p for p, _, _ in self.writer.closed_shards(uploaded=True)], [shard])
+
+        self.assertTrue(self.writer.delete(shard))
+        self.assertEqual(list(pathlib.Path(shard).parent.iterdir()), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,148 @@
+import sys
+import os
+import tempfile
+import pathlib
+import time
+import unittest
+from unittest.mock import patch
+
+# Add project root to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from capture_writer import CaptureWriter, PARTIAL_PREFIX
+from spool_handler import CaptureSpool
+
+JPEG = b"\xff\xd8" + b"\x00" * 1000 + b"\xff\xd9"
+
+
+class TestCaptureSpool(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.capture_dir = pathlib.Path(self.tmp.name) / "captures"
+        (self.capture_dir / "images" / "default").mkdir(parents=True)
+        self.spool_dir = pathlib.Path(self.tmp.name) / "spool"
+        self.spool = CaptureSpool(self.spool_dir, self.capture_dir, CaptureWriter(policy="none"))
+        self.spool.flush_delay_s = 0.2
+        self.spool.wait_s = 0.3
+        # The test directory is usually on disk; pretend it is a tmpfs mount
+        patcher = patch("spool_handler.filesystem_type", return_value="tmpfs")
+        self.fstype = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.spool.stop()
+        self.tmp.cleanup()
+
+    def capture(self, name):
+        final = self.capture_dir / "images" / "default" / name
+        temp = self.spool.temp_path(final)
+        temp.write_bytes(JPEG)
+        self.spool.stage(temp, final)
+        return final
+
+    def wait_until(self, predicate, timeout=3.0):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if predicate():
+                return True
+            time.sleep(0.02)
+        return False
+
+    def test_capture_lands_in_spool_then_flushes(self):
+        self.spool.start()
+        final = self.capture("IMG_1.jpg")
+        self.assertFalse(final.exists())
+        self.assertEqual(self.spool.locate(final), self.spool_dir / "images/default/IMG_1.jpg")
+
+        self.assertTrue(self.wait_until(final.exists))
+        self.assertEqual(final.read_bytes(), JPEG)
+        self.assertTrue(self.wait_until(lambda: self.spool.get_status()["files"] == 0))
+        self.assertEqual(self.spool.locate(final), final)
+        self.assertFalse((self.spool_dir / "images/default/IMG_1.jpg").exists())
+
+    def test_pinned_upload_from_ram_skips_disk(self):
+        self.spool.flush_delay_s = 0
+        final = self.capture("IMG_1.jpg")
+        with self.spool.pinned([final]) as paths:
+            self.spool.start()
+            time.sleep(0.1)
+            self.assertFalse(final.exists()) # Pinned files are not flushed
+            os.remove(paths[0]) # Upload deleted the local copy
+        self.assertEqual(self.spool.get_status()["files"], 0)
+        time.sleep(0.1)
+        self.assertFalse(final.exists())
+
+    def test_deleted_directory_is_not_flushed_back(self):
+        deleted = [self.capture("IMG_1.jpg"), self.capture("IMG_2.jpg")]
+        other = self.capture_dir / "images" / "other" / "IMG_3.jpg"
+        temp = self.spool.temp_path(other)
+        temp.write_bytes(JPEG)
+        self.spool.stage(temp, other)
+
+        self.assertEqual(self.spool.discard_tree(self.capture_dir / "images" / "default"), 2)
+        self.assertEqual(self.spool.bytes, len(JPEG))
+        self.assertFalse((self.spool_dir / "images/default/IMG_1.jpg").exists())
+
+        self.spool.flush_delay_s = 0
+        self.spool.start()
+        self.assertTrue(self.wait_until(other.exists))
+        self.assertFalse(any(path.exists() for path in deleted))
+
+    def test_backpressure_bypasses_when_full(self):
+        self.spool.max_bytes = 100
+        self.capture("IMG_1.jpg")
+        final = self.capture_dir / "images" / "default" / "IMG_2.jpg"
+        self.assertFalse(self.spool.reserve(final))
+        self.assertEqual(self.spool.bypassed, 1)
+
+        self.spool.start() # Flusher makes room
+        self.assertTrue(self.spool.reserve(final))
+
+    def test_concurrent_captures_reserve_room(self):
+        self.spool.max_bytes = 2500
+        self.capture("IMG_1.jpg") # ~1 KB; the size estimate follows it
+        finals = [self.capture_dir / "images" / "default" / f"CAM{i}.jpg" for i in range(2)]
+        self.assertTrue(self.spool.reserve(finals[0]))
+        # Spooled + reserved + this one would exceed the cap, even though nothing new is staged yet
+        self.assertFalse(self.spool.reserve(finals[1]))
+        self.assertGreater(self.spool.get_status()["reserved_bytes"], 0)
+
+        self.spool.release(finals[0])
+        self.assertTrue(self.spool.reserve(finals[1]))
+        temp = self.spool.temp_path(finals[1])
+        temp.write_bytes(JPEG)
+        self.spool.stage(temp, finals[1]) # Settles the reservation with the real size
+        self.assertEqual(self.spool.get_status()["reserved_bytes"], 0)
+        self.assertEqual(self.spool.bytes, 2 * len(JPEG))
+
+    def test_refuses_spool_on_disk(self):
+        self.fstype.return_value = "ext4"
+        (self.spool_dir / "images" / "default").mkdir(parents=True)
+        (self.spool_dir / "images" / "default" / "IMG_7.jpg").write_bytes(JPEG)
+        self.spool.enabled = True
+        self.assertFalse(self.spool.start())
+        self.assertFalse(self.spool.enabled)
+        # A previous run's leftovers still reach the capture directory
+        self.assertTrue((self.capture_dir / "images" / "default" / "IMG_7.jpg").exists())
+
+    def test_recovers_unflushed_files_on_restart(self):
+        (self.spool_dir / "images" / "default").mkdir(parents=True)
+        (self.spool_dir / "images" / "default" / "IMG_7.jpg").write_bytes(JPEG)
+        (self.spool_dir / "images" / "default" / (PARTIAL_PREFIX + "IMG_8.jpg")).write_bytes(JPEG[:10])
+
+        self.spool.start()
+        final = self.capture_dir / "images" / "default" / "IMG_7.jpg"
+        self.assertTrue(self.wait_until(final.exists))
+        self.assertEqual(self.spool.recovered, 1)
+        self.assertFalse((self.spool_dir / "images" / "default" / (PARTIAL_PREFIX + "IMG_8.jpg")).exists())
+
+    def test_stop_drains_spool(self):
+        self.spool.flush_delay_s = 60
+        self.spool.start()
+        final = self.capture("IMG_1.jpg")
+        self.spool.stop()
+        self.assertTrue(final.exists())
+
+
+if __name__ == '__main__':
+    unittest.main()
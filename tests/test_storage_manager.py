@@ -0,0 +1,153 @@
+import sys
+import os
+import tempfile
+import pathlib
+import time
+import unittest
+from collections import namedtuple
+from unittest.mock import patch
+
+# Add project root to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from capture_index import CaptureIndex
+from storage_manager import StorageManager, StorageFullError, MB
+from shard_writer import ShardWriter
+
+DiskUsage = namedtuple("DiskUsage", "total used free")
+
+
+class TestStorageManager(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.capture_dir = pathlib.Path(self.tmp.name) / "captures"
+        for sub in ("default", "session1"):
+            (self.capture_dir / "images" / sub).mkdir(parents=True)
+        self.index = CaptureIndex(pathlib.Path(self.tmp.name) / "index.db", self.capture_dir)
+        self.storage = StorageManager(self.index, self.capture_dir)
+        self.free = 10_000 * MB
+        patcher = patch("storage_manager.shutil.disk_usage",
+                        side_effect=lambda path: DiskUsage(20_000 * MB, 20_000 * MB - self.free, self.free))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.index.close()
+        self.tmp.cleanup()
+
+    def add(self, rel, mtime, size=1000, uploaded=False):
+        path = self.capture_dir / rel
+        path.write_bytes(b"x" * size)
+        os.utime(path, (mtime, mtime))
+        self.index.add(path)
+        if uploaded:
+            self.index.mark_uploaded([path])
+        return rel
+
+    def test_rejects_below_watermark(self):
+        self.storage.configure({"min_free_mb": 500})
+        self.storage.check_capture_allowed()
+        self.free = 100 * MB
+        with self.assertRaises(StorageFullError):
+            self.storage.check_capture_allowed()
+        self.assertTrue(self.storage.get_status()["captures_blocked"])
+
+    def test_quota_deletes_uploaded_first_then_stops(self):
+        old_local = self.add("images/default/a.jpg", 1000)
+        old_uploaded = self.add("images/default/b.jpg", 1001, uploaded=True)
+        new_uploaded = self.add("images/default/c.jpg", 1002, uploaded=True)
+        self.storage.configure({"quota_mb": 2500 / MB, "min_free_mb": 0, "target_free_mb": 0})
+
+        with self.assertRaises(StorageFullError):
+            self.storage.check_capture_allowed()
+        deleted, more = self.storage.enforce_once()
+        self.assertEqual(deleted, [old_uploaded])
+        self.assertFalse(more)
+        self.assertTrue((self.capture_dir / old_local).exists())
+        self.assertTrue((self.capture_dir / new_uploaded).exists())
+        self.storage.check_capture_allowed()
+
+    def test_unuploaded_files_kept_unless_allowed(self):
+        self.add("images/default/a.jpg", 1000)
+        self.storage.configure({"quota_mb": 500 / MB, "min_free_mb": 0, "target_free_mb": 0})
+        self.assertEqual(self.storage.enforce_once()[0], [])
+        self.storage.delete_unuploaded = True
+        self.assertEqual(self.storage.enforce_once()[0], ["images/default/a.jpg"])
+        self.assertEqual(self.index.count(), 0)
+
+    def test_age_and_subfolder_caps_are_incremental(self):
+        now = time.time()
+        self.add("images/default/old.jpg", now - 10 * 86400, uploaded=True)
+        for i in range(5):
+            self.add(f"images/session1/s{i}.jpg", now - 100 + i, uploaded=True)
+        self.storage.configure({"max_age_days": 7, "subfolder_caps": {"session1": 2}, "batch_size": 2})
+
+        deleted, more = self.storage.enforce_once()
+        self.assertEqual(deleted, ["images/default/old.jpg", "images/session1/s0.jpg"])
+        self.assertTrue(more)
+        deleted, more = self.storage.enforce_once()
+        self.assertEqual(deleted, ["images/session1/s1.jpg", "images/session1/s2.jpg"])
+        self.assertEqual(self.index.subfolder_counts(), {"session1": 2})
+
+    def test_age_and_caps_keep_unuploaded_files(self):
+        now = time.time()
+        self.add("images/default/old.jpg", now - 10 * 86400)
+        for i in range(3):
+            self.add(f"images/session1/s{i}.jpg", now - 100 + i, uploaded=(i == 2))
+        self.storage.configure({"max_age_days": 7, "subfolder_caps": {"session1": 1}})
+
+        self.assertEqual(self.storage.enforce_once()[0], ["images/session1/s2.jpg"])
+        self.assertTrue((self.capture_dir / "images/default/old.jpg").exists())
+
+        self.storage.delete_unuploaded = True
+        self.assertEqual(self.storage.enforce_once()[0], ["images/default/old.jpg", "images/session1/s0.jpg"])
+
+    def test_failed_deletions_do_not_count(self):
+        self.add("images/default/a.jpg", 1000, uploaded=True)
+        self.add("images/default/b.jpg", 1001, uploaded=True)
+        self.storage.configure({"quota_mb": 1500 / MB, "min_free_mb": 0, "target_free_mb": 0, "batch_size": 1})
+        real_remove = os.remove
+
+        def remove(path):
+            if path.endswith("a.jpg"):
+                raise PermissionError("read-only")
+            real_remove(path)
+
+        with patch("storage_manager.os.remove", side_effect=remove):
+            deleted, more = self.storage.enforce_once()
+        self.assertEqual(deleted, [])
+        self.assertFalse(more) # Nothing was deleted, so the batch was not used up
+        self.assertEqual(self.index.count(), 2)
+
+    def test_shards_count_and_uploaded_ones_are_deleted_first(self):
+        shards = ShardWriter(self.capture_dir / "shards")
+        shards.configure({"enabled": True, "max_count": 1})
+        shards.recover()
+        self.storage.shard_writer = shards
+        capture = self.add("images/default/a.jpg", 1000, size=3000)
+        closed = [shards.add("default", self.capture_dir / capture, {})[0] for _ in range(2)]
+        shards.mark_uploaded([closed[0]["path"]])
+
+        self.storage.configure({"quota_mb": 9500 / MB, "min_free_mb": 0, "target_free_mb": 0})
+        self.assertGreater(self.storage.used_bytes(), 9500) # Loose capture + two shards of it
+        # The capture-time check reads running totals; no directory walk
+        with patch("shard_writer.os.walk", side_effect=AssertionError("walked")):
+            with self.assertRaises(StorageFullError):
+                self.storage.check_capture_allowed()
+
+        deleted, _ = self.storage.enforce_once()
+        self.assertEqual(deleted, [])
+        self.assertFalse(os.path.exists(closed[0]["path"]))
+        self.assertTrue(os.path.exists(closed[1]["path"])) # Not uploaded: kept
+        self.assertEqual(self.storage.get_status()["shards_deleted"], 1)
+        self.storage.check_capture_allowed()
+
+        # A shard deleted elsewhere (by an upload) is picked up by the next pass
+        before = self.storage.used_bytes()
+        os.remove(closed[1]["path"])
+        self.storage.enforce_once()
+        self.assertLess(self.storage.used_bytes(), before)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import sys
+import os
+import time
+import unittest
+
+# Add project root to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from stream_handler import StreamRegistry, StreamLimitError
+
+
+class TestStreamRegistry(unittest.TestCase):
+    def test_same_slot_supersedes_previous_stream(self):
+        registry = StreamRegistry()
+        first = registry.open("10.0.0.2", "abc-main", "pi_0")
+        second = registry.open("10.0.0.2", "abc-main", "pi_1")
+        self.assertTrue(first.cancelled)
+        self.assertEqual(first.cancel_reason, "superseded")
+        self.assertFalse(second.cancelled)
+        self.assertEqual([s["id"] for s in registry.list()], [second.id])
+
+    def test_different_slots_and_clients_coexist(self):
+        registry = StreamRegistry()
+        a = registry.open("10.0.0.2", "abc-main", "pi_0")
+        b = registry.open("10.0.0.2", "abc-popup", "pi_0")
+        c = registry.open("10.0.0.3", "abc-main", "pi_0")
+        d = registry.open("10.0.0.2", None, "pi_0")
+        self.assertFalse(any(s.cancelled for s in (a, b, c, d)))
+        self.assertEqual(len(registry.list()), 4)
+
+    def test_limits(self):
+        registry = StreamRegistry(max_per_camera=2, max_total=3)
+        registry.open("h1", None, "pi_0")
+        registry.open("h2", None, "pi_0")
+        with self.assertRaises(StreamLimitError):
+            registry.open("h3", None, "pi_0")
+        registry.open("h3", None, "pi_1")
+        with self.assertRaises(StreamLimitError):
+            registry.open("h4", None, "usb_0")
+
+    def test_close_cancel_and_stale_cleanup(self):
+        registry = StreamRegistry(stale_after=0.05)
+        live = registry.open("h1", None, "pi_0")
+        stale = registry.open("h2", None, "pi_0")
+        registry.close(live)
+        self.assertEqual([s["id"] for s in registry.list()], [stale.id])
+        time.sleep(0.1)
+        registry.open("h3", None, "pi_0")
+        self.assertTrue(stale.cancelled)
+        self.assertEqual(stale.cancel_reason, "stale")
+        self.assertFalse(registry.cancel(stale.id))
+
+    def test_stats(self):
+        registry = StreamRegistry()
+        session = registry.open("h1", "x", "pi_0", {"quality": 70})
+        session.record_frame(1000)
+        session.record_frame(500)
+        info = registry.list()[0]
+        self.assertEqual(info["frames"], 2)
+        self.assertEqual(info["bytes_sent"], 1500)
+        self.assertEqual(info["params"], {"quality": 70})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+import sys
+import os
+import tempfile
+import pathlib
+import time
+import unittest
+
+from PIL import Image
+
+# Add project root to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from thumbnail_cache import ThumbnailCache
+
+
+class TestThumbnailCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.capture_dir = pathlib.Path(self.tmp.name) / "captures"
+        (self.capture_dir / "images" / "default").mkdir(parents=True)
+        self.cache_dir = self.capture_dir / "thumbs"
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def make_capture(self, name, size=(1920, 1080)):
+        rel = f"images/default/{name}"
+        Image.new("RGB", size, (200, 40, 40)).save(self.capture_dir / rel, "JPEG")
+        return rel
+
+    def test_generates_bounded_thumbnail_and_reuses_it(self):
+        cache = ThumbnailCache(self.capture_dir, self.cache_dir, size=320)
+        rel = self.make_capture("IMG_1.jpg")
+        thumb = cache.get(rel)
+        with Image.open(thumb) as img:
+            self.assertLessEqual(max(img.size), 320)
+            self.assertEqual(img.size, (320, 180))
+        self.assertEqual(cache.get(rel), thumb)
+        self.assertEqual((cache.misses, cache.hits), (1, 1))
+
+    def test_stale_thumbnail_is_regenerated(self):
+        cache = ThumbnailCache(self.capture_dir, self.cache_dir)
+        rel = self.make_capture("IMG_1.jpg")
+        thumb = cache.get(rel)
+        os.utime(thumb, (1000, 1000))
+        cache.get(rel)
+        self.assertEqual(cache.misses, 2)
+
+    def test_lru_eviction_and_discard(self):
+        cache = ThumbnailCache(self.capture_dir, self.cache_dir, size=64)
+        rels = [self.make_capture(f"IMG_{i}.jpg") for i in range(3)]
+        for rel in rels:
+            cache.get(rel)
+        one_thumb = cache.total_bytes // 3
+        cache.get(rels[0]) # Most recently used now
+        cache.max_bytes = one_thumb * 2 + one_thumb // 2
+        cache.get(self.make_capture("IMG_3.jpg"))
+
+        self.assertTrue(cache.thumb_path(rels[0]).exists())
+        self.assertFalse(cache.thumb_path(rels[1]).exists())
+        self.assertLessEqual(cache.total_bytes, cache.max_bytes)
+
+        cache.discard(rels[0])
+        self.assertFalse(cache.thumb_path(rels[0]).exists())
+
+    def test_order_survives_restart(self):
+        cache = ThumbnailCache(self.capture_dir, self.cache_dir, size=64)
+        rels = [self.make_capture(f"IMG_{i}.jpg") for i in range(2)]
+        for rel in rels:
+            cache.get(rel)
+        time.sleep(0.01)
+        cache.get(rels[0])
+
+        reloaded = ThumbnailCache(self.capture_dir, self.cache_dir, size=64)
+        self.assertEqual(list(reloaded._entries), [rels[1], rels[0]])
+        self.assertEqual(reloaded.total_bytes, cache.total_bytes)
+
+    def test_missing_capture_raises(self):
+        cache = ThumbnailCache(self.capture_dir, self.cache_dir)
+        with self.assertRaises(FileNotFoundError):
+            cache.get("images/default/missing.jpg")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,139 @@
+import sys
+import os
+import json
+import time
+import tempfile
+import pathlib
+import unittest
+from threading import Event, Thread
+from unittest.mock import patch
+
+# Add project root to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import transfer_backends
+from transfer_worker import TransferProcess, run_job
+from upload_throttle import UploadThrottle
+
+
+class TestTransferWorker(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = pathlib.Path(self.tmp.name)
+        self.files = []
+        for i in range(2):
+            path = self.root / f"IMG_{i}.jpg"
+            path.write_bytes(bytes([i]) * 1000)
+            self.files.append(str(path))
+        self.remote_paths = ["images/a/IMG_0.jpg", "images/a/IMG_1.jpg"]
+        self.config = {"enabled": True, "backend": "local", "local_path": str(self.root / "nfs"),
+                       "delete_after_upload": True, "max_attempts": 4, "concurrency": 1, "backoff_s": 0}
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def child(self, config):
+        """A transfer process whose child reads `config` instead of sftp_config.json."""
+        process = TransferProcess()
+        process.command = [sys.executable, "-c",
+            "import json, transfer_backends, transfer_worker\n"
+            f"transfer_backends.load_transfer_config = lambda: json.loads({json.dumps(json.dumps(config))})\n"
+            "transfer_worker.child_main()"]
+        process.configure({"process": True, "nice": 0})
+        self.addCleanup(process.stop)
+        return process
+
+    def test_run_job_reports_each_file(self):
+        done = []
+        with patch.object(transfer_backends, "load_transfer_config", return_value=self.config):
+            result = run_job(self.files, self.remote_paths, lambda *args: done.append(args))
+        self.assertEqual(result["uploaded"], self.files)
+        self.assertEqual((result["delete_after_upload"], result["max_attempts"]), (True, 4))
+        self.assertEqual(sorted(done), [(f, 1000, True) for f in self.files])
+        self.assertTrue((self.root / "nfs" / "images" / "a" / "IMG_1.jpg").exists())
+
+        with patch.object(transfer_backends, "load_transfer_config", return_value={"enabled": False}):
+            self.assertFalse(run_job(self.files, self.remote_paths)["enabled"])
+
+    def test_child_process_uploads_and_reports(self):
+        process = self.child(self.config)
+        done = []
+        result = process.run(self.files, self.remote_paths, lambda *args: done.append(args))
+        self.assertEqual(result["uploaded"], self.files)
+        self.assertEqual(len(done), 2)
+        self.assertFalse(any(os.path.exists(f) for f in self.files))
+
+        status = process.get_status()
+        self.assertTrue(status["process"]["running"])
+        self.assertNotEqual(status["process"]["pid"], os.getpid())
+        self.assertEqual(status["batches"][-1]["files"], 2)
+
+    def test_dead_child_fails_only_its_own_jobs(self):
+        process = self.child(self.config)
+        released = Event()
+        read_events = process._read_events
+        def gated(child):
+            if process.starts == 1: # The first child's reader
+                released.wait(10) # Old reader sees EOF only after the new job is out
+            read_events(child)
+        process._read_events = gated
+        with process._lock:
+            process._start()
+        first = process._process
+        first.kill()
+        first.wait()
+
+        done = []
+        runner = Thread(target=lambda: done.append(process.run(self.files, self.remote_paths,
+                                                               lambda *args: done.append(args))))
+        runner.start()
+        deadline = time.time() + 10
+        while not process._pending and time.time() < deadline:
+            time.sleep(0.01)
+        released.set()
+        runner.join(10)
+
+        result = done[-1]
+        self.assertEqual(result["uploaded"], self.files)
+        self.assertEqual(len(done), 3) # Both file_done callbacks arrived
+        self.assertEqual(process.starts, 2)
+
+    def test_hung_child_is_killed(self):
+        process = TransferProcess()
+        process.command = [sys.executable, "-c", "import time; time.sleep(60)"]
+        process.configure({"process": True, "nice": 0, "job_timeout_s": 0.5})
+        self.addCleanup(process.stop)
+
+        started = time.time()
+        result = process.run(self.files, self.remote_paths)
+        self.assertLess(time.time() - started, 10)
+        self.assertEqual(result["uploaded"], [])
+        self.assertEqual(sorted(result["errors"]), self.files)
+        self.assertIsNone(process._process) # Killed; the next job starts a new child
+        self.assertEqual(process.get_status()["process"]["in_flight"], 0)
+
+    def test_capture_state_is_forwarded(self):
+        throttle = UploadThrottle()
+        sent = []
+        throttle.on_capture_change = lambda *state: sent.append(state)
+        throttle.capture_started()
+        throttle.capture_finished()
+        self.assertEqual([captures for captures, _ in sent], [1, 0])
+
+        child_side = UploadThrottle()
+        child_side.configure({"capture_rate_kb_s": 64})
+        child_side.set_capture_state(*sent[0])
+        self.assertEqual(child_side.current_rate(), 64 * 1024)
+
+    def test_disabled_runs_in_calling_thread(self):
+        process = TransferProcess()
+        process.configure({"process": False})
+        with patch.object(transfer_backends, "load_transfer_config", return_value=self.config):
+            result = process.run(self.files, self.remote_paths)
+        self.assertEqual(result["uploaded"], self.files)
+        self.assertIsNone(process._process)
+        self.assertFalse(process.get_status()["process"]["running"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,125 @@
+import sys
+import os
+import tempfile
+import pathlib
+import time
+import unittest
+from unittest.mock import patch
+
+# Add project root to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import upload_queue
+from upload_queue import UploadQueue
+
+
+class TestUploadQueue(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = pathlib.Path(self.tmp.name)
+        self.capture_dir = self.root / "captures"
+        (self.capture_dir / "images" / "default").mkdir(parents=True)
+        self.db = self.root / "upload_queue.db"
+        self.queue = UploadQueue(self.db, self.capture_dir)
+
+    def tearDown(self):
+        self.queue.close()
+        self.tmp.cleanup()
+
+    def make(self, name):
+        path = self.capture_dir / "images" / "default" / name
+        path.write_bytes(b"\xff\xd8" + b"\x00" * 100)
+        return str(path)
+
+    def test_claim_complete_and_fail(self):
+        files = [self.make(f"IMG_{i}.jpg") for i in range(3)]
+        self.queue.enqueue(files)
+        self.queue.enqueue(files[:1]) # Already queued; ignored
+        self.assertEqual(self.queue.get_status()["pending_bytes"], 3 * 102)
+
+        claimed = self.queue.claim(2)
+        self.assertEqual([e["path"] for e in claimed], files[:2])
+        self.queue.complete([files[0]])
+        self.queue.fail([files[1]], "timeout", max_attempts=1)
+
+        status = self.queue.get_status()
+        self.assertEqual(status["counts"], {"pending": 1, "in_flight": 0, "uploaded": 1, "failed": 1})
+        self.assertEqual(status["recent_failures"][0]["error"], "timeout")
+
+        self.assertEqual(self.queue.retry_failed(), 1)
+        self.assertEqual([e["path"] for e in self.queue.claim(10)], [files[1], files[2]])
+
+    def test_due_summary_and_byte_limited_claim(self):
+        files = [self.make(f"IMG_{i}.jpg") for i in range(4)]
+        self.queue.enqueue(files)
+        count, size, oldest = self.queue.due()
+        self.assertEqual((count, size), (4, 4 * 102))
+        self.assertLessEqual(oldest, time.time())
+
+        self.assertEqual(len(self.queue.claim(10, max_bytes=250)), 2)
+        self.assertEqual(len(self.queue.claim(10, max_bytes=50)), 1) # Always at least one
+        self.assertEqual(self.queue.due()[:2], (1, 102))
+
+    def test_failed_entry_waits_for_backoff(self):
+        path = self.make("IMG_1.jpg")
+        self.queue.enqueue([path])
+        self.queue.claim(1)
+        self.queue.fail([path], errors={path: "connection reset"})
+        self.assertEqual(self.queue.claim(1), []) # Not due yet
+        status = self.queue.get_status()
+        self.assertEqual((status["counts"]["pending"], status["waiting_retry"]), (1, 1))
+        self.assertEqual(status["recent_failures"][0]["error"], "connection reset")
+
+        with patch.object(upload_queue.time, "time", return_value=time.time() + upload_queue.RETRY_MAX_S):
+            claimed = self.queue.claim(1)
+        self.assertEqual(claimed[0]["attempts"], 1)
+
+    def test_backoff_grows_and_is_capped(self):
+        delays = [upload_queue.backoff_delay(n, 2, 30) for n in range(6)]
+        self.assertTrue(1 <= delays[0] <= 2)
+        self.assertTrue(8 <= delays[3] <= 16)
+        self.assertTrue(all(d <= 30 for d in delays))
+
+    def test_in_flight_entries_survive_restart(self):
+        files = [self.make("IMG_1.jpg"), self.make("IMG_2.jpg")]
+        self.queue.enqueue(files)
+        self.queue.claim(1)
+        self.queue.close()
+
+        self.queue = UploadQueue(self.db, self.capture_dir)
+        self.assertEqual(self.queue.get_status()["counts"]["pending"], 2)
+        self.assertEqual(len(self.queue.claim(10)), 2)
+
+    def test_reconcile_drops_missing_and_adds_unqueued(self):
+        kept, gone, new = self.make("IMG_1.jpg"), self.make("IMG_2.jpg"), self.make("IMG_3.jpg")
+        self.queue.enqueue([kept, gone])
+        os.remove(gone)
+
+        old = self.make("IMG_0.jpg")
+        dropped, added, backlog = self.queue.reconcile(os.path.exists, [kept, new], backlog=[old])
+        self.assertEqual((dropped, added, backlog), (1, 1, 1))
+        self.assertEqual(sorted(self.queue.paths()), sorted([kept, new])) # Backlog is only counted
+
+    def test_enabled_since_survives_restart_until_disabled(self):
+        self.assertIsNone(self.queue.enabled_since())
+        self.queue.set_enabled(True)
+        since = self.queue.enabled_since()
+        self.queue.set_enabled(True) # Still on: keeps the first time
+        self.queue.close()
+
+        self.queue = UploadQueue(self.db, self.capture_dir)
+        self.assertEqual(self.queue.enabled_since(), since)
+        self.queue.set_enabled(False)
+        self.assertIsNone(self.queue.enabled_since())
+
+    def test_members_are_returned_with_claim(self):
+        shard = self.capture_dir / "shards" / "default" / "default-000000.tar"
+        shard.parent.mkdir(parents=True)
+        shard.write_bytes(b"tar")
+        members = [self.make("IMG_1.jpg"), self.make("IMG_2.jpg")]
+        self.queue.enqueue([str(shard)], members={str(shard): members})
+        self.assertEqual(self.queue.claim(1)[0]["members"], members)
+
+
+if __name__ == '__main__':
+    unittest.main()
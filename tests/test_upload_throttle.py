@@ -0,0 +1,68 @@
+import sys
+import os
+import time
+import unittest
+from datetime import datetime
+from unittest.mock import patch
+
+# Add project root to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from upload_throttle import TokenBucket, UploadThrottle
+
+
+class TestTokenBucket(unittest.TestCase):
+    def test_consume_holds_the_rate(self):
+        bucket = TokenBucket(rate=100 * 1024, burst_s=0.1)
+        start = time.monotonic()
+        for _ in range(5):
+            bucket.consume(10 * 1024)
+        # 50 KB at 100 KB/s, minus the 10 KB burst
+        self.assertGreaterEqual(time.monotonic() - start, 0.35)
+
+    def test_unlimited_does_not_block(self):
+        bucket = TokenBucket()
+        start = time.monotonic()
+        bucket.consume(100 * 1024 * 1024)
+        self.assertLess(time.monotonic() - start, 0.05)
+
+    def test_rate_change_releases_waiters(self):
+        bucket = TokenBucket(rate=1024)
+        start = time.monotonic()
+        bucket.consume(100 * 1024, rate_fn=lambda: 0) # Limit lifted while waiting
+        self.assertLess(time.monotonic() - start, 0.05)
+
+
+class TestUploadThrottle(unittest.TestCase):
+    def setUp(self):
+        self.throttle = UploadThrottle()
+
+    def test_lowest_applicable_limit_wins(self):
+        self.throttle.configure({"rate_kb_s": 512, "capture_rate_kb_s": 64, "capture_grace_s": 0,
+                                 "temp_limit_c": 70, "hot_rate_kb_s": 128})
+        with patch("system_monitor.get_cpu_temp", return_value=50.0):
+            self.assertEqual(self.throttle.current_rate(), 512 * 1024)
+            self.throttle.capture_started()
+            self.assertEqual(self.throttle.current_rate(), 64 * 1024)
+            self.assertEqual(self.throttle.reason, "capture running")
+            self.throttle.capture_finished()
+            self.assertEqual(self.throttle.current_rate(), 512 * 1024)
+
+        self.throttle._temp_checked = 0
+        with patch("system_monitor.get_cpu_temp", return_value=80.0):
+            self.assertEqual(self.throttle.current_rate(), 128 * 1024)
+
+    def test_windows_cross_midnight(self):
+        self.throttle.configure({"windows": ["22:00-06:00", "12:00-13:00", "bogus"]})
+        self.assertEqual(len(self.throttle.windows), 2)
+        self.assertTrue(self.throttle.in_window(datetime(2024, 1, 1, 23, 30)))
+        self.assertTrue(self.throttle.in_window(datetime(2024, 1, 1, 5, 59)))
+        self.assertTrue(self.throttle.in_window(datetime(2024, 1, 1, 12, 15)))
+        self.assertFalse(self.throttle.in_window(datetime(2024, 1, 1, 9, 0)))
+
+        self.throttle.configure({})
+        self.assertTrue(self.throttle.in_window(datetime(2024, 1, 1, 9, 0)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+import sys
+import os
+import time
+import unittest
+from unittest.mock import MagicMock, patch
+
+import cv2  # Imported up front so patch.dict does not unload it between tests
+import numpy as np
+
+# Add project root to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+
+class FakeCapture:
+    """Minimal stand-in for cv2.VideoCapture that counts grab/read calls."""
+    def __init__(self, *args):
+        self.grabs = 0
+        self.reads = 0
+        self.props = {}
+
+    def isOpened(self):
+        return True
+
+    def set(self, prop, value):
+        self.props[prop] = value
+        return True
+
+    def get(self, prop):
+        import cv2
+        if prop == cv2.CAP_PROP_FRAME_WIDTH:
+            return 1280
+        if prop == cv2.CAP_PROP_FRAME_HEIGHT:
+            return 720
+        return 0
+
+    def grab(self):
+        self.grabs += 1
+        time.sleep(0.005)
+        return True
+
+    def read(self):
+        self.reads += 1
+        time.sleep(0.005)
+        return True, np.zeros((720, 1280, 3), dtype=np.uint8)
+
+    def release(self):
+        pass
+
+
+class TestUSBConsumers(unittest.TestCase):
+    def setUp(self):
+        # Hardware-only modules are mocked so camera_handler can be imported anywhere
+        self.patcher = patch.dict(sys.modules, {
+            'picamera2': MagicMock(), 'picamera2.encoders': MagicMock(),
+            'picamera2.outputs': MagicMock(), 'libcamera': MagicMock()
+        })
+        self.patcher.start()
+        if 'camera_handler' in sys.modules:
+            del sys.modules['camera_handler']
+        import camera_handler
+        self.camera_handler = camera_handler
+        self.fake = FakeCapture()
+        self.cap_patcher = patch.object(camera_handler.cv2, 'VideoCapture', return_value=self.fake)
+        self.cap_patcher.start()
+
+        self.camera = camera_handler.USBCamera(path=0, friendly_name="Fake USB")
+        self.camera.IDLE_GRAB_INTERVAL = 0.05
+        self.camera.start()
+        self.assertTrue(self.camera.ready_event.wait(timeout=2))
+
+    def tearDown(self):
+        self.camera.stop()
+        self.cap_patcher.stop()
+        self.patcher.stop()
+
+    def test_idle_without_consumers(self):
+        time.sleep(0.3)
+        self.assertEqual(self.fake.reads, 0)
+        self.assertGreater(self.fake.grabs, 0)
+        self.assertTrue(self.camera.get_status()["idle"])
+
+    def test_consumer_ramps_up_and_reports_warmup(self):
+        consumer = object()
+        self.camera.acquire(consumer, kind="stream")
+        self.assertTrue(self.camera.wait_for_fresh_frame(2.0))
+        self.assertGreater(self.fake.reads, 0)
+        status = self.camera.get_status()
+        self.assertEqual(status["consumers"], 1)
+        self.assertEqual(status["consumer_kinds"], ["stream"])
+        self.assertIsNotNone(status["last_warmup_s"])
+        self.assertLess(status["last_warmup_s"], self.camera.WARMUP_TIMEOUT)
+
+        self.camera.release(consumer)
+        time.sleep(0.1)
+        reads_after_release = self.fake.reads
+        time.sleep(0.3)
+        self.assertEqual(self.fake.reads, reads_after_release)
+
+    def test_capture_acts_as_consumer(self):
+        import tempfile
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "capture.jpg")
+            self.camera.capture_to_file(path)
+            self.assertTrue(os.path.getsize(path) > 0)
+        self.assertFalse(self.camera.has_consumers())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+import sys
+import os
+import time
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+
+import cv2  # Imported up front so patch.dict does not unload it between tests
+import numpy as np
+
+# Add project root to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+FRAME = np.full((48, 64, 3), 120, dtype=np.uint8)
+JPEG = cv2.imencode(".jpg", FRAME)[1].reshape(-1)
+
+
+class FakeMJPEGCapture:
+    """cv2.VideoCapture stand-in: raw MJPEG buffers while CONVERT_RGB is 0 (if supported), BGR otherwise."""
+    def __init__(self, supports_raw=True, payload=JPEG):
+        self.supports_raw = supports_raw
+        self.payload = payload
+        self.props = {}
+
+    def isOpened(self):
+        return True
+
+    def set(self, prop, value):
+        self.props[prop] = value
+        return True
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_FRAME_WIDTH:
+            return 1280
+        if prop == cv2.CAP_PROP_FRAME_HEIGHT:
+            return 720
+        return 0
+
+    def grab(self):
+        time.sleep(0.005)
+        return True
+
+    def read(self):
+        time.sleep(0.005)
+        if self.supports_raw and self.props.get(cv2.CAP_PROP_CONVERT_RGB) == 0:
+            return True, self.payload.copy()
+        return True, FRAME.copy()
+
+    def release(self):
+        pass
+
+
+class TestUSBPassthrough(unittest.TestCase):
+    def setUp(self):
+        # Hardware-only modules are mocked so camera_handler can be imported anywhere
+        self.patcher = patch.dict(sys.modules, {
+            'picamera2': MagicMock(), 'picamera2.encoders': MagicMock(),
+            'picamera2.outputs': MagicMock(), 'libcamera': MagicMock()
+        })
+        self.patcher.start()
+        if 'camera_handler' in sys.modules:
+            del sys.modules['camera_handler']
+        import camera_handler
+        self.camera_handler = camera_handler
+        self.camera = None
+
+    def tearDown(self):
+        if self.camera:
+            self.camera.stop()
+        self.patcher.stop()
+
+    def start(self, fake):
+        with patch.object(self.camera_handler.cv2, 'VideoCapture', return_value=fake):
+            self.camera = self.camera_handler.USBCamera(path=0, friendly_name="Fake USB")
+            self.camera.start()
+            self.assertTrue(self.camera.ready_event.wait(timeout=2))
+        self.consumer = object()
+        self.camera.acquire(self.consumer, kind="stream")
+        self.assertTrue(self.camera.wait_for_fresh_frame(2.0))
+        self.assertTrue(self.camera.wait_for_fresh_frame(2.0))
+
+    def test_soi_eoi_check(self):
+        is_complete_jpeg = self.camera_handler.is_complete_jpeg
+        self.assertTrue(is_complete_jpeg(JPEG))
+        self.assertTrue(is_complete_jpeg(JPEG.tobytes() + b"\x00" * 16)) # UVC padding
+        self.assertFalse(is_complete_jpeg(JPEG[:-40])) # Truncated: no EOI
+        self.assertFalse(is_complete_jpeg(FRAME))
+
+    def test_passthrough_keeps_camera_bytes(self):
+        self.start(FakeMJPEGCapture())
+        self.assertEqual(self.camera.get_jpeg(), JPEG.tobytes())
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "capture.jpg")
+            with patch.object(self.camera_handler.cv2, 'imwrite') as imwrite:
+                self.camera.capture_to_file(path)
+            imwrite.assert_not_called()
+            with open(path, 'rb') as f:
+                self.assertEqual(f.read(), JPEG.tobytes())
+
+    def test_capture_array_decodes_lazily(self):
+        real_imdecode = cv2.imdecode
+        with patch.object(self.camera_handler.cv2, 'imdecode', side_effect=real_imdecode) as imdecode:
+            self.start(FakeMJPEGCapture())
+            self.assertEqual(imdecode.call_count, 0) # Streaming frames are never decoded
+            self.camera.release(self.consumer)
+            time.sleep(0.05) # Idle: no new frames
+            self.assertEqual(self.camera.capture_array().shape, FRAME.shape)
+            self.camera.capture_array() # Same frame: not decoded again
+            self.assertEqual(imdecode.call_count, 1)
+
+    def test_falls_back_to_decoded_frames(self):
+        self.start(FakeMJPEGCapture(supports_raw=False))
+        self.assertIsNone(self.camera.get_jpeg())
+        self.assertEqual(self.camera.capture_array().shape, FRAME.shape)
+        self.assertEqual(self.camera.cap.props[cv2.CAP_PROP_CONVERT_RGB], 1)
+
+    def test_truncated_frames_are_dropped(self):
+        fake = FakeMJPEGCapture()
+        self.start(fake)
+        fake.payload = JPEG[:-40]
+        seq = self.camera.frame_seq
+        time.sleep(0.1)
+        self.assertEqual(self.camera.frame_seq, seq)
+        self.assertEqual(self.camera.get_jpeg(), JPEG.tobytes())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,139 @@
+import os
+import pathlib
+import sys
+import time
+from collections import OrderedDict
+from threading import Lock, get_ident
+
+from PIL import Image
+
+
+class ThumbnailCache:
+    """
+    Size-bounded on-disk cache of gallery thumbnails.
+
+    Thumbnails mirror the capture layout (`images/<subfolder>/<name>.jpg` under
+    `cache_dir`) and are produced with PIL draft mode, which lets libjpeg decode
+    straight to 1/2, 1/4 or 1/8 scale in the DCT domain instead of decoding the full
+    sensor resolution first. A thumbnail is regenerated when its source is newer.
+    When the cache grows past `max_bytes` the least recently served thumbnails are
+    evicted; serving a thumbnail bumps its mtime so the order survives restarts.
+    """
+    def __init__(self, capture_dir, cache_dir, max_bytes=100 * 1024 * 1024, size=320, quality=75):
+        self.capture_dir = pathlib.Path(capture_dir)
+        self.cache_dir = pathlib.Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.size = size
+        self.quality = quality
+        self._entries = OrderedDict() # rel path -> bytes, least recently used first
+        self.total_bytes = 0
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.locate = None # Optional fn(final path) -> path to read from (e.g. the capture spool)
+        self._load()
+
+    def _load(self):
+        """Rebuilds the LRU order from the thumbnails already on disk."""
+        found = []
+        if self.cache_dir.exists():
+            for root, dirs, files in os.walk(self.cache_dir):
+                for name in files:
+                    path = pathlib.Path(root) / name
+                    if name.startswith("."):
+                        path.unlink(missing_ok=True) # Interrupted write
+                        continue
+                    st = path.stat()
+                    found.append((st.st_mtime, path.relative_to(self.cache_dir).as_posix(), st.st_size))
+        for _, rel, size in sorted(found):
+            self._entries[rel] = size
+            self.total_bytes += size
+
+    def thumb_path(self, rel_path):
+        return self.cache_dir / rel_path
+
+    def _source(self, rel_path):
+        source = self.capture_dir / rel_path
+        return pathlib.Path(self.locate(source)) if self.locate else source
+
+    def get(self, rel_path):
+        """
+        Returns the thumbnail path for a capture (relative to capture_dir), generating
+        it if missing or stale. Raises FileNotFoundError if the capture does not exist.
+        """
+        source = self._source(rel_path)
+        src_mtime = source.stat().st_mtime
+        thumb = self.thumb_path(rel_path)
+        try:
+            fresh = thumb.stat().st_mtime >= src_mtime
+        except FileNotFoundError:
+            fresh = False
+
+        if fresh:
+            self.hits += 1
+            with self._lock:
+                if rel_path in self._entries:
+                    self._entries.move_to_end(rel_path)
+            os.utime(thumb)
+            return thumb
+
+        self.misses += 1
+        return self.generate(rel_path)
+
+    def generate(self, rel_path):
+        """Writes the thumbnail for a capture and returns its path."""
+        source = self._source(rel_path)
+        thumb = self.thumb_path(rel_path)
+        thumb.parent.mkdir(parents=True, exist_ok=True)
+        tmp = thumb.with_name(f".{thumb.name}.{os.getpid()}.{get_ident()}")
+
+        t_start = time.time()
+        with Image.open(source) as img:
+            img.draft("RGB", (self.size, self.size)) # DCT-domain downscale while decoding
+            img = img.convert("RGB")
+            img.thumbnail((self.size, self.size), Image.BILINEAR)
+            img.save(tmp, "JPEG", quality=self.quality)
+        os.replace(tmp, thumb)
+        size = thumb.stat().st_size
+        print(f"[Thumbs] Generated {rel_path} in {time.time() - t_start:.3f}s", file=sys.stderr)
+
+        with self._lock:
+            self.total_bytes += size - self._entries.pop(rel_path, 0)
+            self._entries[rel_path] = size
+            self._evict()
+        return thumb
+
+    def _evict(self):
+        """Drops least recently used thumbnails until under max_bytes. Caller holds the lock."""
+        while self.total_bytes > self.max_bytes and len(self._entries) > 1:
+            rel, size = self._entries.popitem(last=False)
+            self.total_bytes -= size
+            self.thumb_path(rel).unlink(missing_ok=True)
+
+    def discard(self, rel_paths):
+        """Removes the thumbnails of deleted captures. Accepts one path or a list."""
+        if isinstance(rel_paths, (str, pathlib.Path)):
+            rel_paths = [rel_paths]
+        with self._lock:
+            for rel in rel_paths:
+                rel = pathlib.Path(rel).as_posix()
+                self.total_bytes -= self._entries.pop(rel, 0)
+                self.thumb_path(rel).unlink(missing_ok=True)
+
+    def discard_tree(self, rel_dir):
+        """Removes every thumbnail below a deleted capture directory."""
+        prefix = pathlib.Path(rel_dir).as_posix().rstrip("/") + "/"
+        with self._lock:
+            for rel in [r for r in self._entries if r.startswith(prefix)]:
+                self.total_bytes -= self._entries.pop(rel)
+                self.thumb_path(rel).unlink(missing_ok=True)
+
+    def get_status(self):
+        with self._lock:
+            return {
+                "count": len(self._entries),
+                "bytes": self.total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses
+            }
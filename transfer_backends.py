@@ -0,0 +1,511 @@
+import base64
+import hashlib
+import hmac
+import http.client
+import json
+import os
+import pathlib
+import posixpath
+import queue
+import sys
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from threading import Lock, Thread
+from urllib.parse import quote, urlsplit
+
+from manifest_writer import file_checksum
+from upload_queue import backoff_delay
+from upload_throttle import upload_throttle
+
+BASE_DIR = pathlib.Path(__file__).parent.absolute()
+# Historical name: the file holds the settings of whichever backend is selected
+TRANSFER_CONFIG_PATH = BASE_DIR / "sftp_config.json"
+
+MB = 1024 * 1024
+READ_CHUNK = 256 * 1024
+RESUME_CHECKSUM = "sha256" # Verifies resumed uploads when verify_checksum is off
+PARTIAL_SUFFIX = ".part" # Name while a file is being written; renamed once verified
+
+recent_batches = deque(maxlen=20) # Throughput of recent batches of every backend, newest last
+
+
+def load_transfer_config():
+    if not os.path.exists(TRANSFER_CONFIG_PATH):
+        print(f"Transfer config file not found at {TRANSFER_CONFIG_PATH}", file=sys.stderr)
+        return None
+    try:
+        with open(TRANSFER_CONFIG_PATH, 'r') as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"Error loading transfer config: {e}", file=sys.stderr)
+        return None
+
+
+class TransferBackend:
+    """
+    Base class for upload backends, driven by the upload queue.
+
+    `upload_files()` is shared by every backend: it resolves each file's target, sends
+    files over `concurrency` parallel clients, retries failures with exponential
+    backoff and jitter, applies the upload throttle, deletes local copies only after a
+    verified upload and records batch metrics. A backend implements `put()` (upload and
+    verify one file) and, where it needs them, the client, target and directory hooks.
+    """
+    name = None
+    label = "Transfer" # Log prefix
+
+    def __init__(self, config=None):
+        self.config = self.load_config() if config is None else config
+        self.errors = {} # path -> last error for files that failed in the last upload_files call
+        self.on_file_done = None # Optional callback(path, bytes_sent, deleted) after each verified upload
+
+    def load_config(self):
+        return load_transfer_config()
+
+    # --- Backend hooks ---
+
+    def validate(self):
+        """Returns a reason the config cannot be used, or None."""
+        return None
+
+    def connect(self):
+        """Opens one client (connection) for a worker thread."""
+        return None
+
+    def disconnect(self, client):
+        pass
+
+    @contextmanager
+    def session(self, channels):
+        """Yields (clients, reconnect) for one batch."""
+        clients = [self.connect() for _ in range(channels)]
+
+        def reconnect():
+            for client in clients:
+                self.disconnect(client)
+            clients[:] = [self.connect() for _ in range(channels)]
+            return clients
+
+        try:
+            yield clients, reconnect
+        finally:
+            for client in clients:
+                self.disconnect(client)
+
+    def is_alive(self):
+        return True
+
+    def resolve_targets(self, client, relative_paths):
+        """Maps each relative path (posix, below `remote_path`) to this backend's target."""
+        base = self.config.get('remote_path', '') or ''
+        return {rel: posixpath.join(base, rel).lstrip("/") for rel in relative_paths}
+
+    def prepare(self, client, targets, refresh=False):
+        """Creates whatever the targets need (e.g. directories) before upload."""
+        pass
+
+    def put(self, client, local_path, target):
+        """Uploads and verifies one file. Returns (bytes sent, bytes resumed); raises on failure."""
+        raise NotImplementedError
+
+    def batch_info(self):
+        """Extra fields for the batch metrics."""
+        return {}
+
+    def record_batch(self, stats):
+        recent_batches.append(stats)
+
+    # --- Shared ---
+
+    @property
+    def checksum(self):
+        """hashlib name to verify uploads with (size is always checked), or None."""
+        return self.config.get('verify_checksum') or None
+
+    def checksum_for(self, offset):
+        """
+        Checksum for one upload. A resumed upload is always verified: a stale `.part`
+        from another file at the same path would otherwise pass the size check.
+        """
+        return self.checksum or (RESUME_CHECKSUM if offset else None)
+
+    @staticmethod
+    def read_chunks(src):
+        """Reads a file in chunks, holding each back as the bandwidth limit requires."""
+        for chunk in iter(lambda: src.read(READ_CHUNK), b""):
+            upload_throttle.consume(len(chunk)) # Shared by all channels and backends
+            yield chunk
+
+    def _upload_all(self, clients, file_paths, targets, delete_after_upload):
+        """
+        Uploads files to their targets over the given clients in parallel (one worker
+        thread per client). Returns (uploaded {path: (bytes sent, bytes resumed)}, failed {path: error}).
+        """
+        work = queue.Queue()
+        for path in file_paths:
+            work.put(path)
+        uploaded, failed = {}, {}
+        results_lock = Lock()
+
+        def worker(client):
+            while True:
+                try:
+                    local_path = work.get_nowait()
+                except queue.Empty:
+                    return
+                filename = os.path.basename(local_path)
+                print(f"Uploading {filename}...", file=sys.stderr)
+                try:
+                    result = self.put(client, local_path, targets[local_path])
+                    if result[1]:
+                        print(f"Resumed {filename} from byte {result[1]}.", file=sys.stderr)
+                    # Only verified files are deleted locally
+                    if delete_after_upload:
+                        print(f"Successfully uploaded {filename}. Deleting local file...", file=sys.stderr)
+                        os.remove(local_path)
+                    else:
+                        print(f"Successfully uploaded {filename}. Keeping local copy.", file=sys.stderr)
+                    with results_lock:
+                        uploaded[local_path] = result
+                    if self.on_file_done:
+                        self.on_file_done(local_path, result[0], delete_after_upload)
+                except Exception as e:
+                    print(f"Failed to upload {filename}: {e}", file=sys.stderr)
+                    with results_lock:
+                        failed[local_path] = str(e) or type(e).__name__
+
+        if len(clients) == 1:
+            worker(clients[0])
+        else:
+            threads = [Thread(target=worker, args=(client,), daemon=True) for client in clients]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        return uploaded, failed
+
+    def upload_files(self, file_paths, remote_paths=None):
+        """
+        Uploads files and returns the ones that were uploaded, in input order.
+        `remote_paths` gives each file's path below `remote_path` (e.g. `images/default/IMG_1.jpg`),
+        mirroring the local layout; without it (or with `mirror_subfolders` off) files go flat
+        into `remote_path` by name.
+        """
+        if not self.config:
+            print(f"{self.label} configuration missing. Skipping upload.", file=sys.stderr)
+            return False
+
+        if not self.config.get('enabled', False):
+            print(f"{self.label} Auto-Transfer is disabled. Skipping upload.", file=sys.stderr)
+            return False
+
+        problem = self.validate()
+        if problem:
+            print(problem, file=sys.stderr)
+            return False
+
+        # Keeping uploaded files lets the storage manager reclaim them first when space runs low
+        delete_after_upload = self.config.get('delete_after_upload', True)
+        # Parallel clients (SFTP channels, HTTP connections) per batch
+        concurrency = max(1, int(self.config.get('concurrency', 2)))
+        # Per-file retries within a batch, with exponential backoff and jitter between rounds
+        retries = max(0, int(self.config.get('retries', 3)))
+        backoff_s = self.config.get('backoff_s', 2)
+        backoff_max_s = self.config.get('backoff_max_s', 30)
+        if not self.config.get('mirror_subfolders', True):
+            remote_paths = None
+        relative = dict(zip(file_paths, remote_paths or []))
+
+        self.errors = {}
+        pending = []
+        for local_path in file_paths:
+            if not os.path.exists(local_path):
+                print(f"File not found: {local_path}", file=sys.stderr)
+                self.errors[local_path] = "file not found"
+                continue
+            pending.append(local_path)
+
+        uploaded = {}
+        retried = 0
+        t_start = time.time()
+        try:
+            with self.session(min(concurrency, max(1, len(pending)))) as (clients, reconnect):
+                rel_paths = {path: relative.get(path) or os.path.basename(path) for path in pending}
+                resolved = self.resolve_targets(clients[0], sorted(set(rel_paths.values())))
+                targets = {path: resolved[rel] for path, rel in rel_paths.items()}
+                self.prepare(clients[0], targets.values())
+                for attempt in range(retries + 1):
+                    done, failed = self._upload_all(clients, pending, targets, delete_after_upload)
+                    uploaded.update(done)
+                    self.errors.update(failed)
+                    for path in done:
+                        self.errors.pop(path, None)
+                    if not failed or attempt == retries:
+                        break
+                    delay = backoff_delay(attempt, backoff_s, backoff_max_s)
+                    print(f"[{self.label}] Retrying {len(failed)} file(s) in {delay:.1f}s (attempt {attempt + 2}/{retries + 1})...", file=sys.stderr)
+                    time.sleep(delay)
+                    pending = list(failed)
+                    retried += len(pending)
+                    if not self.is_alive():
+                        # The connection dropped; partial files are resumed on the new one
+                        print(f"{self.label} connection lost. Reconnecting...", file=sys.stderr)
+                        try:
+                            clients = reconnect()
+                        except Exception as e:
+                            print(f"{self.label} reconnect failed: {e}", file=sys.stderr)
+                    try:
+                        # Something removed on the server would otherwise stay cached as existing
+                        self.prepare(clients[0], [targets[path] for path in pending], refresh=True)
+                    except Exception as e:
+                        print(f"Failed to prepare upload targets: {e}", file=sys.stderr)
+
+        except Exception as e:
+            print(f"{self.label} connection error: {e}", file=sys.stderr)
+            self.errors.update({path: str(e) for path in file_paths if path not in uploaded})
+
+        if uploaded:
+            seconds = max(time.time() - t_start, 1e-6)
+            total = sum(sent for sent, _ in uploaded.values())
+            stats = {
+                "backend": self.name,
+                "time": t_start,
+                "files": len(uploaded),
+                "bytes": total,
+                "resumed_bytes": sum(resumed for _, resumed in uploaded.values()),
+                "retries": retried,
+                "seconds": round(seconds, 3),
+                "mb_per_s": round(total / MB / seconds, 3),
+                "concurrency": concurrency,
+                **self.batch_info()
+            }
+            self.record_batch(stats)
+            print(f"[{self.label}] Batch: {stats['files']} files, {total / MB:.1f} MB in {seconds:.2f}s ({stats['mb_per_s']} MB/s, x{concurrency})", file=sys.stderr)
+
+        # Input order, so callers can map results back to their own paths
+        return [path for path in file_paths if path in uploaded]
+
+
+class LocalDirBackend(TransferBackend):
+    """
+    Copies files into a local or network-mounted directory (`local_path`, e.g. an NFS
+    or SMB mount). Files are written to `<name>.part`, resumed from its size after an
+    interruption, synced and renamed into place once size (and checksum) match.
+    """
+    name = "local"
+    label = "Local"
+
+    def validate(self):
+        if not self.config.get('local_path'):
+            return "Local backend: local_path missing in config."
+        return None
+
+    def resolve_targets(self, client, relative_paths):
+        base = pathlib.Path(self.config['local_path']) / (self.config.get('remote_path', '') or '').lstrip("/")
+        return {rel: str(base / rel) for rel in relative_paths}
+
+    def prepare(self, client, targets, refresh=False):
+        for directory in {os.path.dirname(t) for t in targets}:
+            os.makedirs(directory, exist_ok=True)
+
+    def put(self, client, local_path, target):
+        partial = target + PARTIAL_SUFFIX
+        local_size = os.path.getsize(local_path)
+        offset = os.path.getsize(partial) if os.path.exists(partial) else 0
+        if offset > local_size:
+            offset = 0
+        sent = 0
+        with open(local_path, 'rb') as src, open(partial, 'r+b' if offset else 'wb') as dest:
+            src.seek(offset)
+            dest.seek(offset)
+            for chunk in self.read_chunks(src):
+                dest.write(chunk)
+                sent += len(chunk)
+            dest.truncate()
+            dest.flush()
+            os.fsync(dest.fileno())
+        if os.path.getsize(partial) != local_size:
+            raise IOError(f"size mismatch after copy ({os.path.getsize(partial)} != {local_size} bytes)")
+        checksum = self.checksum_for(offset)
+        if checksum and file_checksum(partial, checksum) != file_checksum(local_path, checksum):
+            os.remove(partial) # Corrupt or spliced onto a stale partial; the next attempt starts from zero
+            raise IOError(f"{checksum} mismatch after copy")
+        os.replace(partial, target)
+        return sent, offset
+
+
+class HTTPBackend(TransferBackend):
+    """
+    Sends files to an HTTP(S) ingest server at `url`. With `mode: put` each file is
+    a `PUT <url>/<remote path>`; with `mode: multipart` it is a `POST <url>` form
+    with `path` and `file` fields. Bodies are streamed, `headers` are added to every
+    request (e.g. an Authorization token), and the file size and checksum are sent as
+    `X-Content-Length`/`X-Content-<Algorithm>` so the server can verify them. Any 2xx
+    response counts as verified. Each worker keeps its own keep-alive connection.
+    """
+    name = "http"
+    label = "HTTP"
+
+    def validate(self):
+        url = self.config.get('url', '')
+        if urlsplit(url).scheme not in ("http", "https"):
+            return "HTTP backend: url missing or not http(s) in config."
+        return None
+
+    def connect(self):
+        parts = urlsplit(self.config['url'])
+        cls = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+        return cls(parts.netloc, timeout=self.config.get('timeout_s', 60))
+
+    def disconnect(self, client):
+        client.close()
+
+    def resolve_targets(self, client, relative_paths):
+        """Multipart: the `path` form field. PUT: the request path below the URL."""
+        targets = super().resolve_targets(client, relative_paths)
+        if self.config.get('mode') == "multipart":
+            return targets
+        base = urlsplit(self.config['url']).path.rstrip("/")
+        return {rel: f"{base}/{quote(target)}" for rel, target in targets.items()}
+
+    def _verify_headers(self, local_path, size):
+        headers = {"X-Content-Length": str(size)}
+        if self.checksum:
+            headers[f"X-Content-{self.checksum.capitalize()}"] = file_checksum(local_path, self.checksum)
+        return headers
+
+    def _request(self, client, method, path, body, headers):
+        try:
+            client.request(method, path, body=body, headers=headers)
+            response = client.getresponse()
+            detail = response.read(200)
+        except Exception:
+            client.close() # Reopened on the next request
+            raise
+        if not 200 <= response.status < 300:
+            raise IOError(f"HTTP {response.status} {response.reason}: {detail.decode(errors='replace')}")
+
+    def put(self, client, local_path, target):
+        size = os.path.getsize(local_path)
+        headers = {**(self.config.get('headers') or {}), **self._verify_headers(local_path, size)}
+        with open(local_path, 'rb') as src:
+            if self.config.get('mode') == "multipart":
+                boundary = uuid.uuid4().hex
+                head = (f"--{boundary}\r\nContent-Disposition: form-data; name=\"path\"\r\n\r\n{target}\r\n"
+                        f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"{os.path.basename(target)}\"\r\n"
+                        "Content-Type: application/octet-stream\r\n\r\n").encode()
+                tail = f"\r\n--{boundary}--\r\n".encode()
+
+                def body():
+                    yield head
+                    yield from self.read_chunks(src)
+                    yield tail
+
+                headers.update({"Content-Type": f"multipart/form-data; boundary={boundary}",
+                                "Content-Length": str(len(head) + size + len(tail))})
+                self._request(client, "POST", urlsplit(self.config['url']).path or "/", body(), headers)
+            else:
+                headers.update({"Content-Type": "application/octet-stream", "Content-Length": str(size)})
+                self._request(client, "PUT", target, self.read_chunks(src), headers)
+        return size, 0
+
+
+class S3Backend(TransferBackend):
+    """
+    Uploads to S3-compatible object storage (AWS S3, MinIO, Ceph RGW, ...) with
+    SigV4-signed PUTs to `<endpoint>/<bucket>/<key>` (path style, so any local
+    stand-in works). Keys are `remote_path` plus the mirrored relative path. Every
+    PUT carries Content-MD5, so the store itself rejects a corrupted body; the
+    returned ETag is checked against it as well, except under SSE-KMS or SSE-C,
+    where the ETag is not the MD5. Objects up to 5 GB (one PUT).
+    """
+    name = "s3"
+    label = "S3"
+
+    def validate(self):
+        missing = [k for k in ("endpoint", "bucket", "access_key", "secret_key") if not self.config.get(k)]
+        if missing:
+            return f"S3 backend: {', '.join(missing)} missing in config."
+        return None
+
+    def connect(self):
+        parts = urlsplit(self.config['endpoint'])
+        cls = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+        return cls(parts.netloc, timeout=self.config.get('timeout_s', 60))
+
+    def disconnect(self, client):
+        client.close()
+
+    def sign(self, method, path, headers, now=None, payload_hash="UNSIGNED-PAYLOAD"):
+        """Adds SigV4 headers (unsigned payload by default; integrity comes from Content-MD5)."""
+        now = now or datetime.now(timezone.utc)
+        amz_date = now.strftime("%Y%m%dT%H%M%SZ")
+        date = amz_date[:8]
+        region = self.config.get('region', 'us-east-1')
+        headers["Host"] = urlsplit(self.config['endpoint']).netloc
+        headers["x-amz-date"] = amz_date
+        headers["x-amz-content-sha256"] = payload_hash
+        canonical = {k.lower(): str(v).strip() for k, v in headers.items()}
+        signed = ";".join(sorted(canonical))
+        request = "\n".join([method, path, "", "".join(f"{k}:{canonical[k]}\n" for k in sorted(canonical)),
+                             signed, payload_hash])
+        scope = f"{date}/{region}/s3/aws4_request"
+        to_sign = "\n".join(["AWS4-HMAC-SHA256", amz_date, scope, hashlib.sha256(request.encode()).hexdigest()])
+        key = ("AWS4" + self.config['secret_key']).encode()
+        for part in (date, region, "s3", "aws4_request"):
+            key = hmac.new(key, part.encode(), hashlib.sha256).digest()
+        signature = hmac.new(key, to_sign.encode(), hashlib.sha256).hexdigest()
+        headers["Authorization"] = (f"AWS4-HMAC-SHA256 Credential={self.config['access_key']}/{scope}, "
+                                    f"SignedHeaders={signed}, Signature={signature}")
+        return headers
+
+    def put(self, client, local_path, target):
+        size = os.path.getsize(local_path)
+        md5 = bytes.fromhex(file_checksum(local_path, "md5"))
+        path = "/" + quote(f"{self.config['bucket']}/{target}", safe="/-_.~")
+        headers = self.sign("PUT", path, {
+            "Content-Length": str(size),
+            "Content-MD5": base64.b64encode(md5).decode(),
+            "Content-Type": "application/octet-stream"
+        })
+        with open(local_path, 'rb') as src:
+            try:
+                client.request("PUT", path, body=self.read_chunks(src), headers=headers)
+                response = client.getresponse()
+                detail = response.read(300)
+            except Exception:
+                client.close()
+                raise
+        if response.status != 200:
+            raise IOError(f"S3 PUT failed: HTTP {response.status} {detail.decode(errors='replace')}")
+        etag = (response.getheader("ETag") or "").strip('"')
+        # With SSE-KMS or SSE-C the ETag is not the MD5 of the body; Content-MD5 already covered it
+        encrypted = ((response.getheader("x-amz-server-side-encryption") or "").startswith("aws:kms")
+                     or response.getheader("x-amz-server-side-encryption-customer-algorithm"))
+        if etag and not encrypted and etag != md5.hex():
+            raise IOError(f"ETag mismatch after upload ({etag} != {md5.hex()})")
+        return size, 0
+
+
+def backend_class(name):
+    if name in (None, "", "sftp"):
+        from sftp_handler import SFTPHandler # paramiko is only needed for SFTP
+        return SFTPHandler
+    backends = {"local": LocalDirBackend, "http": HTTPBackend, "s3": S3Backend}
+    if name not in backends:
+        raise ValueError(f"Unknown transfer backend '{name}' (expected sftp, local, http or s3)")
+    return backends[name]
+
+
+def create_backend(config=None):
+    """Backend selected by the `backend` key of the transfer config (default: sftp)."""
+    config = load_transfer_config() if config is None else config
+    return backend_class((config or {}).get('backend'))(config)
+
+
+def get_status():
+    config = load_transfer_config() or {}
+    return {"backend": config.get('backend') or "sftp", "batches": list(recent_batches)}
@@ -0,0 +1,285 @@
+import itertools
+import json
+import os
+import pathlib
+import queue
+import subprocess
+import sys
+import time
+from threading import Event, Lock, Thread
+
+import transfer_backends
+from upload_throttle import upload_throttle
+
+BASE_DIR = pathlib.Path(__file__).parent.absolute()
+
+
+def run_job(files, remote_paths, on_file_done=None):
+    """
+    Uploads one batch with the configured backend. Returns a result dict:
+    `enabled`, `uploaded` (paths), `errors` {path: error}, `delete_after_upload`, `max_attempts`.
+    """
+    backend = transfer_backends.create_backend()
+    config = backend.config or {}
+    result = {
+        "enabled": bool(config.get('enabled', False)),
+        "uploaded": [],
+        "errors": {},
+        "delete_after_upload": config.get('delete_after_upload', True),
+        "max_attempts": config.get('max_attempts', 10)
+    }
+    if not result["enabled"]:
+        return result
+    backend.on_file_done = on_file_done
+    result["uploaded"] = backend.upload_files(files, remote_paths) or []
+    result["errors"] = dict(backend.errors)
+    return result
+
+
+def failed_result(files, error):
+    return {"enabled": True, "uploaded": [], "errors": {f: error for f in files},
+            "delete_after_upload": True, "max_attempts": 10}
+
+
+def backend_status():
+    """Recent batches of every backend, plus the SFTP pool if it is in use."""
+    status = transfer_backends.get_status()
+    if "sftp_handler" in sys.modules:
+        status["sftp"] = sys.modules["sftp_handler"].connection_pool.get_status()
+    return status
+
+
+def child_main():
+    """
+    Transfer process entry point. Messages arrive as JSON lines on stdin (`configure`,
+    `capture` and `job`) and events go back as JSON lines on stdout; anything else the
+    process prints goes to stderr, like the app's own logs.
+    """
+    events = os.fdopen(os.dup(1), "w", buffering=1)
+    os.dup2(2, 1)
+    sys.stdout = sys.stderr
+    emit_lock = Lock()
+
+    def emit(event):
+        with emit_lock:
+            events.write(json.dumps(event) + "\n")
+
+    jobs = queue.Queue()
+
+    def read_messages():
+        for line in sys.stdin:
+            message = json.loads(line)
+            if message["type"] == "capture":
+                # Applied at once, even while a job is uploading
+                upload_throttle.set_capture_state(message["captures"], message["last"])
+            else:
+                jobs.put(message)
+        jobs.put(None) # The app closed the pipe (shutdown or crash)
+
+    Thread(target=read_messages, name="transfer-messages", daemon=True).start()
+    while True:
+        message = jobs.get()
+        if message is None:
+            break
+        if message["type"] == "configure":
+            upload_throttle.configure(message["uploads"])
+            if message.get("nice"):
+                try:
+                    os.nice(message["nice"]) # Encryption and packetization yield to capture and previews
+                except OSError:
+                    pass
+            continue
+
+        job_id = message["id"]
+
+        def on_file_done(path, sent, deleted):
+            emit({"type": "file_done", "id": job_id, "path": path, "bytes": sent, "deleted": deleted})
+
+        try:
+            result = run_job(message["files"], message["remote_paths"], on_file_done)
+        except Exception as e:
+            print(f"[Transfer] Job failed: {e}", file=sys.stderr)
+            result = failed_result(message["files"], str(e))
+        emit({"type": "done", "id": job_id, "result": result, "status": backend_status()})
+
+
+class _Job:
+    """A job sent to one transfer process, waiting for its result."""
+    def __init__(self, process, on_file_done):
+        self.process = process # The child that owns it; only that child's exit fails it
+        self.on_file_done = on_file_done
+        self.done = Event()
+        self.result = None
+        self.active = time.time() # Sent, or last file finished
+
+
+class TransferProcess:
+    """
+    Runs uploads in a dedicated child process (`python transfer_worker.py`), so
+    paramiko's pure-Python crypto and packetization do not compete for the app's GIL
+    with the MJPEG encoders and capture handling. The child is started on first use
+    at a lower CPU priority (`nice`) and keeps the SFTP connection pool open between
+    batches.
+
+    Jobs and capture-state updates (for the child's upload throttle) go to the child
+    as JSON lines on its stdin. Results and a `file_done` event for every verified
+    upload (and local deletion) come back on its stdout. `run()` blocks the calling
+    thread until the child reports the job's result. If the child dies, its in-flight
+    jobs fail (the upload queue retries them) and the next job starts a new one. A
+    child that finishes no file for `job_timeout_s` is considered hung and killed.
+    With `process: false` jobs run in the calling thread instead.
+    """
+    def __init__(self):
+        self.enabled = True
+        self.nice = 10
+        self.job_timeout_s = 1800 # Without a finished file; raise it for very low rate limits
+        self.uploads_config = {}
+        self.command = [sys.executable, str(BASE_DIR / "transfer_worker.py")]
+        self._process = None
+        self._pending = {} # job id -> _Job
+        self._ids = itertools.count(1)
+        self._lock = Lock()
+        self._send_lock = Lock()
+        self.starts = 0
+        self.jobs_done = 0
+        self.status = {} # Latest backend status reported by the child
+
+    def configure(self, config):
+        """Applies the `uploads:` section of the system config."""
+        config = config or {}
+        self.enabled = config.get('process', True)
+        self.nice = config.get('nice', self.nice)
+        self.job_timeout_s = config.get('job_timeout_s', self.job_timeout_s)
+        self.uploads_config = config
+        upload_throttle.on_capture_change = self._forward_capture if self.enabled else None
+
+    def _send(self, process, message):
+        with self._send_lock:
+            process.stdin.write(json.dumps(message) + "\n")
+            process.stdin.flush()
+
+    def _forward_capture(self, captures, last_capture):
+        process = self._process
+        if process is not None and process.poll() is None:
+            try:
+                self._send(process, {"type": "capture", "captures": captures, "last": last_capture})
+            except (BrokenPipeError, OSError, ValueError):
+                pass # Died; the reader fails its jobs
+
+    def _start(self):
+        """Caller holds the lock."""
+        process = subprocess.Popen(
+            self.command, cwd=str(BASE_DIR),
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True, bufsize=1
+        )
+        self._send(process, {"type": "configure", "uploads": self.uploads_config, "nice": self.nice})
+        self._process = process
+        self.starts += 1
+        Thread(target=self._read_events, args=(process,), name="transfer-events", daemon=True).start()
+        print(f"[Transfer] Started transfer process (pid {process.pid}).", file=sys.stderr)
+
+    def _finish(self, job_id, result):
+        with self._lock:
+            job = self._pending.pop(job_id, None)
+        if job:
+            job.result = result
+            job.done.set()
+
+    def _read_events(self, process):
+        for line in process.stdout:
+            try:
+                event = json.loads(line)
+            except ValueError:
+                continue
+            if event["type"] == "file_done":
+                with self._lock:
+                    job = self._pending.get(event["id"])
+                if job:
+                    job.active = time.time()
+                if job and job.on_file_done:
+                    try:
+                        job.on_file_done(event["path"], event["bytes"], event["deleted"])
+                    except Exception as e:
+                        print(f"[Transfer] Progress callback failed: {e}", file=sys.stderr)
+            elif event["type"] == "done":
+                self.status = event["status"]
+                self.jobs_done += 1
+                self._finish(event["id"], event["result"])
+        # stdout closed: the child exited
+        code = process.wait()
+        with self._lock:
+            # Jobs already sent to a replacement child are not affected
+            stale = [job_id for job_id, job in self._pending.items() if job.process is process]
+            if self._process is process:
+                self._process = None
+        if stale or code:
+            print(f"[Transfer] Transfer process exited (code {code}).", file=sys.stderr)
+        for job_id in stale:
+            self._finish(job_id, None)
+
+    def run(self, files, remote_paths=None, on_file_done=None):
+        """Uploads one batch and returns the result dict of run_job() (blocks until done)."""
+        if not self.enabled:
+            return run_job(files, remote_paths, on_file_done)
+        try:
+            with self._lock:
+                if self._process is None or self._process.poll() is not None:
+                    self._start()
+                job_id = next(self._ids)
+                job = _Job(self._process, on_file_done)
+                self._pending[job_id] = job
+                self._send(job.process, {"type": "job", "id": job_id, "files": list(files),
+                                         "remote_paths": list(remote_paths or [])})
+        except (BrokenPipeError, OSError, ValueError) as e:
+            print(f"[Transfer] Cannot reach transfer process: {e}", file=sys.stderr)
+            return failed_result(files, "transfer process unavailable")
+
+        timeout = self.job_timeout_s
+        while not job.done.wait(min(5, timeout) if timeout else None):
+            if time.time() - job.active >= timeout:
+                print(f"[Transfer] No file finished for {timeout}s; killing hung transfer process (pid {job.process.pid}).", file=sys.stderr)
+                job.process.kill() # Its reader then fails this job and any other it holds
+                if not job.done.wait(10):
+                    self._finish(job_id, None)
+                break
+        if job.result is None:
+            # Lost with the child; the queue retries these files after a backoff
+            return failed_result(files, "transfer process exited")
+        return job.result
+
+    def stop(self, timeout=5):
+        with self._lock:
+            process, self._process = self._process, None
+        if process is None:
+            return
+        try:
+            process.stdin.close() # The child finishes its current job and exits
+        except OSError:
+            pass
+        try:
+            process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            process.terminate() # Mid-upload; the .part file is resumed next time
+            process.wait(1)
+
+    def get_status(self):
+        """Process state plus the backend status (batches, SFTP pool) of wherever uploads run."""
+        status = dict(self.status) if self.enabled else backend_status()
+        process = self._process
+        status["process"] = {
+            "enabled": self.enabled,
+            "running": bool(process and process.poll() is None),
+            "pid": process.pid if process else None,
+            "starts": self.starts,
+            "jobs": self.jobs_done,
+            "in_flight": len(self._pending)
+        }
+        return status
+
+
+# One transfer process for the app
+transfer_process = TransferProcess()
+
+
+if __name__ == "__main__":
+    child_main()
@@ -0,0 +1,295 @@
+import json
+import pathlib
+import random
+import sqlite3
+import sys
+import time
+from threading import Lock
+
+BASE_DIR = pathlib.Path(__file__).parent.absolute()
+UPLOAD_QUEUE_PATH = BASE_DIR / "upload_queue.db"
+DEFAULT_CAPTURE_DIR = BASE_DIR / "captures"
+
+PENDING = "pending"
+IN_FLIGHT = "in_flight"
+UPLOADED = "uploaded"
+FAILED = "failed"
+STATES = (PENDING, IN_FLIGHT, UPLOADED, FAILED)
+MAX_UPLOADED = 5000 # Finished entries kept for the status page
+RETRY_BASE_S = 60 # Queue-level retry delay after a failed batch, doubling per attempt
+RETRY_MAX_S = 3600
+
+
+def backoff_delay(attempt, base_s, max_s):
+    """Exponential backoff with jitter: half the capped delay plus a random share of the other half."""
+    delay = min(max_s, base_s * 2 ** attempt)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+class UploadQueue:
+    """
+    Durable SFTP upload queue in SQLite, so captures that are waiting for upload
+    survive a restart and are never dropped silently.
+
+    Entries move pending -> in_flight -> uploaded (or failed). Paths are stored relative
+    to `capture_dir`, like the capture index. An entry can carry `members`: the
+    captures packed into a tar shard, which are marked uploaded along with it. Entries
+    that were in flight when the app stopped go back to pending on startup, and
+    reconcile() drops entries whose files are gone and queues files that were never
+    uploaded. A failed entry goes back to pending with a growing, jittered delay
+    (`retry_at`) until it runs out of attempts.
+
+    The queue also remembers since when auto-transfer has been enabled. Files from
+    before that are backlog: reconcile() only reports them, and they are queued on
+    explicit request (queue_backlog), because uploading usually deletes the local copy.
+    """
+    def __init__(self, db_path=UPLOAD_QUEUE_PATH, capture_dir=DEFAULT_CAPTURE_DIR):
+        self.capture_dir = pathlib.Path(capture_dir)
+        self._lock = Lock()
+        self._conn = sqlite3.connect(str(db_path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS uploads ("
+            " path TEXT PRIMARY KEY,"
+            " state TEXT NOT NULL,"
+            " size INTEGER,"
+            " attempts INTEGER DEFAULT 0,"
+            " enqueued REAL,"
+            " updated REAL,"
+            " last_error TEXT,"
+            " members TEXT,"
+            " retry_at REAL DEFAULT 0)"
+        )
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(uploads)")}
+        if "retry_at" not in columns:
+            self._conn.execute("ALTER TABLE uploads ADD COLUMN retry_at REAL DEFAULT 0")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_uploads_state ON uploads (state, enqueued)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value)")
+        self._conn.commit()
+        # Anything in flight when the app stopped did not finish
+        with self._lock:
+            self._conn.execute("UPDATE uploads SET state = ? WHERE state = ?", (PENDING, IN_FLIGHT))
+            self._conn.commit()
+
+    def _rel(self, path):
+        p = pathlib.Path(path)
+        if p.is_absolute():
+            try:
+                p = p.relative_to(self.capture_dir)
+            except ValueError:
+                p = p.relative_to(self.capture_dir.resolve())
+        return p.as_posix()
+
+    def abs_path(self, rel):
+        return str(self.capture_dir / rel)
+
+    def enqueue(self, paths, members=None, sizes=None):
+        """
+        Queues files for upload (already queued or finished entries are left alone).
+        `members` maps a path to the captures packed in it; `sizes` maps a path to its size.
+        """
+        members = members or {}
+        sizes = sizes or {}
+        now = time.time()
+        rows = []
+        for path in paths:
+            size = sizes.get(path)
+            if size is None:
+                try:
+                    size = pathlib.Path(path).stat().st_size
+                except OSError:
+                    size = 0 # Still in the RAM spool or already gone; the worker checks again
+            packed = members.get(path)
+            rows.append((self._rel(path), PENDING, size, now, now,
+                         json.dumps([self._rel(m) for m in packed]) if packed else None))
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO uploads (path, state, size, enqueued, updated, members)"
+                " VALUES (?, ?, ?, ?, ?, ?)", rows
+            )
+            self._conn.commit()
+        return len(rows)
+
+    def due(self):
+        """(count, bytes, oldest enqueue time) of the pending entries that can be uploaded now."""
+        with self._lock:
+            count, size, oldest = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0), MIN(enqueued) FROM uploads WHERE state = ? AND retry_at <= ?",
+                (PENDING, time.time())
+            ).fetchone()
+        return count, size, oldest
+
+    def claim(self, limit, max_bytes=0):
+        """
+        Moves up to `limit` of the oldest pending entries that are due to in_flight and
+        returns them as dicts. With `max_bytes`, the batch stops before it would exceed
+        that size (it always holds at least one entry).
+        """
+        now = time.time()
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT path, size, attempts, enqueued, members FROM uploads WHERE state = ? AND retry_at <= ?"
+                " ORDER BY enqueued, path LIMIT ?", (PENDING, now, limit)
+            ).fetchall()
+            if max_bytes:
+                total = 0
+                for i, row in enumerate(rows):
+                    total += row[1] or 0
+                    if i and total > max_bytes:
+                        rows = rows[:i]
+                        break
+            self._conn.executemany(
+                "UPDATE uploads SET state = ?, updated = ? WHERE path = ?", [(IN_FLIGHT, now, row[0]) for row in rows]
+            )
+            self._conn.commit()
+        return [{
+            "path": self.abs_path(path),
+            "size": size,
+            "attempts": attempts,
+            "enqueued": enqueued,
+            "members": [self.abs_path(m) for m in json.loads(members)] if members else []
+        } for path, size, attempts, enqueued, members in rows]
+
+    def _set_state(self, paths, state, error=None, count_attempt=False):
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE uploads SET state = ?, updated = ?, last_error = ?,"
+                " attempts = attempts + ? WHERE path = ?",
+                [(state, now, error, 1 if count_attempt else 0, self._rel(p)) for p in paths]
+            )
+            if state == UPLOADED:
+                self._prune_uploaded()
+            self._conn.commit()
+
+    def complete(self, paths):
+        self._set_state(paths, UPLOADED, count_attempt=True)
+
+    def fail(self, paths, error=None, max_attempts=0, errors=None):
+        """
+        Records a failed attempt. Entries are retried after a backoff delay until they
+        have `max_attempts` attempts (0 retries forever), then marked failed.
+        `errors` maps a path to its own error message.
+        """
+        errors = errors or {}
+        now = time.time()
+        with self._lock:
+            for path in paths:
+                rel = self._rel(path)
+                row = self._conn.execute("SELECT attempts FROM uploads WHERE path = ?", (rel,)).fetchone()
+                if row is None:
+                    continue
+                attempts = row[0] + 1
+                if max_attempts and attempts >= max_attempts:
+                    state, retry_at = FAILED, 0
+                else:
+                    state, retry_at = PENDING, now + backoff_delay(attempts - 1, RETRY_BASE_S, RETRY_MAX_S)
+                self._conn.execute(
+                    "UPDATE uploads SET state = ?, updated = ?, last_error = ?, attempts = ?, retry_at = ? WHERE path = ?",
+                    (state, now, errors.get(path, error), attempts, retry_at, rel)
+                )
+            self._conn.commit()
+
+    def release(self, paths):
+        """Returns in-flight entries to pending without counting an attempt (e.g. uploads paused)."""
+        self._set_state(paths, PENDING)
+
+    def retry_failed(self):
+        """Puts every failed entry back in the queue. Returns how many."""
+        with self._lock:
+            count = self._conn.execute(
+                "UPDATE uploads SET state = ?, updated = ?, retry_at = 0 WHERE state = ?", (PENDING, time.time(), FAILED)
+            ).rowcount
+            self._conn.commit()
+        return count
+
+    def drop(self, paths):
+        """Forgets entries (e.g. the file was deleted before it was uploaded)."""
+        with self._lock:
+            self._conn.executemany("DELETE FROM uploads WHERE path = ?", [(self._rel(p),) for p in paths])
+            self._conn.commit()
+
+    def _prune_uploaded(self):
+        """Caller holds the lock."""
+        row = self._conn.execute(
+            "SELECT updated FROM uploads WHERE state = ? ORDER BY updated DESC LIMIT 1 OFFSET ?",
+            (UPLOADED, MAX_UPLOADED)
+        ).fetchone()
+        if row:
+            self._conn.execute("DELETE FROM uploads WHERE state = ? AND updated <= ?", (UPLOADED, row[0]))
+
+    def paths(self, states=(PENDING, IN_FLIGHT, FAILED)):
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT path FROM uploads WHERE state IN ({','.join('?' * len(states))})", states
+            ).fetchall()
+        return [self.abs_path(row[0]) for row in rows]
+
+    def enabled_since(self):
+        """When auto-transfer was (last) enabled, or None while it is off."""
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = 'enabled_since'").fetchone()
+        return row[0] if row else None
+
+    def set_enabled(self, enabled):
+        """Records auto-transfer being switched on (keeping an earlier start) or off."""
+        with self._lock:
+            if enabled:
+                self._conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('enabled_since', ?)", (time.time(),))
+            else:
+                self._conn.execute("DELETE FROM meta WHERE key = 'enabled_since'")
+            self._conn.commit()
+
+    def unqueued(self, paths):
+        """The paths that have no queue entry."""
+        with self._lock:
+            known = {row[0] for row in self._conn.execute("SELECT path FROM uploads")}
+        return [p for p in paths if self._rel(p) not in known]
+
+    def reconcile(self, exists, candidates=(), backlog=()):
+        """
+        Startup sync with the disk: drops unfinished entries whose file no longer
+        exists (`exists(path)` decides, e.g. also looking in the spool) and queues
+        `candidates`, the files that should be uploaded but were never queued (e.g. a
+        crash right after capture). `backlog` (files from before auto-transfer was
+        enabled) is only counted. Returns (dropped, added, backlog not queued).
+        """
+        gone = [p for p in self.paths() if not exists(p)]
+        if gone:
+            self.drop(gone)
+        added = self.unqueued(candidates)
+        if added:
+            self.enqueue(added)
+        waiting = len(self.unqueued(backlog))
+        if gone or added:
+            print(f"[Uploads] Reconciled queue with disk: {len(gone)} missing file(s) dropped, {len(added)} file(s) queued.", file=sys.stderr)
+        if waiting:
+            print(f"[Uploads] {waiting} file(s) from before auto-transfer was enabled are not queued. "
+                  "POST /api/uploads/backlog to upload them (they are deleted locally if delete_after_upload is on).", file=sys.stderr)
+        return len(gone), len(added), waiting
+
+    def get_status(self):
+        with self._lock:
+            counts = dict(self._conn.execute("SELECT state, COUNT(*) FROM uploads GROUP BY state"))
+            pending_bytes, oldest = self._conn.execute(
+                "SELECT COALESCE(SUM(size), 0), MIN(enqueued) FROM uploads WHERE state = ?", (PENDING,)
+            ).fetchone()
+            waiting = self._conn.execute(
+                "SELECT COUNT(*) FROM uploads WHERE state = ? AND retry_at > ?", (PENDING, time.time())
+            ).fetchone()[0]
+            failed = self._conn.execute(
+                "SELECT path, attempts, last_error FROM uploads WHERE last_error IS NOT NULL AND state != ?"
+                " ORDER BY updated DESC LIMIT 20", (UPLOADED,)
+            ).fetchall()
+        return {
+            "counts": {state: counts.get(state, 0) for state in STATES},
+            "pending_bytes": pending_bytes,
+            "oldest_pending_age_s": round(time.time() - oldest, 1) if oldest else None,
+            "waiting_retry": waiting,
+            "recent_failures": [{"path": p, "attempts": a, "error": e} for p, a, e in failed]
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
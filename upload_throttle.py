@@ -0,0 +1,192 @@
+import sys
+import time
+from datetime import datetime
+from threading import Lock
+
+KB = 1024
+
+
+def parse_window(text):
+    """'22:00-06:00' -> (start, end) in minutes after midnight. A window may cross midnight."""
+    start, end = text.split("-")
+    minutes = []
+    for part in (start, end):
+        hours, mins = part.strip().split(":")
+        minutes.append(int(hours) * 60 + int(mins))
+    return tuple(minutes)
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket in bytes per second, shared by all upload channels.
+    `consume(n)` takes n tokens and blocks until the bucket is out of debt, so the
+    combined throughput of every caller stays at the rate. A rate of 0 means unlimited.
+    """
+    def __init__(self, rate=0, burst_s=1.0):
+        self.rate = rate
+        self.burst_s = burst_s
+        self._tokens = rate * burst_s
+        self._last = time.monotonic()
+        self._lock = Lock()
+
+    def _refill(self):
+        """Caller holds the lock."""
+        now = time.monotonic()
+        if self.rate:
+            self._tokens = min(self.rate * self.burst_s, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def set_rate(self, rate):
+        with self._lock:
+            self._refill()
+            self.rate = rate
+
+    def consume(self, n, rate_fn=None):
+        """
+        Takes `n` tokens, sleeping while the bucket is in debt. `rate_fn` is called
+        between sleeps so a rate change (e.g. a capture ending) applies to waiting callers.
+        """
+        with self._lock:
+            self._refill()
+            self._tokens -= n
+        while True:
+            if rate_fn:
+                self.set_rate(rate_fn())
+            with self._lock:
+                self._refill()
+                if not self.rate:
+                    self._tokens = max(self._tokens, 0) # Unlimited; forget the debt
+                    return
+                deficit = -self._tokens
+            if deficit <= 0:
+                return
+            time.sleep(min(0.5, deficit / self.rate))
+
+
+class UploadThrottle:
+    """
+    Decides how fast uploads may go, so they do not starve previews, MQTT and captures
+    on a shared uplink and CPU.
+
+    The rate is the lowest of the limits that apply right now: `rate_kb_s` always,
+    `capture_rate_kb_s` while a capture is running (and for `capture_grace_s` after,
+    which keeps interval captures covered), and `hot_rate_kb_s` while the CPU is at or
+    above `temp_limit_c`. A limit of 0 does not apply. `windows` (e.g. ["22:00-06:00"])
+    restricts when new upload batches start; with none, uploads run at any time.
+    """
+    def __init__(self):
+        self.rate_kb_s = 0
+        self.capture_rate_kb_s = 0
+        self.capture_grace_s = 5
+        self.temp_limit_c = 0
+        self.hot_rate_kb_s = 0
+        self.windows = []
+        self.bucket = TokenBucket()
+        self._captures = 0 # Captures in progress
+        self._last_capture = 0.0 # When the last one started or finished
+        self.on_capture_change = None # Called with (captures, last_capture), e.g. to tell the transfer process
+        self._temp = None
+        self._temp_checked = 0.0
+        self._lock = Lock()
+        self.reason = None # Why the current rate applies
+
+    def configure(self, config):
+        """Applies the `uploads:` section of the system config."""
+        config = config or {}
+        self.rate_kb_s = config.get('rate_kb_s', 0) or 0
+        self.capture_rate_kb_s = config.get('capture_rate_kb_s', 0) or 0
+        self.capture_grace_s = config.get('capture_grace_s', self.capture_grace_s)
+        self.temp_limit_c = config.get('temp_limit_c', 0) or 0
+        self.hot_rate_kb_s = config.get('hot_rate_kb_s', 0) or 0
+        self.windows = []
+        for window in config.get('windows', []) or []:
+            try:
+                self.windows.append(parse_window(window))
+            except ValueError:
+                print(f"[Uploads] Ignoring invalid upload window '{window}' (expected HH:MM-HH:MM).", file=sys.stderr)
+        self.bucket.set_rate(self.current_rate())
+
+    def capture_started(self):
+        with self._lock:
+            self._captures += 1
+            self._last_capture = time.time()
+        self._capture_changed()
+
+    def capture_finished(self):
+        with self._lock:
+            self._captures = max(0, self._captures - 1)
+            self._last_capture = time.time()
+        self._capture_changed()
+
+    def _capture_changed(self):
+        if self.on_capture_change:
+            try:
+                self.on_capture_change(self._captures, self._last_capture)
+            except Exception as e:
+                print(f"[Uploads] Failed to forward capture state: {e}", file=sys.stderr)
+
+    def set_capture_state(self, captures, last_capture):
+        """Capture state reported by another process (the app, for the transfer process)."""
+        with self._lock:
+            self._captures = captures
+            self._last_capture = last_capture
+
+    def capturing(self):
+        with self._lock:
+            return self._captures > 0 or time.time() - self._last_capture < self.capture_grace_s
+
+    def cpu_temp(self):
+        """CPU temperature, read at most every 10 seconds."""
+        if self.temp_limit_c and time.time() - self._temp_checked >= 10:
+            from system_monitor import get_cpu_temp
+            self._temp = get_cpu_temp()
+            self._temp_checked = time.time()
+        return self._temp
+
+    def current_rate(self):
+        """Allowed upload rate in bytes/s right now (0 = unlimited)."""
+        limits = []
+        if self.rate_kb_s:
+            limits.append((self.rate_kb_s, "rate limit"))
+        if self.capture_rate_kb_s and self.capturing():
+            limits.append((self.capture_rate_kb_s, "capture running"))
+        temp = self.cpu_temp()
+        if self.temp_limit_c and self.hot_rate_kb_s and temp is not None and temp >= self.temp_limit_c:
+            limits.append((self.hot_rate_kb_s, f"CPU at {temp}C"))
+        if not limits:
+            self.reason = None
+            return 0
+        rate, self.reason = min(limits)
+        return rate * KB
+
+    def consume(self, n):
+        """Blocks until `n` more bytes may be sent."""
+        self.bucket.consume(n, self.current_rate)
+
+    def in_window(self, now=None):
+        """Whether new upload batches may start now."""
+        if not self.windows:
+            return True
+        now = now or datetime.now()
+        minute = now.hour * 60 + now.minute
+        for start, end in self.windows:
+            if start <= end and start <= minute < end:
+                return True
+            if start > end and (minute >= start or minute < end): # Crosses midnight
+                return True
+        return False
+
+    def get_status(self):
+        rate = self.current_rate()
+        return {
+            "rate_kb_s": round(rate / KB, 1) if rate else None,
+            "reason": self.reason,
+            "in_window": self.in_window(),
+            "windows": [f"{s // 60:02d}:{s % 60:02d}-{e // 60:02d}:{e % 60:02d}" for s, e in self.windows],
+            "capturing": self.capturing(),
+            "cpu_temp": self._temp
+        }
+
+
+# Shared by every upload channel so the limit covers their combined throughput
+upload_throttle = UploadThrottle()